@@ -0,0 +1,8 @@
+"""
+离线性能基准测试
+
+- mock_ai_builder: 本地模拟的 AI Builder 上游（chat completions + search）
+- run_bench: 在给定并发级别下驱动真实的 app，输出可比较的 JSON 基线
+
+用法见 README.md 的「性能基准测试」一节。
+"""
@@ -0,0 +1,215 @@
+"""
+模拟的 AI Builder 上游
+
+实现 /v1/chat/completions（支持 stream）和 /v1/search/，行为由 profile 控制：
+- 延迟分布：fixed:50 / uniform:20:80 / lognormal:50:0.5（中位数 ms, sigma）/ exp:50（均值 ms）
+- 工具调用模式：每个对话的工具轮数（例如 0-3）和每轮并行调用数（例如 1-5），
+  按第一条用户消息确定性地选取，同一个对话在重试和对比时行为一致
+- 错误率：chat / search 分别按概率返回 error_status
+- 关键词池大小：决定搜索缓存的命中率
+
+profile 通过环境变量 BENCH_MOCK_PROFILE（JSON）传入：
+
+    BENCH_MOCK_PROFILE='{"rounds": "1-2"}' uvicorn bench.mock_ai_builder:app --port 18001
+"""
+import asyncio
+import json
+import os
+import random
+import time
+import zlib
+from typing import Any, Callable, Dict, List, Tuple
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+DEFAULT_PROFILE: Dict[str, Any] = {
+    "chat_latency": "lognormal:400:0.4",
+    "search_latency": "lognormal:300:0.5",
+    # 流式模式下相邻 token 之间的间隔
+    "token_interval": "fixed:5",
+    "rounds": "0-3",
+    "parallel": "1-5",
+    "keywords_per_call": "1-3",
+    "keyword_pool": 500,
+    "answer_words": 60,
+    "chat_error_rate": 0.0,
+    "search_error_rate": 0.0,
+    "error_status": 503,
+}
+
+WORDS = (
+    "fastapi python async server latency cache search agent model token stream "
+    "request response upstream client pool timeout retry budget circuit vector index "
+    "benchmark throughput memory worker event loop schedule result source answer"
+).split()
+
+
+def parse_range(spec: Any) -> Tuple[int, int]:
+    """解析 "1-5" 或 3 形式的整数范围"""
+    low, _, high = str(spec).partition("-")
+    return int(low), int(high or low)
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """
+    解析延迟分布，返回采样函数（秒）
+
+    Raises:
+        ValueError: 不支持的分布
+    """
+    kind, *params = spec.split(":")
+    values = [float(param) for param in params]
+    if kind == "fixed":
+        return lambda rng: values[0] / 1000
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1]) / 1000
+    if kind == "lognormal":
+        median, sigma = values[0], values[1] if len(values) > 1 else 0.5
+        return lambda rng: median * rng.lognormvariate(0, sigma) / 1000
+    if kind == "exp":
+        return lambda rng: rng.expovariate(1 / values[0]) / 1000
+    raise ValueError(f"不支持的延迟分布: {spec}")
+
+
+def load_profile() -> Dict[str, Any]:
+    profile = dict(DEFAULT_PROFILE)
+    profile.update(json.loads(os.getenv("BENCH_MOCK_PROFILE") or "{}"))
+    return profile
+
+
+PROFILE = load_profile()
+CHAT_LATENCY = parse_latency(PROFILE["chat_latency"])
+SEARCH_LATENCY = parse_latency(PROFILE["search_latency"])
+TOKEN_INTERVAL = parse_latency(PROFILE["token_interval"])
+
+COUNTS: Dict[str, int] = {}
+_rng = random.Random()
+
+app = FastAPI(title="Mock AI Builder")
+
+
+def reset_counts() -> None:
+    COUNTS.update({
+        "chat": 0, "chat_stream": 0, "chat_errors": 0,
+        "search": 0, "search_errors": 0, "keywords": 0,
+    })
+
+
+reset_counts()
+
+
+def _conversation_rng(messages: List[Dict[str, Any]], salt: str) -> random.Random:
+    first_user = next((m.get("content") or "" for m in messages if m.get("role") == "user"), "")
+    return random.Random(zlib.crc32(f"{first_user}|{salt}".encode("utf-8")))
+
+
+def _completion_message(body: Dict[str, Any]) -> Tuple[Dict[str, Any], str]:
+    messages = body.get("messages") or []
+    rounds_done = sum(1 for m in messages if m.get("role") == "assistant" and m.get("tool_calls"))
+    rounds = _conversation_rng(messages, "rounds").randint(*parse_range(PROFILE["rounds"]))
+
+    if body.get("tools") and rounds_done < rounds:
+        rng = _conversation_rng(messages, f"round{rounds_done}")
+        tool_calls = []
+        for index in range(rng.randint(*parse_range(PROFILE["parallel"]))):
+            keywords = [
+                f"topic {rng.randrange(PROFILE['keyword_pool'])}"
+                for _ in range(rng.randint(*parse_range(PROFILE["keywords_per_call"])))
+            ]
+            tool_calls.append({
+                "id": f"call_{rounds_done}_{index}_{rng.randrange(10 ** 6)}",
+                "type": "function",
+                "function": {"name": "search_web", "arguments": json.dumps({"keywords": keywords})}
+            })
+        return {"role": "assistant", "content": None, "tool_calls": tool_calls}, "tool_calls"
+
+    rng = _conversation_rng(messages, "answer")
+    answer = " ".join(rng.choice(WORDS) for _ in range(PROFILE["answer_words"]))
+    return {"role": "assistant", "content": answer}, "stop"
+
+
+def _error_response(kind: str) -> JSONResponse:
+    COUNTS[f"{kind}_errors"] += 1
+    return JSONResponse({"detail": "mock upstream error"}, status_code=PROFILE["error_status"])
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    COUNTS["chat"] += 1
+    await asyncio.sleep(CHAT_LATENCY(_rng))
+    if _rng.random() < PROFILE["chat_error_rate"]:
+        return _error_response("chat")
+
+    message, finish_reason = _completion_message(body)
+    usage = {"prompt_tokens": sum(len(m.get("content") or "") for m in body.get("messages") or []) // 4,
+             "completion_tokens": PROFILE["answer_words"] if finish_reason == "stop" else 20}
+    usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+    if not body.get("stream"):
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model"),
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": usage,
+        }
+
+    COUNTS["chat_stream"] += 1
+
+    async def events():
+        def chunk(delta: Dict[str, Any], finish: Any = None, **extra: Any) -> str:
+            data = {"id": "chatcmpl-mock", "model": body.get("model"),
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish}], **extra}
+            return f"data: {json.dumps(data)}\n\n"
+
+        for index, tool_call in enumerate(message.get("tool_calls") or []):
+            yield chunk({"tool_calls": [{"index": index, "id": tool_call["id"], "type": "function",
+                                         "function": {"name": "search_web", "arguments": ""}}]})
+            yield chunk({"tool_calls": [{"index": index,
+                                         "function": {"arguments": tool_call["function"]["arguments"]}}]})
+        for word in (message.get("content") or "").split():
+            await asyncio.sleep(TOKEN_INTERVAL(_rng))
+            yield chunk({"content": word + " "})
+        yield chunk({}, finish_reason, usage=usage)
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.post("/v1/search/")
+async def search(request: Request):
+    body = await request.json()
+    COUNTS["search"] += 1
+    keywords = body.get("keywords") or []
+    COUNTS["keywords"] += len(keywords)
+    await asyncio.sleep(SEARCH_LATENCY(_rng))
+    if _rng.random() < PROFILE["search_error_rate"]:
+        return _error_response("search")
+
+    queries = []
+    for keyword in keywords:
+        rng = random.Random(zlib.crc32(keyword.encode("utf-8")))
+        results = []
+        for index in range(body.get("max_results", 6)):
+            results.append({
+                "title": f"{keyword} - result {index}",
+                "url": f"https://example.com/{keyword.replace(' ', '-')}/{index}",
+                "content": " ".join(rng.choice(WORDS) for _ in range(80)),
+                "score": round(0.95 - index * 0.1, 2),
+            })
+        queries.append({"keyword": keyword, "response": {"results": results, "answer": None}})
+    return {"queries": queries, "combined_answer": None, "errors": None}
+
+
+@app.get("/counts")
+async def counts():
+    return COUNTS
+
+
+@app.post("/reset")
+async def reset():
+    reset_counts()
+    return COUNTS
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Agentic Loop 离线基准测试
+
+在子进程中启动模拟的 AI Builder（bench/mock_ai_builder.py），
+通过 ASGI 传输在进程内驱动真实的 main.app（包括 lifespan），
+在每个并发级别下统计延迟分位数、RPS、内存和上游调用次数，结果写入 JSON。
+
+示例：
+    python -m bench.run_bench --levels 1,8,32 --requests 200 --output bench/baseline.json
+    python -m bench.run_bench --rounds 1-3 --parallel 3 --chat-error-rate 0.02 --stream
+    python -m bench.run_bench --compare bench/baseline.json --output bench/current.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from bench.mock_ai_builder import DEFAULT_PROFILE
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 对比时参与回归判断的指标：(路径, 越大越好)
+COMPARED_METRICS = [
+    (("latency_ms", "p50"), False),
+    (("latency_ms", "p95"), False),
+    (("latency_ms", "p99"), False),
+    (("rps",), True),
+]
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """最近秩法计算分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1))]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def max_rss_mb() -> float:
+    """当前进程的峰值常驻内存（MB）"""
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return round(usage / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def current_rss_mb() -> Optional[float]:
+    try:
+        with open("/proc/self/statm") as f:
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+    except (OSError, ValueError):
+        return None
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def start_mock(port: int, profile: Dict[str, Any]) -> subprocess.Popen:
+    """启动模拟上游并等待就绪"""
+    env = dict(os.environ, BENCH_MOCK_PROFILE=json.dumps(profile))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "bench.mock_ai_builder:app",
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning", "--no-access-log"],
+        cwd=REPO_ROOT, env=env
+    )
+    deadline = time.monotonic() + 20
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("模拟上游启动失败")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/counts", timeout=0.5)
+            return process
+        except httpx.TransportError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("模拟上游启动超时")
+
+
+def build_payload(index: int, args: argparse.Namespace) -> Dict[str, Any]:
+    # 第一条用户消息决定模拟上游为这个对话选择的工具调用模式
+    return {
+        "messages": [{"role": "user", "content": f"bench question #{index} (seed {args.seed})"}],
+        "model": args.model,
+        "stream": args.stream,
+    }
+
+
+async def run_level(client: httpx.AsyncClient, mock: httpx.AsyncClient, concurrency: int,
+                    args: argparse.Namespace, offset: int) -> Dict[str, Any]:
+    """在一个并发级别下发送 args.requests 个请求"""
+    await mock.post("/reset")
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    next_index = 0
+
+    async def worker() -> None:
+        nonlocal next_index
+        while next_index < args.requests:
+            index = offset + next_index
+            next_index += 1
+            started = time.perf_counter()
+            try:
+                response = await client.post("/chat", json=build_payload(index, args))
+                status = str(response.status_code)
+                # 流式模式下错误以 error 事件返回，状态码仍为 200
+                if args.stream and "event: error" in response.text:
+                    status = "stream_error"
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append((time.perf_counter() - started) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "ok": statuses.get("200", 0),
+        "statuses": statuses,
+        "duration_s": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50), 2),
+            "p95": round(percentile(latencies, 0.95), 2),
+            "p99": round(percentile(latencies, 0.99), 2),
+            "mean": round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+            "max": round(max(latencies), 2) if latencies else 0.0,
+        },
+        "memory_mb": {"rss": current_rss_mb(), "max_rss": max_rss_mb()},
+        "upstream": (await mock.get("/counts")).json(),
+    }
+
+
+async def run(args: argparse.Namespace, mock_url: str) -> List[Dict[str, Any]]:
+    # main 在导入时读取上游地址和 token
+    os.environ["AI_BUILDER_BASE_URL"] = mock_url
+    os.environ.setdefault("AI_BUILDER_TOKEN", "bench-token")
+    os.chdir(REPO_ROOT)
+    sys.path.insert(0, REPO_ROOT)
+    import logging
+    import main
+
+    if not args.verbose:
+        logging.getLogger("main").setLevel(logging.WARNING)
+
+    results = []
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client, \
+                httpx.AsyncClient(base_url=mock_url) as mock:
+            if args.warmup:
+                await run_level(client, mock, min(args.warmup, 4), argparse.Namespace(
+                    **dict(vars(args), requests=args.warmup)), offset=10 ** 6)
+            offset = 0
+            for concurrency in args.levels:
+                level = await run_level(client, mock, concurrency, args, offset)
+                offset += args.requests
+                results.append(level)
+                print(
+                    f"并发 {concurrency:>4}: {level['rps']:>8.2f} req/s  "
+                    f"p50 {level['latency_ms']['p50']:>8.1f}ms  p95 {level['latency_ms']['p95']:>8.1f}ms  "
+                    f"p99 {level['latency_ms']['p99']:>8.1f}ms  状态 {level['statuses']}  "
+                    f"上游 chat={level['upstream']['chat']} search={level['upstream']['search']}",
+                    file=sys.stderr
+                )
+    return results
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> bool:
+    """
+    打印与基线的对比，返回是否存在超过阈值的回归
+    """
+    regressed = False
+    baseline_levels = {level["concurrency"]: level for level in baseline.get("levels", [])}
+    print(f"\n与基线对比（基线 commit: {baseline.get('meta', {}).get('commit')}，阈值 {threshold:.0%}）：", file=sys.stderr)
+    for level in current["levels"]:
+        base = baseline_levels.get(level["concurrency"])
+        if base is None:
+            print(f"  并发 {level['concurrency']}: 基线中没有该级别", file=sys.stderr)
+            continue
+        parts = []
+        for path, higher_is_better in COMPARED_METRICS:
+            new_value, old_value = level, base
+            for key in path:
+                new_value, old_value = new_value[key], old_value[key]
+            change = (new_value - old_value) / old_value if old_value else 0.0
+            worse = -change if higher_is_better else change
+            flag = ""
+            if worse > threshold:
+                regressed = True
+                flag = " ✗"
+            parts.append(f"{'.'.join(path)} {old_value} → {new_value} ({change:+.1%}){flag}")
+        print(f"  并发 {level['concurrency']}: " + "，".join(parts), file=sys.stderr)
+    return regressed
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Agentic Loop 离线基准测试")
+    parser.add_argument("--levels", default="1,8,32", help="并发级别，逗号分隔（默认 1,8,32）")
+    parser.add_argument("--requests", type=int, default=100, help="每个并发级别的请求数（默认 100）")
+    parser.add_argument("--warmup", type=int, default=5, help="预热请求数，不计入结果（默认 5）")
+    parser.add_argument("--stream", action="store_true", help="使用流式模式（SSE）请求 /chat")
+    parser.add_argument("--model", default="gpt-5")
+    parser.add_argument("--seed", type=int, default=0, help="对话种子，决定每个请求的工具调用模式")
+    parser.add_argument("--profile", help="模拟上游 profile 的 JSON 文件")
+    parser.add_argument("--chat-latency", help="chat 延迟分布，例如 lognormal:400:0.4")
+    parser.add_argument("--search-latency", help="search 延迟分布，例如 uniform:100:500")
+    parser.add_argument("--rounds", help="每个对话的工具轮数范围，例如 0-3")
+    parser.add_argument("--parallel", help="每轮并行工具调用数范围，例如 1-5")
+    parser.add_argument("--keyword-pool", type=int, help="关键词池大小（越小缓存命中率越高）")
+    parser.add_argument("--chat-error-rate", type=float)
+    parser.add_argument("--search-error-rate", type=float)
+    parser.add_argument("--output", help="结果 JSON 文件（默认输出到标准输出）")
+    parser.add_argument("--compare", help="基线 JSON 文件，输出对比结果")
+    parser.add_argument("--threshold", type=float, default=0.1, help="判定回归的相对变化阈值（默认 0.1）")
+    parser.add_argument("--verbose", action="store_true", help="保留应用的 INFO 日志")
+    args = parser.parse_args(argv)
+    args.levels = [int(level) for level in args.levels.split(",") if level.strip()]
+    return args
+
+
+def build_profile(args: argparse.Namespace) -> Dict[str, Any]:
+    profile: Dict[str, Any] = {}
+    if args.profile:
+        with open(args.profile) as f:
+            profile.update(json.load(f))
+    overrides = {
+        "chat_latency": args.chat_latency,
+        "search_latency": args.search_latency,
+        "rounds": args.rounds,
+        "parallel": args.parallel,
+        "keyword_pool": args.keyword_pool,
+        "chat_error_rate": args.chat_error_rate,
+        "search_error_rate": args.search_error_rate,
+    }
+    profile.update({key: value for key, value in overrides.items() if value is not None})
+    return profile
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    profile = build_profile(args)
+    port = free_port()
+    mock = start_mock(port, profile)
+    try:
+        levels = asyncio.run(run(args, f"http://127.0.0.1:{port}"))
+    finally:
+        mock.terminate()
+        mock.wait(timeout=10)
+
+    result = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "stream": args.stream,
+            "requests_per_level": args.requests,
+            "seed": args.seed,
+            "profile": dict(DEFAULT_PROFILE, **profile),
+        },
+        "levels": levels,
+    }
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+        print(f"结果已写入 {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(result, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+冷启动基准测试
+
+每次在新的 Python 子进程中导入 main（模拟 serverless 冷启动），测量：
+- 进程总耗时（解释器启动 + 导入 + 请求）
+- import main 耗时
+- lifespan 启动耗时
+- 每个路径的首个请求延迟（直接调用 ASGI 应用，不经过网络）
+- 首个请求后 httpx 是否已真正加载
+
+分别在 FAST_START=0 和 FAST_START=1 下运行，输出各指标的中位数和最小值（JSON）。
+
+示例：
+    python -m bench.startup_bench --runs 10
+    python -m bench.startup_bench --paths /,/hello --output bench/startup.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = ("0", "1")
+
+
+async def _get(app, path: str) -> int:
+    """直接调用 ASGI 应用发送一个 GET 请求，返回状态码"""
+    raw_path, _, query = path.partition("?")
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": raw_path, "raw_path": raw_path.encode(), "query_string": query.encode(),
+        "root_path": "", "headers": [(b"host", b"localhost"), (b"accept-encoding", b"gzip")],
+        "client": ("127.0.0.1", 0), "server": ("localhost", 80),
+    }
+    status = 0
+
+    async def receive() -> Dict[str, Any]:
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message: Dict[str, Any]) -> None:
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+
+def child(paths: List[str]) -> None:
+    """子进程：测量导入和首个请求，结果以一行 JSON 输出"""
+    started = time.perf_counter()
+    import main
+    imported = time.perf_counter()
+
+    async def run() -> Dict[str, Any]:
+        result: Dict[str, Any] = {"import_ms": (imported - started) * 1000, "requests": {}}
+        t0 = time.perf_counter()
+        async with main.app.router.lifespan_context(main.app):
+            result["lifespan_ms"] = (time.perf_counter() - t0) * 1000
+            for path in paths:
+                t0 = time.perf_counter()
+                status = await _get(main.app, path)
+                result["requests"][path] = {"status": status, "ms": (time.perf_counter() - t0) * 1000}
+            result["httpx_loaded"] = type(sys.modules.get("httpx")).__name__ == "module"
+        return result
+
+    print(json.dumps(asyncio.run(run())))
+
+
+def run_once(fast_start: str, paths: List[str]) -> Dict[str, Any]:
+    env = dict(os.environ, FAST_START=fast_start)
+    started = time.perf_counter()
+    output = subprocess.check_output(
+        [sys.executable, "-W", "ignore", "-m", "bench.startup_bench", "--child", ",".join(paths)],
+        cwd=REPO_ROOT, env=env, stderr=subprocess.DEVNULL, text=True,
+    )
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process_ms"] = (time.perf_counter() - started) * 1000
+    return result
+
+
+def summarize(runs: List[Dict[str, Any]], paths: List[str]) -> Dict[str, Any]:
+    def stats(values: List[float]) -> Dict[str, float]:
+        return {"median": round(statistics.median(values), 1), "min": round(min(values), 1)}
+
+    return {
+        "process_ms": stats([run["process_ms"] for run in runs]),
+        "import_ms": stats([run["import_ms"] for run in runs]),
+        "lifespan_ms": stats([run["lifespan_ms"] for run in runs]),
+        "first_request_ms": {path: stats([run["requests"][path]["ms"] for run in runs]) for path in paths},
+        "status": {path: runs[-1]["requests"][path]["status"] for path in paths},
+        "httpx_loaded": runs[-1]["httpx_loaded"],
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="冷启动基准测试")
+    parser.add_argument("--runs", type=int, default=5, help="每种模式的子进程次数（默认 5）")
+    parser.add_argument("--paths", default="/,/hello", help="首个请求的路径，逗号分隔，按顺序请求（默认 /,/hello）")
+    parser.add_argument("--output", help="结果 JSON 文件（默认输出到标准输出）")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    if args.child is not None:
+        child([path for path in args.child.split(",") if path])
+        return 0
+
+    # 子进程不能导入 run_bench：它会在 main 之前导入 httpx
+    from bench.run_bench import git_commit
+
+    paths = [path for path in args.paths.split(",") if path]
+    # 预先编译字节码，避免第一次运行计入编译时间
+    run_once(MODES[0], paths)
+    modes = {}
+    for fast_start in MODES:
+        runs = [run_once(fast_start, paths) for _ in range(args.runs)]
+        modes[f"FAST_START={fast_start}"] = summarize(runs, paths)
+        print(f"FAST_START={fast_start}: import {modes[f'FAST_START={fast_start}']['import_ms']['median']}ms",
+              file=sys.stderr)
+
+    result = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "runs": args.runs,
+        },
+        "modes": modes,
+    }
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+        print(f"结果已写入 {args.output}", file=sys.stderr)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,411 @@
+"""
+缓存后端
+
+CacheBackend: 缓存接口（get / set / delete / clear / stats），搜索缓存和 /chat 响应缓存都通过它读写。
+
+- TTLCache（memory）：进程内缓存，带过期时间（TTL）、LRU 淘汰和字节数上限，并统计命中率。
+  只在事件循环线程中访问，不需要加锁。每个 worker 进程各有一份。
+- SQLiteCache（sqlite）：本机文件缓存，同一台机器上的所有 worker 共享（uvicorn --workers N）。
+  WAL 模式下读写互不阻塞，读取走 mmap；值用紧凑 JSON + zlib 压缩存储，
+  按过期时间和总字节数淘汰。
+
+配置（环境变量）：
+- CACHE_BACKEND: memory（默认）或 sqlite
+- CACHE_SQLITE_PATH: SQLite 文件路径，默认为系统临时目录下的 ai-chat-cache.sqlite3
+- CACHE_SQLITE_BUSY_TIMEOUT_MS: 数据库被其他 worker 锁住时的最长等待毫秒数，默认 5。
+  查询在事件循环线程中执行，等待期间整个 worker 都被阻塞，因此只等几毫秒，超时按未命中处理
+"""
+import json
+import logging
+import os
+import tempfile
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+import startup
+from config import env_float
+
+# 只有 SQLite 后端用到；FAST_START 模式下首次使用时才加载
+sqlite3 = startup.import_module("sqlite3")
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SQLITE_PATH = os.path.join(tempfile.gettempdir(), "ai-chat-cache.sqlite3")
+DEFAULT_SQLITE_BUSY_TIMEOUT = 0.005
+
+
+def json_size(value: Any) -> int:
+    """按 JSON 序列化后的字节数估算缓存项大小"""
+    return len(json.dumps(value, ensure_ascii=False, default=str).encode("utf-8"))
+
+
+class Codec:
+    """文件缓存的值编码方式（进程内缓存直接保存对象，不需要编码）"""
+
+    def encode(self, value: Any) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, data: bytes) -> Any:
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+    """紧凑 JSON + zlib 压缩"""
+
+    def __init__(self, level: int = 1):
+        self.level = level
+
+    def encode(self, value: Any) -> bytes:
+        data = json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+        return zlib.compress(data, self.level)
+
+    def decode(self, data: bytes) -> Any:
+        return json.loads(zlib.decompress(data))
+
+
+JSON_CODEC = JsonCodec()
+
+
+class CacheBackend:
+    """缓存接口"""
+
+    backend = ""
+
+    @property
+    def enabled(self) -> bool:
+        raise NotImplementedError
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """读取缓存，未命中或已过期时返回 None"""
+        raise NotImplementedError
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """写入缓存（ttl 为 None 时使用默认有效期）"""
+        raise NotImplementedError
+
+    def delete(self, key: Hashable) -> None:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+
+class TTLCache(CacheBackend):
+    """
+    TTL + LRU 缓存
+
+    - 每个条目有过期时间，读取时惰性清理
+    - 条目数或总字节数超限时淘汰最久未使用的条目
+    - 统计 hits / misses / evictions / expirations
+    """
+
+    backend = "memory"
+
+    def __init__(
+        self,
+        max_entries: int,
+        max_bytes: int,
+        ttl: float,
+        sizeof: Callable[[Any], int] = json_size,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._sizeof = sizeof
+        # key -> (value, expires_at, size)
+        self._entries: "OrderedDict[Hashable, Tuple[Any, float, int]]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0 and self.max_bytes > 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """读取缓存，未命中或已过期时返回 None"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires_at, _ = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """写入缓存；单个条目超过字节上限时不缓存"""
+        if not self.enabled:
+            return
+        size = self._sizeof(value)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._entries[key] = (value, expires_at, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def delete(self, key: Hashable) -> None:
+        if key in self._entries:
+            self._remove(key)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+    def _remove(self, key: Hashable) -> None:
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self) -> Dict[str, Any]:
+        """返回缓存统计信息"""
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class SQLiteCache(CacheBackend):
+    """
+    SQLite 文件缓存（同一台机器上的 worker 进程共享）
+
+    - 多个缓存通过 namespace 共用一个文件
+    - 读取不写数据库：淘汰顺序按过期时间（先写入的先淘汰），而不是严格的 LRU
+    - 每写入 evict_interval 次检查一次条目数和总字节数，超限时淘汰最早过期的条目
+    - 数据库出错（包括等待锁超过 busy_timeout 秒）或值无法解码时按未命中处理，不影响请求
+    """
+
+    backend = "sqlite"
+
+    def __init__(
+        self,
+        namespace: str,
+        max_entries: int,
+        max_bytes: int,
+        ttl: float,
+        path: str = DEFAULT_SQLITE_PATH,
+        codec: Codec = JSON_CODEC,
+        evict_interval: int = 64,
+        busy_timeout: float = DEFAULT_SQLITE_BUSY_TIMEOUT,
+    ):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.path = path
+        self._codec = codec
+        self._evict_interval = evict_interval
+        self._busy_timeout = busy_timeout
+        self._writes = 0
+        self._db: Optional["sqlite3.Connection"] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0 and self.max_bytes > 0
+
+    def _connect(self) -> "sqlite3.Connection":
+        # 首次使用时连接（每个 worker 进程一个连接，fork 之后才创建）
+        if self._db is None:
+            db = sqlite3.connect(self.path, timeout=self._busy_timeout, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("PRAGMA mmap_size=67108864")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL,"
+                " expires_at REAL NOT NULL, size INTEGER NOT NULL,"
+                " PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS cache_expires ON cache (namespace, expires_at)")
+            self._db = db
+        return self._db
+
+    @staticmethod
+    def _key(key: Hashable) -> str:
+        return json.dumps(key, ensure_ascii=False, separators=(",", ":"), default=str)
+
+    def _failed(self, action: str, e: Exception) -> None:
+        self.errors += 1
+        logger.warning("SQLite 缓存%s失败（%s）: %s", action, self.namespace, e)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        try:
+            row = self._connect().execute(
+                "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+                (self.namespace, self._key(key))
+            ).fetchone()
+        except sqlite3.Error as e:
+            self._failed("读取", e)
+            self.misses += 1
+            return None
+        if row is None:
+            self.misses += 1
+            return None
+        if row[1] <= time.time():
+            # 过期条目由写入时的淘汰清理
+            self.expirations += 1
+            self.misses += 1
+            return None
+        try:
+            value = self._codec.decode(row[0])
+        except Exception as e:
+            # 损坏或旧格式的条目：删除后按未命中处理
+            self._failed("解码", e)
+            self.delete(key)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        if not self.enabled:
+            return
+        data = self._codec.encode(value)
+        if len(data) > self.max_bytes:
+            return
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        try:
+            db = self._connect()
+            db.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at, size) VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, self._key(key), data, expires_at, len(data))
+            )
+            self._writes += 1
+            if self._writes % self._evict_interval == 0:
+                self._evict(db)
+        except sqlite3.Error as e:
+            self._failed("写入", e)
+
+    def _evict(self, db: "sqlite3.Connection") -> None:
+        """删除过期条目；条目数或总字节数仍超限时按过期时间淘汰"""
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = db.execute(
+                "DELETE FROM cache WHERE namespace = ? AND expires_at <= ?", (self.namespace, time.time())
+            )
+            self.expirations += max(cursor.rowcount, 0)
+            entries, total = db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache WHERE namespace = ?", (self.namespace,)
+            ).fetchone()
+            victims = []
+            if entries > self.max_entries or total > self.max_bytes:
+                for key, size in db.execute(
+                    "SELECT key, size FROM cache WHERE namespace = ? ORDER BY expires_at", (self.namespace,)
+                ):
+                    if entries <= self.max_entries and total <= self.max_bytes:
+                        break
+                    victims.append((self.namespace, key))
+                    entries -= 1
+                    total -= size
+                db.executemany("DELETE FROM cache WHERE namespace = ? AND key = ?", victims)
+            db.execute("COMMIT")
+        except sqlite3.Error:
+            db.execute("ROLLBACK")
+            raise
+        self.evictions += len(victims)
+
+    def delete(self, key: Hashable) -> None:
+        try:
+            self._connect().execute(
+                "DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, self._key(key))
+            )
+        except sqlite3.Error as e:
+            self._failed("删除", e)
+
+    def clear(self) -> None:
+        try:
+            self._connect().execute("DELETE FROM cache WHERE namespace = ?", (self.namespace,))
+        except sqlite3.Error as e:
+            self._failed("清空", e)
+
+    def stats(self) -> Dict[str, Any]:
+        """条目数和字节数为所有 worker 共享的数据，命中统计只包括当前进程"""
+        try:
+            entries, total = self._connect().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache WHERE namespace = ?", (self.namespace,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            self._failed("统计", e)
+            entries, total = 0, 0
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend,
+            "path": self.path,
+            "entries": entries,
+            "bytes": total,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "errors": self.errors,
+        }
+
+
+def create_cache(
+    namespace: str,
+    max_entries: int,
+    max_bytes: int,
+    ttl: float,
+    sizeof: Callable[[Any], int] = json_size,
+    codec: Codec = JSON_CODEC,
+) -> CacheBackend:
+    """
+    按 CACHE_BACKEND 创建缓存
+
+    Args:
+        namespace: 缓存名称（文件缓存中区分不同缓存）
+        sizeof: 进程内缓存估算条目大小的函数
+        codec: 文件缓存的值编码方式
+
+    Raises:
+        ValueError: 未知的缓存后端
+    """
+    backend = os.getenv("CACHE_BACKEND", TTLCache.backend).lower()
+    if backend == TTLCache.backend:
+        return TTLCache(max_entries=max_entries, max_bytes=max_bytes, ttl=ttl, sizeof=sizeof)
+    if backend == SQLiteCache.backend:
+        return SQLiteCache(
+            namespace, max_entries=max_entries, max_bytes=max_bytes, ttl=ttl,
+            path=os.getenv("CACHE_SQLITE_PATH") or DEFAULT_SQLITE_PATH, codec=codec,
+            busy_timeout=env_float("CACHE_SQLITE_BUSY_TIMEOUT_MS", DEFAULT_SQLITE_BUSY_TIMEOUT * 1000) / 1000
+        )
+    raise ValueError(f"未知的缓存后端: {backend}（可选: memory, sqlite）")
@@ -0,0 +1,328 @@
+"""
+并发控制工具
+
+SingleFlight: 请求合并。相同 key 的并发调用共享同一个进行中的上游请求，
+所有调用方得到同一个结果（或同一个异常）。
+
+ToolScheduler: 全局工具调用调度器。所有请求的工具调用共享一个全局并发上限，
+每个请求另有自己的并发上限，并统计排队深度和等待时间。
+
+ConcurrencyLimiter: 上游并发限制（准入控制）。超过并发上限的调用进入有界等待队列，
+队列已满或排队超时时立即拒绝（抛出 UpstreamOverloaded），而不是一直挂起。
+
+cancel_on_disconnect: 执行期间定期检查客户端是否已断开，断开时取消任务
+（连同其中的上游调用和工具调用），不再为已经离开的客户端继续工作。
+"""
+import asyncio
+import contextvars
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class _Call:
+    """一次进行中的共享调用"""
+
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: "asyncio.Task[Any]"):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Single-flight 请求合并
+
+    - 第一个调用方创建共享任务，后续相同 key 的调用方等待同一个任务
+    - 共享任务的异常会传递给所有等待方，且不会被缓存：任务结束后 key 立即释放
+    - 单个调用方被取消不影响其他等待方；所有等待方都取消后共享任务才会被取消
+    - 共享任务在空的上下文中运行，不继承第一个调用方的截止时间和追踪 span；
+      每个调用方的超时只约束它自己的等待
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]], timeout: Optional[float] = None) -> T:
+        """
+        执行 fn，若相同 key 的调用正在进行则等待其结果
+
+        Args:
+            key: 合并用的 key
+            fn: 无参协程函数，只在没有进行中的调用时执行
+            timeout: 本调用方最长等待秒数（None 表示一直等待）；超时不影响其他等待方
+
+        Returns:
+            fn 的返回值
+
+        Raises:
+            asyncio.TimeoutError: 本调用方等待超时
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.get_running_loop().create_task(fn(), context=contextvars.Context()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _task: self._forget(key, call))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+
+        call.waiters += 1
+        try:
+            # shield：调用方被取消或等待超时时不取消共享任务
+            return await asyncio.wait_for(asyncio.shield(call.task), timeout=timeout)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # 已经没有调用方在等待，取消上游请求
+                call.task.cancel()
+                self._forget(key, call)
+
+    def _forget(self, key: Hashable, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        if call.task.done() and not call.task.cancelled():
+            # 标记异常已被读取，避免 "exception was never retrieved" 警告
+            call.task.exception()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
+
+
+class ToolSession:
+    """单个请求的工具调用会话，限制该请求自身的并发数"""
+
+    def __init__(self, scheduler: "ToolScheduler", limit: int):
+        self._scheduler = scheduler
+        self._semaphore = asyncio.Semaphore(limit)
+
+    def submit(self, fn: Callable[..., Awaitable[T]], *args: Any) -> "asyncio.Task[T]":
+        """提交一个工具调用，返回对应的任务"""
+        return asyncio.ensure_future(self._run(fn, *args))
+
+    async def _run(self, fn: Callable[..., Awaitable[T]], *args: Any) -> T:
+        async with self._semaphore:
+            return await self._scheduler.run(fn, *args)
+
+
+class ToolScheduler:
+    """
+    全局工具调用调度器
+
+    - 全局并发上限：所有请求的工具调用共享
+    - 每请求并发上限：通过 session() 创建的 ToolSession 控制
+    - 统计：排队深度、正在执行数、等待时间（次数 / 总计 / 最大值）
+    """
+
+    def __init__(self, max_concurrency: int, per_request_limit: int):
+        self.max_concurrency = max_concurrency
+        self.per_request_limit = per_request_limit
+        # 信号量在首次使用时创建，确保绑定到运行中的事件循环
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def session(self) -> ToolSession:
+        """为一个请求创建工具调用会话"""
+        return ToolSession(self, self.per_request_limit)
+
+    async def run(self, fn: Callable[..., Awaitable[T]], *args: Any) -> T:
+        """在全局并发上限内执行 fn(*args)"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        enqueued_at = time.perf_counter()
+        self.queued += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queued -= 1
+
+        waited = time.perf_counter() - enqueued_at
+        self.wait_count += 1
+        self.wait_total += waited
+        if waited > self.wait_max:
+            self.wait_max = waited
+
+        self.running += 1
+        try:
+            result = await fn(*args)
+            self.completed += 1
+            return result
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.running -= 1
+            self._semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "per_request_limit": self.per_request_limit,
+            "queue_depth": self.queued,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "wait_count": self.wait_count,
+            "wait_avg_ms": round(self.wait_total / self.wait_count * 1000, 3) if self.wait_count else 0.0,
+            "wait_max_ms": round(self.wait_max * 1000, 3),
+        }
+
+
+class UpstreamOverloaded(Exception):
+    """上游并发已满且等待队列已满（或排队超时），请求被拒绝"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} 上游繁忙，请稍后重试")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class ConcurrencyLimiter:
+    """
+    上游并发限制器
+
+    - max_concurrency: 同时进行的上游调用数上限（<= 0 表示不限制）
+    - max_queue: 等待队列长度上限，队列满时立即拒绝
+    - queue_timeout: 单个调用在队列中的最长等待秒数
+    - retry_after: 拒绝时建议客户端重试的等待秒数
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: int,
+        max_queue: int,
+        queue_timeout: float,
+        retry_after: float,
+    ):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_concurrency > 0
+
+    def utilization(self) -> float:
+        """当前负载：(进行中 + 排队) / 并发上限"""
+        if not self.enabled:
+            return 0.0
+        return (self.in_flight + self.queued) / self.max_concurrency
+
+    @asynccontextmanager
+    async def slot(self, timeout: Optional[float] = None) -> AsyncIterator[None]:
+        """
+        获取一个上游调用名额
+
+        Args:
+            timeout: 调用方允许的最长排队秒数（不超过 queue_timeout）
+
+        Raises:
+            UpstreamOverloaded: 队列已满或排队超时
+        """
+        if not self.enabled:
+            yield
+            return
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        # 按计数判断（在任何 await 之前），同一时刻到达的一批请求也不会超出队列上限
+        if self.in_flight + self.queued >= self.max_concurrency + self.max_queue:
+            self.rejected += 1
+            raise UpstreamOverloaded(self.name, self.retry_after)
+
+        self.queued += 1
+        try:
+            queue_timeout = self.queue_timeout if timeout is None else min(timeout, self.queue_timeout)
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=queue_timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            self.rejected += 1
+            raise UpstreamOverloaded(self.name, self.retry_after)
+        finally:
+            self.queued -= 1
+
+        self.admitted += 1
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+
+class ClientDisconnected(Exception):
+    """客户端在响应完成前断开了连接"""
+
+
+async def cancel_on_disconnect(
+    awaitable: Awaitable[T],
+    is_disconnected: Callable[[], Awaitable[bool]],
+    interval: float,
+) -> T:
+    """
+    执行 awaitable，每隔 interval 秒检查一次客户端是否已断开
+
+    Args:
+        awaitable: 要执行的协程
+        is_disconnected: 检查客户端是否已断开的协程函数（例如 Request.is_disconnected）
+        interval: 检查间隔（秒）
+
+    Returns:
+        awaitable 的结果
+
+    Raises:
+        ClientDisconnected: 客户端已断开；此时任务已被取消并完成清理
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=interval)
+            if done:
+                return task.result()
+            if await is_disconnected():
+                task.cancel()
+                # 等待取消完成，确保子任务（工具调用等）都已清理
+                await asyncio.wait({task})
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
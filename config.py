@@ -0,0 +1,30 @@
+"""
+环境变量配置读取工具
+
+各模块的可调参数都通过环境变量配置，解析失败时回退到默认值。
+"""
+import os
+
+
+def env_float(name: str, default: float) -> float:
+    """读取浮点型环境变量"""
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def env_int(name: str, default: int) -> int:
+    """读取整型环境变量"""
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def env_bool(name: str, default: bool) -> bool:
+    """读取布尔型环境变量（1/true/yes/on 视为真）"""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
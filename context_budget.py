@@ -0,0 +1,182 @@
+"""
+上下文 token 预算
+
+Agentic Loop 每一轮都会把完整的消息历史（包括之前所有的搜索结果）重新发给模型。
+ContextBudget 在本地估算 token 数，超出模型预算时逐级压缩较早轮次的工具结果：
+1. 去掉在更新的搜索结果中已出现过的 URL，并保留较短的摘要
+2. 减少每个关键词的结果数、缩短摘要
+3. 只保留标题和 URL
+4. 整条工具结果替换为省略说明
+最新一轮的工具结果始终保持不变。
+
+配置（环境变量）：
+- CONTEXT_TOKEN_BUDGET: 默认 token 预算，默认 12000
+- CONTEXT_TOKEN_BUDGETS: 按模型覆盖预算，例如 "gpt-5=24000,deepseek=16000"
+"""
+import os
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from config import env_int
+from text_utils import cjk_re
+
+DEFAULT_TOKEN_BUDGET = env_int("CONTEXT_TOKEN_BUDGET", 12000)
+
+MODEL_TOKEN_BUDGETS: Dict[str, int] = {
+    "gpt-5": 24000,
+}
+for _item in os.getenv("CONTEXT_TOKEN_BUDGETS", "").split(","):
+    _model, _, _budget = _item.partition("=")
+    if _model.strip() and _budget.strip().isdigit():
+        MODEL_TOKEN_BUDGETS[_model.strip()] = int(_budget)
+
+# 每条消息的固定开销（role、分隔符等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# 压缩级别：每个关键词最多保留的结果数、摘要字符数、是否保留摘要答案
+# 所有级别都会去掉在更新的搜索结果中已出现过的 URL
+COMPACTION_LEVELS: List[Dict[str, Any]] = [
+    {"max_results": 5, "snippet_chars": 200, "include_answers": True},
+    {"max_results": 3, "snippet_chars": 120, "include_answers": True},
+    {"max_results": 2, "snippet_chars": 60, "include_answers": False},
+    {"max_results": 1, "snippet_chars": 0, "include_answers": False},
+]
+
+OMITTED_TOOL_RESULT = "（较早的搜索结果已省略以节省上下文，请参考后续搜索结果）"
+
+# render(payload, exclude_urls, **level) -> str
+Renderer = Callable[..., str]
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """
+    本地估算文本 token 数（不依赖 tokenizer）
+
+    CJK 字符大约 1 个 token，其余字符大约 4 个字符 1 个 token。
+    """
+    if not text:
+        return 0
+    cjk = len(cjk_re().findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def estimate_message_tokens(message: Dict[str, Any]) -> int:
+    """估算单条消息的 token 数（包括工具调用参数）"""
+    tokens = MESSAGE_OVERHEAD_TOKENS + estimate_tokens(message.get("content"))
+    for tool_call in message.get("tool_calls") or []:
+        function = tool_call.get("function", {})
+        tokens += estimate_tokens(function.get("name")) + estimate_tokens(function.get("arguments"))
+    return tokens
+
+
+def token_budget_for(model: str) -> int:
+    """返回模型对应的 token 预算"""
+    return MODEL_TOKEN_BUDGETS.get(model, DEFAULT_TOKEN_BUDGET)
+
+
+class ContextBudget:
+    """
+    单个请求的上下文预算管理
+
+    工具结果在写入消息历史时通过 register() 登记原始搜索结果，
+    每次调用上游前用 fit() 把消息历史压缩到预算以内。
+    """
+
+    # 进程内累计统计
+    totals: Dict[str, int] = {"requests": 0, "compacted_requests": 0, "compactions": 0, "tokens_saved": 0}
+
+    def __init__(self, model: str, render: Renderer, budget: Optional[int] = None):
+        self.budget = budget if budget is not None else token_budget_for(model)
+        self._render = render
+        self._payloads: Dict[str, Dict[str, Any]] = {}
+        self._levels: Dict[str, int] = {}
+        self._original_tokens: Dict[str, int] = {}
+        self.tokens_saved = 0
+        self.compactions = 0
+        ContextBudget.totals["requests"] += 1
+
+    def register(self, tool_call_id: str, search_result: Dict[str, Any], message: Dict[str, Any]) -> None:
+        """登记一条工具结果消息及其原始搜索结果"""
+        self._payloads[tool_call_id] = search_result
+        self._levels[tool_call_id] = -1
+        self._original_tokens[tool_call_id] = estimate_message_tokens(message)
+
+    def fit(self, messages: List[Dict[str, Any]]) -> int:
+        """
+        将消息历史压缩到预算以内（原地修改较早轮次的工具结果）
+
+        Args:
+            messages: 即将发送给上游的消息历史
+
+        Returns:
+            本次发送相对未压缩历史节省的 token 数
+        """
+        sizes = [estimate_message_tokens(message) for message in messages]
+        total = sum(sizes)
+
+        if total > self.budget:
+            total = self._compact(messages, sizes, total)
+
+        saved = 0
+        for message, size in zip(messages, sizes):
+            tool_call_id = message.get("tool_call_id")
+            if message.get("role") == "tool" and self._levels.get(tool_call_id, -1) >= 0:
+                saved += self._original_tokens[tool_call_id] - size
+        if saved > 0 and self.tokens_saved == 0:
+            ContextBudget.totals["compacted_requests"] += 1
+        self.tokens_saved += saved
+        ContextBudget.totals["tokens_saved"] += saved
+        return saved
+
+    def _compact(self, messages: List[Dict[str, Any]], sizes: List[int], total: int) -> int:
+        # 最新一轮：最后一条带 tool_calls 的 assistant 消息之后的工具结果，不压缩
+        last_tool_round = max(
+            (index for index, message in enumerate(messages)
+             if message.get("role") == "assistant" and message.get("tool_calls")),
+            default=len(messages)
+        )
+
+        # 从新到旧收集每条工具结果之后出现的 URL，用于去重
+        candidates = []
+        newer_urls: Set[str] = set()
+        for index in range(len(messages) - 1, -1, -1):
+            message = messages[index]
+            tool_call_id = message.get("tool_call_id")
+            if message.get("role") != "tool" or tool_call_id not in self._payloads:
+                continue
+            payload_urls = _result_urls(self._payloads[tool_call_id])
+            if index < last_tool_round:
+                candidates.append((index, tool_call_id, set(newer_urls)))
+            newer_urls |= payload_urls
+        candidates.reverse()  # 最旧的优先压缩
+
+        for level in range(len(COMPACTION_LEVELS) + 1):
+            for index, tool_call_id, exclude_urls in candidates:
+                if total <= self.budget:
+                    return total
+                if self._levels[tool_call_id] >= level:
+                    continue
+                if level < len(COMPACTION_LEVELS):
+                    content = self._render(
+                        self._payloads[tool_call_id],
+                        exclude_urls=exclude_urls,
+                        **COMPACTION_LEVELS[level]
+                    )
+                else:
+                    content = OMITTED_TOOL_RESULT
+                messages[index]["content"] = content
+                self._levels[tool_call_id] = level
+                self.compactions += 1
+                ContextBudget.totals["compactions"] += 1
+                new_size = estimate_message_tokens(messages[index])
+                total += new_size - sizes[index]
+                sizes[index] = new_size
+        return total
+
+
+def _result_urls(search_result: Dict[str, Any]) -> Set[str]:
+    urls = set()
+    for query in search_result.get("queries") or []:
+        for item in query.get("response", {}).get("results", []):
+            if item.get("url"):
+                urls.add(item["url"])
+    return urls
@@ -0,0 +1,86 @@
+"""
+请求级截止时间
+
+一个 chat 请求的总截止时间保存在 contextvar 中，asyncio 任务创建时会复制上下文，
+因此每一轮的上游调用、工具调用和其中的搜索请求都能读到同一个截止时间，
+不需要逐层传参。上游调用的超时取「自身超时」和「剩余时间」中较小的一个。
+
+配置（环境变量）：
+- CHAT_DEADLINE_MS: 请求未指定截止时间时的默认值（毫秒），默认 90000
+- CHAT_MAX_DEADLINE_MS: 请求可以指定的最大截止时间（毫秒），默认 300000
+- CHAT_FINAL_ROUND_RESERVE_MS: 为最后一轮（不提供工具、生成最终答案）预留的时间（毫秒），
+  默认 15000；最多为总截止时间的一半
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from config import env_int
+
+DEFAULT_DEADLINE_MS = env_int("CHAT_DEADLINE_MS", 90000)
+MAX_DEADLINE_MS = env_int("CHAT_MAX_DEADLINE_MS", 300000)
+FINAL_ROUND_RESERVE_MS = env_int("CHAT_FINAL_ROUND_RESERVE_MS", 15000)
+
+_current: ContextVar[Optional["Deadline"]] = ContextVar("deadline", default=None)
+
+
+class Deadline:
+    """截止时间（基于 time.monotonic）"""
+
+    __slots__ = ("expires_at", "total")
+
+    def __init__(self, seconds: float):
+        self.total = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    @classmethod
+    def from_ms(cls, deadline_ms: Optional[int]) -> "Deadline":
+        """按请求指定的毫秒数创建（未指定时使用默认值，超过上限时截断）"""
+        if not deadline_ms or deadline_ms <= 0:
+            deadline_ms = DEFAULT_DEADLINE_MS
+        return cls(min(deadline_ms, MAX_DEADLINE_MS) / 1000)
+
+    def remaining(self) -> float:
+        """剩余秒数（已过期时为 0）"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def final_round_reserve(self) -> float:
+        """为最后一轮预留的秒数"""
+        return min(FINAL_ROUND_RESERVE_MS / 1000, self.total / 2)
+
+    def shrink(self, seconds: float) -> "Deadline":
+        """提前 seconds 秒到期的子截止时间"""
+        child = Deadline(0)
+        child.total = self.total
+        child.expires_at = self.expires_at - seconds
+        return child
+
+
+@contextmanager
+def scope(deadline: Deadline) -> Iterator[Deadline]:
+    """在 with 块内（以及其中创建的任务中）使用该截止时间"""
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+def current() -> Optional[Deadline]:
+    return _current.get()
+
+
+def clamp(timeout: float) -> float:
+    """
+    按当前截止时间收紧超时
+
+    没有截止时间时原样返回；剩余时间为 0 时返回 0，调用方应直接按超时处理。
+    """
+    deadline = _current.get()
+    if deadline is None:
+        return timeout
+    return min(timeout, deadline.remaining())
@@ -0,0 +1,68 @@
+"""
+JSON 编解码快速路径
+
+- 安装了 orjson 时使用 orjson 编解码，否则使用标准库（输出与 starlette 的 JSONResponse 相同）
+- FastJSONResponse: 应用的默认响应类
+- RawJSON: 保留上游原始字节的 dict，不需要改动时直接把原始字节返回给客户端
+
+配置（环境变量）：
+- RESPONSE_FAST_PATH: 启用响应快速路径，默认关闭。启用后 /chat（非流式）和 /search
+  不再按 response_model 校验和重新序列化：/chat 直接返回上游最后一轮的原始 JSON
+  （上游的额外字段会原样保留），/search 直接编码搜索结果
+"""
+import json
+from typing import Any, Dict, Mapping, Optional, Union
+
+from starlette.responses import JSONResponse, Response
+
+from config import env_bool
+
+try:
+    import orjson
+except ImportError:  # 可选依赖
+    orjson = None
+
+FAST_PATH = env_bool("RESPONSE_FAST_PATH", False)
+
+
+def dumps(content: Any) -> bytes:
+    """编码为紧凑的 UTF-8 JSON"""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class RawJSON(dict):
+    """解析后的 JSON 对象，附带原始字节（raw）"""
+
+    __slots__ = ("raw",)
+
+    def __init__(self, data: Dict[str, Any], raw: bytes):
+        super().__init__(data)
+        self.raw = raw
+
+
+def loads_raw(data: bytes) -> Any:
+    """解析 JSON；顶层是对象时返回保留原始字节的 RawJSON"""
+    parsed = loads(data)
+    return RawJSON(parsed, data) if isinstance(parsed, dict) else parsed
+
+
+class FastJSONResponse(JSONResponse):
+    """使用 dumps 编码的 JSONResponse"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def response(content: Any, headers: Optional[Mapping[str, str]] = None) -> Response:
+    """RawJSON 直接返回原始字节，其他内容用 FastJSONResponse 编码"""
+    if isinstance(content, RawJSON):
+        return Response(content.raw, media_type="application/json", headers=headers)
+    return FastJSONResponse(content, headers=headers)
@@ -1,35 +1,92 @@
-from fastapi import FastAPI, Query, Body, HTTPException
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, Query, Body, HTTPException, Request
+from fastapi.responses import HTMLResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any
-import requests
+from typing import Optional, List, Dict, Set, Any, AsyncIterator, Awaitable, Callable
+from contextlib import aclosing, asynccontextmanager
+import asyncio
+import contextvars
 import os
+import random
+import zlib
+import time
 import logging
 import json as json_lib
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import unicodedata
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
+import deadline
+import fast_json
+import metrics
+import openapi_schema
+import response_cache
+import startup
+import static_assets
+import tracing
+import upstream
+from cache import create_cache
+from concurrency import ClientDisconnected, SingleFlight, ToolScheduler, UpstreamOverloaded, cancel_on_disconnect
+from resilience import FAILURE_STATUS_CODES, CircuitOpenError, Hedger, is_retryable
+from config import env_bool, env_float, env_int
+from context_budget import ContextBudget
+from round_policy import create_policy
+from search_results import SearchResultStore
+from structured_logging import log_event, setup_logging
+
+# FAST_START 模式下首次使用时才加载
+httpx = startup.import_module("httpx")
+
+# 配置日志（后台线程写出，LOG_FORMAT=json 时输出结构化日志）
+setup_logging()
 logger = logging.getLogger(__name__)
+# httpx 会为每个上游请求输出一行 INFO 日志，热路径上只保留警告
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logging.getLogger("httpcore").setLevel(logging.WARNING)
 
 # AI Builder API 配置
-AI_BUILDER_BASE_URL = "https://space.ai-builders.com/backend"
-AI_BUILDER_API_KEY = os.getenv("AI_BUILDER_TOKEN")
+AI_BUILDER_BASE_URL = os.getenv("AI_BUILDER_BASE_URL", "https://space.ai-builders.com/backend")
+_api_key: Optional[str] = None
+_api_key_loaded = False
+
+
+def get_api_key() -> Optional[str]:
+    """
+    AI Builder API token
+
+    优先读取环境变量 AI_BUILDER_TOKEN，没有时从文件读取；首次调用时才读取并缓存结果。
+    """
+    global _api_key, _api_key_loaded
+    if not _api_key_loaded:
+        _api_key = os.getenv("AI_BUILDER_TOKEN")
+        # 如果环境变量中没有，尝试从文件读取
+        if not _api_key:
+            try:
+                with open("AI builder API key:", "r") as f:
+                    lines = f.readlines()
+                    if len(lines) >= 2:
+                        _api_key = lines[1].strip()
+            except FileNotFoundError:
+                pass
+        _api_key_loaded = True
+    return _api_key
+
+
+upstream.configure(AI_BUILDER_BASE_URL, get_api_key)
 
-# 如果环境变量中没有，尝试从文件读取
-if not AI_BUILDER_API_KEY:
+# 主页和 /static 下的文件（启动时读入内存，FAST_START 模式下首次访问时读入）
+assets = static_assets.StaticAssets()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：加载静态资源，创建并关闭共享的上游 HTTP 客户端"""
+    if not startup.FAST_START:
+        # FAST_START 模式下首次访问时再加载
+        assets.load()
+        await upstream.start()
     try:
-        with open("AI builder API key:", "r") as f:
-            lines = f.readlines()
-            if len(lines) >= 2:
-                AI_BUILDER_API_KEY = lines[1].strip()
-    except FileNotFoundError:
-        pass
+        yield
+    finally:
+        await upstream.close()
+
 
 app = FastAPI(
     title="AI Chat with Agentic Loop",
@@ -87,14 +144,23 @@ app = FastAPI(
     license_info={
         "name": "MIT",
     },
+    lifespan=lifespan,
+    default_response_class=fast_json.FastJSONResponse,
 )
 
-# 挂载静态文件
+# /openapi.json 优先使用构建时生成的 openapi.json（python openapi_schema.py）
+openapi_schema.install(app)
+
+# 请求耗时和进行中请求数（/metrics）
+app.add_middleware(metrics.MetricsMiddleware)
+# 请求追踪（X-Debug-Trace 请求头或 TRACE_EXPORT_PATH）
+app.add_middleware(tracing.TracingMiddleware)
+
+# 挂载静态文件（内存中预压缩，带 ETag 和指纹 URL）
 # 在 Vercel 上，静态文件通过 vercel.json 路由处理
 # 本地开发时使用 mount
-import os
 if os.getenv("VERCEL") != "1":
-    app.mount("/static", StaticFiles(directory="static"), name="static")
+    app.mount("/static", static_assets.StaticAssetsApp(assets), name="static")
 
 
 class HelloResponse(BaseModel):
@@ -136,43 +202,20 @@ class HelloRequest(BaseModel):
     tags=["基础"],
     summary="主页",
     description="返回聊天界面的 HTML 页面",
-    response_class=FileResponse
+    response_class=HTMLResponse
 )
-async def root():
+async def root(request: Request):
     """
     主页端点
     
-    返回聊天界面的 HTML 页面。
+    返回聊天界面的 HTML 页面（启动时读入内存，支持 If-None-Match 和压缩）。
     """
-    # 在 Vercel 上，静态文件通过 vercel.json 路由处理
-    # 这里直接返回文件内容
-    static_path = "static/index.html"
-    
-    # 尝试多个可能的路径
-    possible_paths = [
-        static_path,
-        os.path.join(os.path.dirname(__file__), static_path),
-        os.path.join(os.getcwd(), static_path),
-    ]
-    
-    for path in possible_paths:
-        if os.path.exists(path):
-            return FileResponse(path)
-    
-    # 如果找不到文件，尝试读取并返回 HTML 内容
-    try:
-        for path in possible_paths:
-            try:
-                with open(path, "r", encoding="utf-8") as f:
-                    from fastapi.responses import HTMLResponse
-                    return HTMLResponse(content=f.read())
-            except FileNotFoundError:
-                continue
-    except Exception as e:
-        logger.error(f"Error loading static file: {e}")
+    asset = assets.get(static_assets.INDEX)
+    if asset is not None:
+        return assets.response(asset, request.headers)
     
-    # 如果都失败了，返回一个简单的 HTML
-    from fastapi.responses import HTMLResponse
+    # 如果找不到文件，返回一个简单的 HTML
+    logger.error(f"Static file not found: {assets.directory}/{static_assets.INDEX}")
     return HTMLResponse(content="""
     <!DOCTYPE html>
     <html>
@@ -449,9 +492,21 @@ class ChatRequest(BaseModel):
     )
     stream: Optional[bool] = Field(
         False,
-        description="是否使用流式响应",
+        description="是否使用流式响应（Server-Sent Events，逐轮推送事件和 token 增量）",
         example=False
     )
+    deadline_ms: Optional[int] = Field(
+        None,
+        description="整个请求的截止时间（毫秒），也可以通过 X-Deadline-Ms 请求头指定；默认由服务端配置",
+        ge=1,
+        example=30000
+    )
+    max_rounds: Optional[int] = Field(
+        None,
+        description="最多轮数（含生成最终答案的一轮），1 表示不使用搜索；不超过服务端上限（默认 4）",
+        ge=1,
+        example=2
+    )
     
     class Config:
         json_schema_extra = {
@@ -521,7 +576,272 @@ def get_search_tool_definition():
     }
 
 
-def execute_search(keywords: List[str], max_results: int = 6) -> Dict[str, Any]:
+# 搜索结果缓存：按「规范化关键词 + max_results」缓存单个关键词的结果，
+# 多关键词请求可以部分命中，只把未命中的关键词发往上游
+# CACHE_BACKEND=sqlite 时同一台机器上的 worker 共享
+SEARCH_CACHE_TTL = env_float("SEARCH_CACHE_TTL", 300.0)
+# 超过 SEARCH_CACHE_TTL 后仍可使用的秒数：先返回旧结果，同时在后台刷新（0 表示关闭）
+SEARCH_CACHE_STALE_TTL = env_float("SEARCH_CACHE_STALE_TTL", 0.0)
+# 上游拒绝的关键词（不可重试的 4xx，或上游报告该关键词失败）在这段时间内直接返回失败，不再请求上游（0 表示关闭）
+SEARCH_NEGATIVE_TTL = env_float("SEARCH_NEGATIVE_TTL", 10.0)
+search_cache = create_cache(
+    "search",
+    max_entries=env_int("SEARCH_CACHE_MAX_ENTRIES", 2048),
+    max_bytes=env_int("SEARCH_CACHE_MAX_BYTES", 64 * 1024 * 1024),
+    ttl=SEARCH_CACHE_TTL,
+)
+
+# 正在后台刷新的关键词集合（持有任务引用，避免任务被回收）
+_search_refreshes: Dict[Any, "asyncio.Task[None]"] = {}
+
+# 相同的未命中关键词集合并发搜索时只发一次上游请求
+search_flight = SingleFlight()
+
+# 搜索对冲请求（可选）：上游在最近延迟的分位数内未返回时再发一个相同请求，先到先用
+SEARCH_HEDGE_ENABLED = env_bool("SEARCH_HEDGE_ENABLED", False)
+search_hedger = Hedger(
+    percentile=env_float("SEARCH_HEDGE_PERCENTILE", 0.95),
+    min_delay=env_float("SEARCH_HEDGE_MIN_DELAY", 0.05),
+    max_ratio=env_float("SEARCH_HEDGE_MAX_RATIO", 0.1),
+)
+
+# 全局工具调用调度器：所有请求共享全局并发上限，每个请求另有并发上限
+tool_scheduler = ToolScheduler(
+    max_concurrency=env_int("TOOL_MAX_CONCURRENCY", 64),
+    per_request_limit=env_int("TOOL_MAX_PER_REQUEST", 4),
+)
+
+
+def normalize_keyword(keyword: str) -> str:
+    """规范化搜索关键词：Unicode NFKC、忽略大小写、合并空白"""
+    return " ".join(unicodedata.normalize("NFKC", keyword).casefold().split())
+
+
+class CachedSearchError(Exception):
+    """
+    关键词近期搜索失败（负缓存命中），在负缓存有效期内不再请求上游
+    
+    status_code: 所有关键词都是被上游以 4xx 拒绝时为原状态码（重试也不会成功），否则为 None
+    """
+
+    def __init__(self, errors: List[Dict[str, str]], retry_after: float, status_code: Optional[int] = None):
+        super().__init__("; ".join(f"{item['keyword']}: {item['error']}" for item in errors))
+        self.errors = errors
+        self.retry_after = retry_after
+        self.status_code = status_code
+
+
+def _search_entry(response_data: Dict[str, Any]) -> Dict[str, Any]:
+    return {"response": response_data, "fresh_until": time.time() + SEARCH_CACHE_TTL}
+
+
+def _cache_search_response(norm: str, max_results: int, response_data: Dict[str, Any]) -> None:
+    search_cache.set(("search", norm, max_results), _search_entry(response_data),
+                     ttl=SEARCH_CACHE_TTL + SEARCH_CACHE_STALE_TTL)
+
+
+def _cache_search_failure(keywords: List[str], max_results: int, error: str,
+                          status_code: Optional[int] = None) -> None:
+    """负缓存：在 SEARCH_NEGATIVE_TTL 内直接返回失败（status_code 为上游拒绝时的 4xx 状态码）"""
+    if SEARCH_NEGATIVE_TTL <= 0:
+        return
+    entry: Dict[str, Any] = {"error": error}
+    if status_code is not None:
+        entry["status"] = status_code
+    for keyword in keywords:
+        search_cache.set(("search", normalize_keyword(keyword), max_results), entry, ttl=SEARCH_NEGATIVE_TTL)
+    metrics.SEARCH_CACHE_EVENTS.labels("negative_store").inc(len(keywords))
+
+
+def _search_error_text(e: Exception) -> str:
+    """写入负缓存和 errors 的简短错误描述"""
+    if isinstance(e, httpx.HTTPStatusError):
+        return f"上游返回 {e.response.status_code}"
+    return str(e) or type(e).__name__
+
+
+def _is_cacheable_failure(e: Exception) -> bool:
+    """
+    是否为关键词相关的上游失败（不可重试的 4xx，例如关键词被拒绝）
+    
+    429 / 5xx、连接错误和超时是整个上游的故障，与关键词无关，不缓存（由熔断器处理）；
+    本地准入控制（排队已满、熔断）同样不缓存。
+    """
+    if not isinstance(e, httpx.HTTPStatusError) or is_retryable(e):
+        return False
+    status = e.response.status_code
+    return 400 <= status < 500 and status not in FAILURE_STATUS_CODES
+
+
+async def _fetch_search(missing: List[str], max_results: int) -> Dict[str, Any]:
+    """未命中的关键词合并为一次上游请求（相同集合的并发请求共享）"""
+    flight_key = (tuple(sorted({normalize_keyword(keyword) for keyword in missing})), max_results)
+    
+    def fetch() -> Awaitable[Dict[str, Any]]:
+        return upstream.post_json(upstream.SEARCH_PATH, {
+            "keywords": missing,
+            "max_results": max_results
+        })
+    
+    # 共享请求不继承任何调用方的截止时间，每个调用方只按自己的剩余时间等待
+    request_deadline = deadline.current()
+    timeout = request_deadline.remaining() if request_deadline is not None else None
+    if SEARCH_HEDGE_ENABLED:
+        return await search_flight.do(flight_key, lambda: search_hedger.run(fetch), timeout)
+    return await search_flight.do(flight_key, fetch, timeout)
+
+
+def _store_search_results(missing: List[str], max_results: int, data: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """
+    写入上游返回的结果，上游报告失败的关键词写入负缓存
+    
+    Returns:
+        规范化关键词 -> 结果
+    """
+    missing_norms = {normalize_keyword(keyword) for keyword in missing}
+    responses: Dict[str, Dict[str, Any]] = {}
+    for index, query in enumerate(data.get("queries") or []):
+        norm = normalize_keyword(query.get("keyword", ""))
+        if norm not in missing_norms and index < len(missing):
+            # 上游改写了关键词时按位置对应
+            norm = normalize_keyword(missing[index])
+        response_data = query.get("response")
+        if norm in missing_norms and response_data is not None:
+            responses[norm] = response_data
+            _cache_search_response(norm, max_results, response_data)
+    for item in data.get("errors") or []:
+        keyword = item.get("keyword")
+        if keyword and normalize_keyword(keyword) not in responses:
+            _cache_search_failure([keyword], max_results, str(item.get("error") or "搜索失败"))
+    return responses
+
+
+async def _refresh_search(keywords: List[str], max_results: int, key: Any) -> None:
+    try:
+        _store_search_results(keywords, max_results, await _fetch_search(keywords, max_results))
+        metrics.SEARCH_CACHE_EVENTS.labels("refresh").inc()
+    except Exception as e:
+        # 刷新失败时继续使用旧结果，直到其过期
+        metrics.SEARCH_CACHE_EVENTS.labels("refresh_error").inc()
+        logger.warning("后台刷新搜索缓存失败 %s: %s", keywords, e)
+    finally:
+        _search_refreshes.pop(key, None)
+
+
+def schedule_search_refresh(keywords: List[str], max_results: int) -> None:
+    """
+    在后台刷新过期但仍在可用期内的缓存
+    
+    刷新任务使用空的上下文，不继承当前请求的截止时间和追踪；同一组关键词同时只刷新一次。
+    """
+    key = (tuple(sorted(normalize_keyword(keyword) for keyword in keywords)), max_results)
+    if key in _search_refreshes:
+        return
+    _search_refreshes[key] = asyncio.get_running_loop().create_task(
+        _refresh_search(keywords, max_results, key), context=contextvars.Context()
+    )
+
+
+async def search_with_cache(keywords: List[str], max_results: int) -> Dict[str, Any]:
+    """
+    带缓存的搜索：命中缓存的关键词直接返回，其余关键词合并为一次上游请求
+    
+    - 超过 SEARCH_CACHE_TTL 但仍在 SEARCH_CACHE_STALE_TTL 内的结果直接返回，并在后台刷新
+    - 近期失败的关键词（负缓存）直接计入 errors，不请求上游
+    - 部分关键词失败时返回其余关键词的结果，失败的关键词计入 errors
+    
+    Args:
+        keywords: 搜索关键词列表
+        max_results: 每个关键词的最大结果数
+    
+    Returns:
+        与 AI Builder /v1/search/ 结构相同的结果字典
+    
+    Raises:
+        CachedSearchError: 所有关键词都命中负缓存
+        调用上游时的异常（没有任何关键词可以返回结果时）
+    """
+    normalized = [normalize_keyword(keyword) for keyword in keywords]
+    responses: Dict[str, Dict[str, Any]] = {}
+    missing: List[str] = []
+    missing_seen = set()
+    stale: List[str] = []
+    errors: List[Dict[str, str]] = []
+    failed_seen = set()
+    # 负缓存命中的上游状态码（None 表示不是 4xx 拒绝）
+    failed_statuses: Set[Optional[int]] = set()
+    now = time.time()
+    
+    for keyword, norm in zip(keywords, normalized):
+        if norm in responses or norm in missing_seen or norm in failed_seen:
+            continue
+        cached = search_cache.get(("search", norm, max_results)) or {}
+        if "response" in cached:
+            responses[norm] = cached["response"]
+            if cached["fresh_until"] <= now:
+                stale.append(keyword)
+        elif "error" in cached:
+            errors.append({"keyword": keyword, "error": cached["error"]})
+            failed_seen.add(norm)
+            failed_statuses.add(cached.get("status"))
+            metrics.SEARCH_CACHE_EVENTS.labels("negative_hit").inc()
+        else:
+            missing.append(keyword)
+            missing_seen.add(norm)
+    
+    if stale:
+        metrics.SEARCH_CACHE_EVENTS.labels("stale_hit").inc(len(stale))
+        schedule_search_refresh(stale, max_results)
+    
+    combined_key = ("combined", tuple(sorted(set(normalized))), max_results)
+    combined_answer = None
+    
+    if missing:
+        try:
+            with tracing.span("search.upstream", keywords=missing, cache_hits=len(responses)):
+                data = await _fetch_search(missing, max_results)
+        except Exception as e:
+            # 整批请求被拒绝时无法确定是哪个关键词的问题：只有单个关键词时才写入负缓存
+            if len(missing) == 1 and _is_cacheable_failure(e):
+                _cache_search_failure(missing, max_results, _search_error_text(e), e.response.status_code)
+            if not responses:
+                raise
+            # 已有部分关键词的结果：返回这些结果，失败的关键词计入 errors
+            errors.extend({"keyword": keyword, "error": _search_error_text(e)} for keyword in missing)
+        else:
+            responses.update(_store_search_results(missing, max_results, data))
+            errors.extend(data.get("errors") or [])
+            # 综合答案只有在本次上游请求覆盖了全部关键词时才完整
+            if len(missing_seen) == len(set(normalized)):
+                combined_answer = data.get("combined_answer")
+                if combined_answer and not errors:
+                    search_cache.set(combined_key, combined_answer)
+    elif not errors:
+        combined_answer = search_cache.get(combined_key)
+    
+    if not responses and errors and not missing:
+        status_code = None
+        if None not in failed_statuses:
+            status_code = failed_statuses.pop() if len(failed_statuses) == 1 else 400
+        raise CachedSearchError(errors, SEARCH_NEGATIVE_TTL, status_code)
+    
+    logger.debug("搜索缓存: 命中 %d 个关键词，上游请求 %d 个关键词", len(set(normalized)) - len(missing), len(missing))
+    
+    queries = []
+    emitted = set()
+    for keyword, norm in zip(keywords, normalized):
+        if norm in responses and norm not in emitted:
+            emitted.add(norm)
+            queries.append({"keyword": keyword, "response": responses[norm]})
+    
+    return {
+        "queries": queries,
+        "combined_answer": combined_answer,
+        "errors": errors or None
+    }
+
+
+async def execute_search(keywords: List[str], max_results: int = 6) -> Dict[str, Any]:
     """
     执行搜索并返回结果
     
@@ -532,34 +852,25 @@ def execute_search(keywords: List[str], max_results: int = 6) -> Dict[str, Any]:
     Returns:
         搜索结果字典
     """
-    if not AI_BUILDER_API_KEY:
+    if not get_api_key():
         return {"error": "AI Builder API token 未配置"}
     
-    url = f"{AI_BUILDER_BASE_URL}/v1/search/"
-    headers = {
-        "Authorization": f"Bearer {AI_BUILDER_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
-    payload = {
-        "keywords": keywords,
-        "max_results": max_results
-    }
-    
     try:
-        response = requests.post(url, headers=headers, json=payload, timeout=60)
-        response.raise_for_status()
-        return response.json()
+        return await search_with_cache(keywords, max_results)
     except Exception as e:
-        return {"error": f"搜索失败: {str(e)}"}
+        return {"error": f"搜索失败: {str(e) or type(e).__name__}"}
 
 
-def execute_single_tool_call(tool_call: Dict[str, Any]) -> Dict[str, Any]:
+async def execute_single_tool_call(
+    tool_call: Dict[str, Any],
+    result_store: Optional[SearchResultStore] = None
+) -> Dict[str, Any]:
     """
     执行单个工具调用
     
     Args:
         tool_call: 工具调用对象，包含 function 和 id
+        result_store: 本请求的搜索结果存储；提供时只把新结果发给模型
     
     Returns:
         包含 tool_call_id, result_text, success 的字典
@@ -573,7 +884,7 @@ def execute_single_tool_call(tool_call: Dict[str, Any]) -> Dict[str, Any]:
         # 解析参数
         function_args = json_lib.loads(function_args_str)
     except Exception as e:
-        logger.warning(f"工具调用 {tool_call_id} 参数解析失败: {e}")
+        logger.warning("工具调用 %s 参数解析失败: %s", tool_call_id, e)
         function_args = {}
     
     # 执行搜索
@@ -581,11 +892,23 @@ def execute_single_tool_call(tool_call: Dict[str, Any]) -> Dict[str, Any]:
         keywords = function_args.get("keywords", [])
         max_results = function_args.get("max_results", 6)
         
-        # 执行搜索
-        search_result = execute_search(keywords, max_results)
-        
-        # 格式化搜索结果
-        search_result_text = format_search_results_for_llm(search_result)
+        with tracing.span("tool.call", id=tool_call_id, name=function_name, keywords=keywords) as tool_span:
+            # 执行搜索
+            started = time.perf_counter()
+            search_result = await execute_search(keywords, max_results)
+            metrics.TOOL_CALL_DURATION.labels(
+                function_name, "error" if "error" in search_result else "ok"
+            ).observe(time.perf_counter() - started)
+            if "error" in search_result:
+                tool_span.set_attribute("error", search_result["error"])
+            
+            with tracing.span("tool.format") as format_span:
+                # 去掉本请求中已经发给模型的结果（跨关键词、跨轮次）
+                llm_result = result_store.add(search_result) if result_store is not None else search_result
+                
+                # 格式化搜索结果
+                search_result_text = format_search_results_for_llm(llm_result)
+                format_span.set_attribute("chars", len(search_result_text))
         
         return {
             "tool_call_id": tool_call_id,
@@ -593,10 +916,11 @@ def execute_single_tool_call(tool_call: Dict[str, Any]) -> Dict[str, Any]:
             "keywords": keywords,
             "result_text": search_result_text,
             "search_result": search_result,
+            "llm_result": llm_result,
             "success": "error" not in search_result
         }
     else:
-        logger.warning(f"未知的工具: {function_name}")
+        logger.warning("未知的工具: %s", function_name)
         return {
             "tool_call_id": tool_call_id,
             "function_name": function_name,
@@ -605,12 +929,22 @@ def execute_single_tool_call(tool_call: Dict[str, Any]) -> Dict[str, Any]:
         }
 
 
-def format_search_results_for_llm(search_result: Dict[str, Any]) -> str:
+def format_search_results_for_llm(
+    search_result: Dict[str, Any],
+    max_results: int = 5,
+    snippet_chars: int = 200,
+    include_answers: bool = True,
+    exclude_urls: Optional[Set[str]] = None
+) -> str:
     """
     将搜索结果格式化为 LLM 可读的文本
     
     Args:
         search_result: 搜索结果字典
+        max_results: 每个关键词最多展示的结果数
+        snippet_chars: 每个结果的内容摘要字符数，0 表示只保留标题和 URL
+        include_answers: 是否包含摘要答案
+        exclude_urls: 需要跳过的 URL（已在其他搜索结果中出现）
     
     Returns:
         格式化的文本字符串
@@ -625,11 +959,16 @@ def format_search_results_for_llm(search_result: Dict[str, Any]) -> str:
             keyword = query.get("keyword", "未知")
             response_data = query.get("response", {})
             results = response_data.get("results", [])
+            if exclude_urls:
+                results = [result for result in results if result.get("url") not in exclude_urls]
             
             formatted_text += f"关键词: {keyword}\n"
-            formatted_text += f"找到 {len(results)} 个结果：\n\n"
+            if query.get("duplicates"):
+                formatted_text += f"找到 {len(results)} 个新结果（另有 {query['duplicates']} 个与之前的结果重复，已省略）：\n\n"
+            else:
+                formatted_text += f"找到 {len(results)} 个结果：\n\n"
             
-            for i, result in enumerate(results[:5], 1):  # 只取前5个结果
+            for i, result in enumerate(results[:max_results], 1):
                 title = result.get("title", "无标题")
                 url = result.get("url", "")
                 content = result.get("content", "")
@@ -637,121 +976,790 @@ def format_search_results_for_llm(search_result: Dict[str, Any]) -> str:
                 
                 formatted_text += f"{i}. {title} (相关性: {score:.2f})\n"
                 formatted_text += f"   URL: {url}\n"
-                formatted_text += f"   内容: {content[:200]}...\n\n"
+                if snippet_chars > 0:
+                    formatted_text += f"   内容: {content[:snippet_chars]}...\n\n"
+                else:
+                    formatted_text += "\n"
             
             # 如果有摘要答案，也包含进去
-            if response_data.get("answer"):
+            if include_answers and response_data.get("answer"):
                 formatted_text += f"摘要: {response_data['answer']}\n\n"
     
     # 如果有综合答案，也包含进去
-    if search_result.get("combined_answer"):
+    if include_answers and search_result.get("combined_answer"):
         formatted_text += f"综合答案: {search_result['combined_answer']}\n"
     
     return formatted_text
 
 
-# ==================== Chat API 端点 ====================
+# ==================== 上游错误处理 ====================
 
-@app.post(
-    "/chat",
-    response_model=ChatResponse,
-    tags=["Chat"],
-    summary="Chat 对话（Agentic Loop with Search）",
-    description="""
-    ## Chat 端点 - Agentic Loop with Search Tool (最多四轮)
+def upstream_http_exception(e: Exception, where: str = "chat") -> HTTPException:
+    """
+    将调用 AI Builder 时出现的异常转换为 HTTPException
     
-    这个端点实现了 Agentic Loop（代理循环），AI 可以自主决定是否使用搜索工具来获取信息。
+    Args:
+        e: 上游调用抛出的异常
+        where: 出错的端点，用于错误计数
     
-    ### 工作流程
-    1. **第一轮**：AI 接收用户输入，并可以选择调用 `search_web` 工具来搜索信息
-    2. **工具执行**：如果 AI 决定调用工具，系统会执行搜索并获取结果
-    3. **第二轮**：如果第一轮调用了工具，AI 可以继续调用工具进行更深入的搜索
-    4. **第三轮**：如果前两轮调用了工具，AI 可以继续调用工具进行更深入的搜索
-    5. **第四轮**：无论前面如何，第四轮不提供工具，强制生成最终答案
-    6. **返回结果**：AI 基于所有搜索结果生成最终回复
+    Returns:
+        对应的 HTTPException
+    """
+    metrics.ERRORS.labels(where, type(e).__name__).inc()
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, CircuitOpenError):
+        return HTTPException(
+            status_code=503,
+            detail=f"AI Builder 服务暂时不可用（{e.name} 熔断中），请稍后重试",
+            headers={"Retry-After": str(max(1, round(e.retry_after)))}
+        )
+    if isinstance(e, CachedSearchError) and e.status_code is not None:
+        # 上游拒绝了这些关键词：保留原状态码，不提示重试
+        return HTTPException(status_code=e.status_code, detail=f"搜索失败（{e}）")
+    if isinstance(e, CachedSearchError):
+        return HTTPException(
+            status_code=503,
+            detail=f"搜索近期失败，请稍后重试（{e}）",
+            headers={"Retry-After": str(max(1, round(e.retry_after)))}
+        )
+    if isinstance(e, UpstreamOverloaded):
+        return HTTPException(
+            status_code=503,
+            detail=f"AI Builder 服务繁忙（{e.name}），请稍后重试",
+            headers={"Retry-After": str(max(1, round(e.retry_after)))}
+        )
+    if isinstance(e, upstream.TIMEOUT_ERRORS):
+        return HTTPException(
+            status_code=500,
+            detail="请求超时，AI Builder 服务响应时间过长"
+        )
+    if isinstance(e, httpx.TransportError):
+        return HTTPException(
+            status_code=500,
+            detail="无法连接到 AI Builder 服务，请检查网络连接"
+        )
+    if isinstance(e, httpx.HTTPStatusError):
+        error_detail = f"AI Builder API 错误: {e.response.status_code}"
+        try:
+            error_body = e.response.json()
+            if "detail" in error_body:
+                error_detail = error_body["detail"]
+            elif "message" in error_body:
+                error_detail = error_body["message"]
+        except Exception:
+            error_detail = e.response.text or error_detail
+        
+        return HTTPException(
+            status_code=e.response.status_code,
+            detail=error_detail
+        )
+    return HTTPException(
+        status_code=500,
+        detail=f"处理请求时发生错误: {str(e)}"
+    )
+
+
+# ==================== Agentic Loop ====================
+
+# 轮次策略（ROUND_POLICY）：决定每轮是否还提供工具，不提供工具的一轮生成最终答案
+round_policy = create_policy()
+
+
+def upstream_load() -> float:
+    """上游负载：chat 和 search 并发限制器中较高的利用率"""
+    return max(limiter.utilization() for limiter in upstream.limiters.values())
+
+
+# /chat 响应缓存（CHAT_CACHE_ENABLED，默认关闭）
+chat_cache = response_cache.from_env()
+
+
+def chat_cache_key(request: ChatRequest) -> str:
+    return response_cache.cache_key(
+        [(msg.role, msg.content) for msg in request.messages],
+        request.model, request.temperature, request.max_tokens, request.max_rounds
+    )
+
+
+def store_chat_response(key: str, response: Dict[str, Any]) -> Optional[bytes]:
+    """
+    按 ChatResponse 校验并序列化最终回复，完整的回答（finish_reason 为 stop）写入响应缓存
     
-    ### 特点
-    - 最多支持四轮交互
-    - 前3轮可以调用工具
-    - 第4轮强制生成最终答案，避免无限循环
+    Returns:
+        序列化后的 JSON；不符合 ChatResponse 结构时返回 None（交给 FastAPI 按原流程处理）
+    """
+    try:
+        body = ChatResponse.model_validate(response).model_dump_json().encode("utf-8")
+    except ValueError:
+        return None
+    choices = response.get("choices") or []
+    if choices and choices[0].get("finish_reason") == "stop" and choices[0].get("message", {}).get("content"):
+        chat_cache.set(key, body)
+    return body
+
+# 非流式请求检查客户端是否断开的间隔（秒）；流式响应由 starlette 监听断开
+DISCONNECT_POLL_INTERVAL = env_float("DISCONNECT_POLL_INTERVAL", 0.5)
+# 客户端断开时记录的状态码（nginx 约定的 Client Closed Request）
+CLIENT_CLOSED_REQUEST = 499
+
+DEADLINE_HEADER = "x-deadline-ms"
+
+
+def format_sse(event: str, data: Any) -> str:
+    """将事件编码为一条 Server-Sent Events 消息"""
+    return f"event: {event}\ndata: {json_lib.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def summarize_tool_result(result: Dict[str, Any], round_num: int) -> Dict[str, Any]:
+    """
+    生成工具执行结果的摘要（用于流式事件，不包含完整搜索内容）
     
-    ### 功能特点
-    - AI 自主决定是否需要搜索
-    - 支持单轮工具调用（只执行一次搜索）
-    - 自动将搜索结果整合到最终回复中
-    - 默认使用 GPT-5 模型
-    - 支持完整的 OpenAI 兼容格式
+    Args:
+        result: execute_single_tool_call 的返回值
+        round_num: 当前轮次
     
-    ### 请求参数
+    Returns:
+        摘要字典
+    """
+    summary = {
+        "round": round_num,
+        "id": result.get("tool_call_id"),
+        "name": result.get("function_name"),
+        "success": result.get("success", False)
+    }
+    search_result = result.get("search_result")
+    if search_result is not None:
+        summary["keywords"] = result.get("keywords", [])
+        queries = search_result.get("queries", [])
+        sources = []
+        result_count = 0
+        for query in queries:
+            results = query.get("response", {}).get("results", [])
+            result_count += len(results)
+            for item in results[:2]:
+                sources.append({"title": item.get("title", "无标题"), "url": item.get("url", "")})
+        summary["result_count"] = result_count
+        summary["sources"] = sources
+    if not summary["success"]:
+        summary["error"] = result.get("result_text")
+    return summary
+
+
+async def stream_completion(
+    payload: Dict[str, Any],
+    round_num: int,
+    emit: Callable[[str, Any], Awaitable[None]]
+) -> Dict[str, Any]:
+    """
+    以流式方式请求一轮 chat completion
     
-    - **messages** (必需): 对话消息列表
-      - 每个消息包含 `role` (system/user/assistant) 和 `content`
-      - 至少需要一条消息
-    - **model** (可选): 模型名称，默认为 "gpt-5"
-    - **temperature** (可选): 生成随机性，0-2 之间
-    - **max_tokens** (可选): 最大生成 token 数
-    - **stream** (可选): 是否流式响应，默认 false
+    逐块解析上游 SSE，内容增量立即通过 emit 转发给客户端（不等待完整回复），
+    同时拼装出与非流式响应结构相同的 round_response。
     
-    ### 使用示例
+    Args:
+        payload: 请求负载
+        round_num: 当前轮次
+        emit: 事件回调
     
-    **基本对话（不需要搜索）：**
-    ```json
-    POST /chat
-    {
-        "messages": [
-            {"role": "user", "content": "你好，请介绍一下你自己"}
-        ]
+    Returns:
+        与非流式接口结构相同的响应字典
+    """
+    payload = dict(payload, stream=True)
+    round_response: Dict[str, Any] = {
+        "id": "",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": payload["model"]
     }
-    ```
-    
-    **需要搜索的对话（AI 会自动调用搜索工具）：**
-    ```json
-    POST /chat
-    {
-        "messages": [
-            {"role": "user", "content": "FastAPI 的最新版本是什么？它有什么新特性？"}
-        ]
+    content_parts: List[str] = []
+    tool_calls: Dict[int, Dict[str, Any]] = {}
+    finish_reason = None
+    usage = None
+    
+    # 读到 [DONE] 时提前结束，立即关闭上游流（释放并发名额并把本次调用记为成功）
+    async with aclosing(upstream.stream_lines(upstream.CHAT_COMPLETIONS_PATH, payload)) as stream:
+        async for line in stream:
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            try:
+                chunk = json_lib.loads(data)
+            except ValueError:
+                logger.warning("无法解析的流式数据块: %s", data[:200])
+                continue
+        
+            for key in ("id", "created", "model"):
+                if chunk.get(key):
+                    round_response[key] = chunk[key]
+            if chunk.get("usage"):
+                usage = chunk["usage"]
+        
+            for choice in chunk.get("choices") or []:
+                delta = choice.get("delta") or {}
+                if delta.get("content"):
+                    content_parts.append(delta["content"])
+                    await emit("delta", {"round": round_num, "content": delta["content"]})
+                # 工具调用以增量形式到达：按 index 拼接 id / name / arguments
+                for tool_call_delta in delta.get("tool_calls") or []:
+                    entry = tool_calls.setdefault(tool_call_delta.get("index", 0), {
+                        "id": None,
+                        "type": "function",
+                        "function": {"name": "", "arguments": ""}
+                    })
+                    if tool_call_delta.get("id"):
+                        entry["id"] = tool_call_delta["id"]
+                    if tool_call_delta.get("type"):
+                        entry["type"] = tool_call_delta["type"]
+                    function_delta = tool_call_delta.get("function") or {}
+                    if function_delta.get("name"):
+                        entry["function"]["name"] += function_delta["name"]
+                    if function_delta.get("arguments"):
+                        entry["function"]["arguments"] += function_delta["arguments"]
+                if choice.get("finish_reason"):
+                    finish_reason = choice["finish_reason"]
+    
+    message: Dict[str, Any] = {
+        "role": "assistant",
+        "content": "".join(content_parts) or None
     }
-    ```
+    if tool_calls:
+        message["tool_calls"] = [tool_calls[index] for index in sorted(tool_calls)]
+    round_response["choices"] = [{"index": 0, "message": message, "finish_reason": finish_reason}]
+    if usage:
+        round_response["usage"] = usage
+    return round_response
+
+
+async def run_agentic_loop(
+    request: ChatRequest,
+    emit: Optional[Callable[[str, Any], Awaitable[None]]] = None
+) -> Dict[str, Any]:
+    """
+    执行 Agentic Loop（默认最多四轮），结束时记录一条 chat.request 事件
     
-    在这个例子中：
-    1. **第一轮**：AI 会判断需要搜索最新信息，自动调用 `search_web` 工具
-    2. **工具执行**：系统执行搜索并获取结果
-    3. **第二轮**：AI 可以继续调用工具进行更深入的搜索（如果需要）
-    4. **第三轮**：AI 可以继续调用工具进行更深入的搜索（如果需要）
-    5. **第四轮**：强制生成最终答案，整合所有搜索结果
-    6. **返回结果**：包含最新信息的最终回复
+    - 前几轮：可以提供工具；轮次策略在新结果很少或上游负载高时提前停止提供工具
+    - 最后一轮：强制不提供工具，生成最终答案
     
-    **带参数的高级请求：**
-    ```json
-    POST /chat
-    {
-        "messages": [
-            {"role": "system", "content": "你是一个有用的助手，可以使用网络搜索获取最新信息"},
-            {"role": "user", "content": "Python 3.12 有什么新特性？"}
-        ],
-        "model": "gpt-5",
-        "temperature": 0.7,
-        "max_tokens": 1000
-    }
-    ```
+    整个循环在请求截止时间（request.deadline_ms 或服务端默认值）内执行，
+    剩余时间只够生成答案时跳过后续工具轮次，直接进入最后一轮。
     
-    **使用 curl：**
-    ```bash
-    curl -X POST "http://localhost:8000/chat" \\
-         -H "Content-Type: application/json" \\
-         -d '{
-             "messages": [
-                 {"role": "user", "content": "你好"}
-             ]
-         }'
-    ```
+    Args:
+        request: ChatRequest 对象
+        emit: 流式模式下的事件回调；为 None 时使用非流式上游请求
     
-    ### 响应示例
+    Returns:
+        最后一轮的上游响应
     
-    **成功响应 (200):**
-    ```json
-    {
+    Raises:
+        调用上游时的异常，由调用方转换为 HTTP 错误
+    """
+    summary: Dict[str, Any] = {
+        "model": request.model,
+        "stream": emit is not None,
+        "messages": len(request.messages),
+        "rounds": 0,
+        "max_rounds": round_policy.rounds_for(request.max_rounds),
+        "tool_calls": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+    }
+    started = time.perf_counter()
+    status = "error"
+    request_deadline = deadline.Deadline.from_ms(request.deadline_ms)
+    summary["deadline_ms"] = round(request_deadline.total * 1000)
+    try:
+        with deadline.scope(request_deadline), \
+                tracing.span("chat", model=request.model, stream=emit is not None) as chat_span:
+            response = await _run_rounds(request, emit, summary)
+            chat_span.set_attributes(**summary)
+        status = "ok"
+        return response
+    except asyncio.CancelledError:
+        # 客户端断开（或服务关闭）：后续轮次不再开始
+        status = "cancelled"
+        metrics.CHAT_CANCELLED_WORK.labels("round").inc(summary["max_rounds"] - summary["rounds"])
+        raise
+    except Exception as e:
+        summary["error"] = type(e).__name__
+        raise
+    finally:
+        metrics.CHAT_ROUNDS.labels("true" if emit is not None else "false").observe(summary["rounds"])
+        log_event(
+            logger, "chat.request",
+            status=status,
+            duration_ms=round((time.perf_counter() - started) * 1000, 1),
+            **summary
+        )
+
+
+async def _run_rounds(
+    request: ChatRequest,
+    emit: Optional[Callable[[str, Any], Awaitable[None]]],
+    summary: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Agentic Loop 的各轮处理，每轮结束时记录一条 chat.round 事件，并累计到 summary"""
+    # 准备消息列表
+    messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
+    
+    # 本请求的工具调用会话（受全局和每请求并发上限约束）
+    tool_session = tool_scheduler.session()
+    
+    # 上下文预算：超出预算时压缩较早轮次的搜索结果
+    context = ContextBudget(request.model, format_search_results_for_llm)
+    
+    # 搜索结果去重：每条工具消息只包含本请求中尚未发给模型的结果
+    result_store = SearchResultStore()
+    
+    stream_label = "true" if emit is not None else "false"
+    
+    # 请求截止时间；工具轮次在预留给最后一轮的时间之前结束
+    request_deadline = deadline.current() or deadline.Deadline.from_ms(None)
+    final_reserve = request_deadline.final_round_reserve()
+    final_forced = False
+    
+    max_rounds = summary["max_rounds"]
+    # 上一轮工具调用的新结果比例（None 表示还没有结果）
+    novelty: Optional[float] = None
+    
+    # ========== 循环处理（默认最多四轮）==========
+    for round_num in range(1, max_rounds + 1):
+        # 剩余时间只够生成答案时，跳过后续工具轮次
+        if not final_forced and round_num < max_rounds and request_deadline.remaining() <= final_reserve:
+            final_forced = True
+            metrics.CHAT_DEADLINE_FINAL_ROUNDS.labels("reserve").inc()
+            logger.info("剩余时间不足（%.1fs），跳过工具轮次，直接生成最终答案", request_deadline.remaining())
+        
+        # 判断是否提供工具：由轮次策略决定，最后一轮（或时间不足时）不提供
+        if not final_forced:
+            load = upstream_load()
+            stop_reason = round_policy.stop_reason(round_num, max_rounds, novelty, load)
+            if stop_reason is not None:
+                final_forced = True
+                metrics.CHAT_ROUND_STOPS.labels(stop_reason).inc()
+                if round_num < max_rounds:
+                    logger.info("第 %d 轮停止提供工具: %s（novelty=%s, load=%.2f）", round_num, stop_reason, novelty, load)
+        provide_tools = not final_forced
+        round_deadline = request_deadline.shrink(final_reserve) if provide_tools else request_deadline
+        
+        with tracing.span("chat.round", round=round_num) as round_span, deadline.scope(round_deadline):
+            summary["rounds"] = round_num
+            
+            # 构建请求负载
+            payload = {
+                "model": request.model,
+                "messages": messages
+            }
+            
+            # 前3轮提供工具
+            if provide_tools:
+                payload["tools"] = [get_search_tool_definition()]
+                payload["tool_choice"] = "auto"
+            
+            # 添加可选参数
+            if request.temperature is not None:
+                payload["temperature"] = request.temperature
+            if request.max_tokens is not None:
+                payload["max_tokens"] = request.max_tokens
+            
+            with tracing.span("context.fit", budget=context.budget) as fit_span:
+                tokens_saved = context.fit(messages)
+                fit_span.set_attribute("tokens_saved", tokens_saved)
+            round_event: Dict[str, Any] = {
+                "round": round_num,
+                "tools_available": provide_tools,
+                "messages": len(messages),
+                "tokens_saved": tokens_saved,
+                "deadline_left_ms": round(request_deadline.remaining() * 1000),
+            }
+            
+            # 发送请求（流式模式下逐块转发 token 增量）
+            upstream_started = time.perf_counter()
+            with metrics.CHAT_ROUND_UPSTREAM_DURATION.labels(str(round_num), stream_label).time(), \
+                    tracing.span("llm.completion", tools_available=provide_tools, stream=emit is not None) as llm_span:
+                try:
+                    if emit is not None:
+                        await emit("round_start", {"round": round_num, "tools_available": provide_tools})
+                        round_response = await stream_completion(payload, round_num, emit)
+                    else:
+                        round_response = await upstream.post_json(
+                            upstream.CHAT_COMPLETIONS_PATH, payload, keep_raw=fast_json.FAST_PATH
+                        )
+                except asyncio.CancelledError:
+                    metrics.CHAT_CANCELLED_WORK.labels("completion").inc()
+                    raise
+                except upstream.TIMEOUT_ERRORS:
+                    # 工具轮次用完了自己的时间片：放弃这一轮，用剩余时间生成最终答案
+                    if not provide_tools or request_deadline.expired():
+                        raise
+                    round_timed_out = True
+                else:
+                    round_timed_out = False
+            round_event["upstream_ms"] = round((time.perf_counter() - upstream_started) * 1000, 1)
+            if round_timed_out:
+                final_forced = True
+                metrics.CHAT_DEADLINE_FINAL_ROUNDS.labels("completion_timeout").inc()
+                logger.warning("第 %d 轮上游调用超出时间片，直接生成最终答案", round_num)
+                log_event(logger, "chat.round", finish_reason="timeout", **round_event)
+                continue
+            
+            # 检查响应
+            choices = round_response.get("choices", [])
+            if not choices:
+                logger.warning("响应中没有 choices，直接返回")
+                log_event(logger, "chat.round", **round_event)
+                return round_response
+            
+            choice = choices[0]
+            message = choice.get("message", {})
+            tool_calls = message.get("tool_calls")
+            finish_reason = choice.get("finish_reason")
+            usage = round_response.get("usage") or {}
+            prompt_tokens = usage.get("prompt_tokens") or 0
+            completion_tokens = usage.get("completion_tokens") or 0
+            metrics.LLM_TOKENS.labels(request.model, "prompt").inc(prompt_tokens)
+            metrics.LLM_TOKENS.labels(request.model, "completion").inc(completion_tokens)
+            metrics.CHAT_TOOL_CALLS_PER_ROUND.labels(str(round_num)).observe(len(tool_calls or ()))
+            summary["prompt_tokens"] += prompt_tokens
+            summary["completion_tokens"] += completion_tokens
+            summary["tool_calls"] += len(tool_calls or ())
+            round_event.update(
+                finish_reason=finish_reason,
+                tool_calls=len(tool_calls or ()),
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+            )
+            llm_span.set_attributes(
+                finish_reason=finish_reason,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+            )
+            round_span.set_attributes(tool_calls=len(tool_calls or ()))
+            
+            # 将 assistant 消息添加到消息历史
+            assistant_message = {
+                "role": "assistant",
+                "content": message.get("content")
+            }
+            if tool_calls:
+                assistant_message["tool_calls"] = tool_calls
+            messages.append(assistant_message)
+            
+            # 如果没有工具调用，或者 finish_reason 是 "stop"，直接返回
+            if not tool_calls or finish_reason == "stop":
+                if message.get("content"):
+                    log_event(logger, "chat.answer", logging.DEBUG, round=round_num, preview=message["content"][:200])
+                log_event(logger, "chat.round", **round_event)
+                return round_response
+            
+            # ========== 执行工具调用（并行执行）==========
+            for tool_call in tool_calls:
+                function = tool_call.get("function", {})
+                function_name = function.get("name")
+                tool_call_id = tool_call.get("id")
+                
+                # 解析参数（用于日志和流式事件）
+                try:
+                    function_args = json_lib.loads(function.get("arguments", "{}"))
+                except Exception as e:
+                    logger.warning("工具调用 %s 参数解析失败: %s", tool_call_id, e)
+                    function_args = {}
+                log_event(logger, "chat.tool_call", logging.DEBUG,
+                          round=round_num, id=tool_call_id, name=function_name, arguments=function_args)
+                
+                if emit is not None:
+                    await emit("tool_call", {
+                        "round": round_num,
+                        "id": tool_call_id,
+                        "name": function_name,
+                        "arguments": function_args
+                    })
+            
+            # 并行执行所有工具调用
+            tools_started = time.perf_counter()
+            tool_results = []
+            store_mark = result_store.mark()
+            
+            # 提交所有任务到全局工具调度器
+            task_to_tool_call = {
+                tool_session.submit(execute_single_tool_call, tool_call, result_store): tool_call
+                for tool_call in tool_calls
+            }
+            pending = set(task_to_tool_call)
+            try:
+                # 收集结果（按完成顺序），最多等到本轮时间片结束
+                while pending:
+                    done, pending = await asyncio.wait(
+                        pending, timeout=round_deadline.remaining(), return_when=asyncio.FIRST_COMPLETED
+                    )
+                    if not done:
+                        break
+                    for task in done:
+                        tool_call = task_to_tool_call[task]
+                        try:
+                            result = task.result()
+                            tool_results.append(result)
+                            if not result["success"]:
+                                logger.error("工具调用 %s 失败: %s", result["tool_call_id"], result["result_text"])
+                            elif logger.isEnabledFor(logging.DEBUG) and "search_result" in result:
+                                log_event(logger, "chat.tool_result", logging.DEBUG,
+                                          round=round_num, id=result["tool_call_id"],
+                                          queries=[
+                                              {
+                                                  "keyword": query.get("keyword"),
+                                                  "results": len(query.get("response", {}).get("results", [])),
+                                                  "top": [item.get("title") for item in query.get("response", {}).get("results", [])[:2]]
+                                              }
+                                              for query in result["search_result"].get("queries", [])
+                                          ])
+                        except Exception as e:
+                            logger.error("工具调用执行异常: %s", e)
+                            metrics.ERRORS.labels("tool", type(e).__name__).inc()
+                            result = {
+                                "tool_call_id": tool_call.get("id"),
+                                "function_name": tool_call.get("function", {}).get("name", "unknown"),
+                                "result_text": f"执行异常: {str(e)}",
+                                "success": False
+                            }
+                            tool_results.append(result)
+                        
+                        if emit is not None:
+                            await emit("tool_result", summarize_tool_result(result, round_num))
+            except asyncio.CancelledError:
+                metrics.CHAT_CANCELLED_WORK.labels("tool_call").inc(len(pending))
+                raise
+            finally:
+                # 请求异常退出或时间片用完时取消尚未完成的工具调用
+                for task in pending:
+                    task.cancel()
+            
+            if pending:
+                # 超时的工具调用也要有对应的工具消息
+                final_forced = True
+                metrics.CHAT_DEADLINE_FINAL_ROUNDS.labels("tool_timeout").inc()
+                logger.warning("第 %d 轮有 %d 个工具调用超出时间片，已取消", round_num, len(pending))
+                for task in pending:
+                    tool_call = task_to_tool_call[task]
+                    tool_results.append({
+                        "tool_call_id": tool_call.get("id"),
+                        "function_name": tool_call.get("function", {}).get("name", "unknown"),
+                        "result_text": "搜索超时（请求剩余时间不足），已取消",
+                        "success": False
+                    })
+            
+            # 按原始顺序添加结果到消息历史（保持工具调用顺序）
+            tool_results_dict = {r["tool_call_id"]: r for r in tool_results}
+            for tool_call in tool_calls:
+                tool_call_id = tool_call.get("id")
+                if tool_call_id in tool_results_dict:
+                    result = tool_results_dict[tool_call_id]
+                    tool_message = {
+                        "role": "tool",
+                        "content": result["result_text"],
+                        "tool_call_id": tool_call_id
+                    }
+                    messages.append(tool_message)
+                    if result.get("success") and "llm_result" in result:
+                        context.register(tool_call_id, result["llm_result"], tool_message)
+            
+            # 本轮没有拿到任何结果（例如搜索失败）时不据此判断
+            novelty = result_store.novelty(store_mark) if result_store.total > store_mark[0] else None
+            round_event.update(
+                tools_ms=round((time.perf_counter() - tools_started) * 1000, 1),
+                tool_failures=sum(1 for r in tool_results if not r.get("success")),
+                novelty=round(novelty, 3) if novelty is not None else None,
+            )
+            log_event(logger, "chat.round", **round_event)
+            
+            # 继续下一轮，由轮次策略决定下一轮是否还提供工具
+        
+    # 如果循环结束（理论上不应该到达这里，因为最后一轮不提供工具，应该返回）
+    # 返回最后一轮的响应
+    return round_response
+
+
+async def chat_event_stream(request: ChatRequest, cache_key: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    流式模式：运行 Agentic Loop 并以 SSE 推送过程事件
+    
+    提供 cache_key 时，完整的最终回复写入响应缓存。
+    
+    事件类型：
+    - round_start: 每轮开始
+    - delta: 上游返回的 token 增量
+    - tool_call: AI 发起的工具调用
+    - tool_result: 工具执行结果摘要
+    - trace: 请求追踪（仅在请求头 X-Debug-Trace: 1 时）
+    - done: 最终响应（结构同非流式接口）
+    - error: 处理失败
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    
+    async def emit(event: str, data: Any) -> None:
+        await queue.put(format_sse(event, data))
+    
+    async def produce() -> None:
+        try:
+            final_response = await run_agentic_loop(request, emit)
+            trace = tracing.current_trace()
+            if trace is not None and trace.debug:
+                # 流式响应头已经发出，trace 以事件形式在 done 之前推送
+                await emit("trace", trace.to_dict())
+            await emit("done", final_response)
+            if cache_key is not None:
+                store_chat_response(cache_key, final_response)
+        except Exception as e:
+            error = upstream_http_exception(e)
+            await emit("error", {"status_code": error.status_code, "detail": error.detail})
+        finally:
+            await queue.put(None)
+    
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            message = await queue.get()
+            if message is None:
+                break
+            yield message
+    finally:
+        # 客户端断开时 starlette 取消响应生成器，这里连同 Agentic Loop 一起取消
+        if not producer.done():
+            metrics.CLIENT_DISCONNECTS.labels("true").inc()
+            producer.cancel()
+
+
+# ==================== Chat API 端点 ====================
+
+@app.post(
+    "/chat",
+    response_model=ChatResponse,
+    tags=["Chat"],
+    summary="Chat 对话（Agentic Loop with Search）",
+    description="""
+    ## Chat 端点 - Agentic Loop with Search Tool (最多四轮)
+    
+    这个端点实现了 Agentic Loop（代理循环），AI 可以自主决定是否使用搜索工具来获取信息。
+    
+    ### 工作流程
+    1. **第一轮**：AI 接收用户输入，并可以选择调用 `search_web` 工具来搜索信息
+    2. **工具执行**：如果 AI 决定调用工具，系统会执行搜索并获取结果
+    3. **第二轮**：如果第一轮调用了工具，AI 可以继续调用工具进行更深入的搜索
+    4. **第三轮**：如果前两轮调用了工具，AI 可以继续调用工具进行更深入的搜索
+    5. **第四轮**：无论前面如何，第四轮不提供工具，强制生成最终答案
+    6. **返回结果**：AI 基于所有搜索结果生成最终回复
+    
+    ### 特点
+    - 默认最多支持四轮交互（可通过 `max_rounds` 减少）
+    - 前3轮可以调用工具
+    - 第4轮强制生成最终答案，避免无限循环
+    - 上一轮搜索几乎没有新结果（URL 和内容都与之前重复）或上游负载较高时，提前进入最后一轮
+    
+    ### 功能特点
+    - AI 自主决定是否需要搜索
+    - 支持单轮工具调用（只执行一次搜索）
+    - 自动将搜索结果整合到最终回复中
+    - 默认使用 GPT-5 模型
+    - 支持完整的 OpenAI 兼容格式
+    
+    ### 请求参数
+    
+    - **messages** (必需): 对话消息列表
+      - 每个消息包含 `role` (system/user/assistant) 和 `content`
+      - 至少需要一条消息
+    - **model** (可选): 模型名称，默认为 "gpt-5"
+    - **temperature** (可选): 生成随机性，0-2 之间
+    - **max_tokens** (可选): 最大生成 token 数
+    - **stream** (可选): 是否流式响应，默认 false
+    - **max_rounds** (可选): 最多轮数（含最终答案一轮），默认由服务端决定（4）
+    - **deadline_ms** (可选): 整个请求的截止时间（毫秒），也可用请求头 `X-Deadline-Ms` 指定；
+      剩余时间不足时跳过工具轮次，直接生成最终答案
+    
+    ### 流式响应（stream = true）
+    
+    返回 `text/event-stream`，按发生顺序推送以下事件：
+    - `round_start`: 每轮开始，`{"round": 1, "tools_available": true}`
+    - `delta`: 上游 token 增量，`{"round": 1, "content": "..."}`
+    - `tool_call`: AI 发起的工具调用（含参数）
+    - `tool_result`: 工具执行结果摘要（结果数量、前几个来源）
+    - `done`: 最终响应，结构与非流式响应相同
+    - `error`: 处理失败，`{"status_code": 500, "detail": "..."}`
+    
+    ### 响应缓存
+    
+    服务端设置 `CHAT_CACHE_ENABLED=1` 时，完全相同的请求（消息、模型、temperature、max_tokens、
+    max_rounds）直接返回缓存的最终回复（流式模式下只推送 `done` 事件）。
+    - temperature > 0 的请求默认不使用缓存，请求头 `X-Chat-Cache: force` 时仍然使用
+    - 请求头 `Cache-Control: no-cache` 跳过缓存读取，`no-store` 既不读也不写
+    - 响应头 `X-Cache`: `HIT` / `MISS` / `BYPASS`
+    
+    ### 请求追踪
+    
+    请求头 `X-Debug-Trace: 1` 时，响应头 `X-Trace-Id` / `X-Trace` 返回本次请求的 span
+    （请求 → 轮次 → 上游调用 / 工具调用 → 格式化，含耗时和 token、关键词等属性）；
+    流式模式下 trace 以 `trace` 事件在 `done` 之前推送。
+    
+    ### 使用示例
+    
+    **基本对话（不需要搜索）：**
+    ```json
+    POST /chat
+    {
+        "messages": [
+            {"role": "user", "content": "你好，请介绍一下你自己"}
+        ]
+    }
+    ```
+    
+    **需要搜索的对话（AI 会自动调用搜索工具）：**
+    ```json
+    POST /chat
+    {
+        "messages": [
+            {"role": "user", "content": "FastAPI 的最新版本是什么？它有什么新特性？"}
+        ]
+    }
+    ```
+    
+    在这个例子中：
+    1. **第一轮**：AI 会判断需要搜索最新信息，自动调用 `search_web` 工具
+    2. **工具执行**：系统执行搜索并获取结果
+    3. **第二轮**：AI 可以继续调用工具进行更深入的搜索（如果需要）
+    4. **第三轮**：AI 可以继续调用工具进行更深入的搜索（如果需要）
+    5. **第四轮**：强制生成最终答案，整合所有搜索结果
+    6. **返回结果**：包含最新信息的最终回复
+    
+    **带参数的高级请求：**
+    ```json
+    POST /chat
+    {
+        "messages": [
+            {"role": "system", "content": "你是一个有用的助手，可以使用网络搜索获取最新信息"},
+            {"role": "user", "content": "Python 3.12 有什么新特性？"}
+        ],
+        "model": "gpt-5",
+        "temperature": 0.7,
+        "max_tokens": 1000
+    }
+    ```
+    
+    **使用 curl：**
+    ```bash
+    curl -X POST "http://localhost:8000/chat" \\
+         -H "Content-Type: application/json" \\
+         -d '{
+             "messages": [
+                 {"role": "user", "content": "你好"}
+             ]
+         }'
+    ```
+    
+    ### 响应示例
+    
+    **成功响应 (200):**
+    ```json
+    {
         "id": "chatcmpl-xxx",
         "object": "chat.completion",
         "created": 1234567890,
@@ -779,6 +1787,7 @@ def format_search_results_for_llm(search_result: Dict[str, Any]) -> str:
     - **401**: API token 未配置或无效
     - **422**: 请求参数验证错误
     - **500**: AI Builder 服务错误或网络错误
+    - **503**: 上游并发已满或已熔断，请按 `Retry-After` 头指定的秒数后重试
     """,
     response_description="AI Builder 返回的聊天完成响应",
     responses={
@@ -835,7 +1844,7 @@ def format_search_results_for_llm(search_result: Dict[str, Any]) -> str:
         }
     }
 )
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request, http_response: Response):
     """
     Chat 端点 - Agentic Loop with Search (最多四轮)
     
@@ -843,6 +1852,11 @@ async def chat(request: ChatRequest):
     - 第一轮、第二轮和第三轮：可以提供工具
     - 第四轮：强制不提供工具，生成最终答案
     
+    客户端中途断开时，进行中的上游调用和工具调用会被取消，后续轮次不再开始。
+    
+    截止时间（deadline_ms 字段或 X-Deadline-Ms 请求头）约束整个请求：每次上游调用的超时
+    不超过剩余时间，时间不足时跳过工具轮次，在截止时间内返回尽力而为的答案。
+    
     **参数：**
     - request: ChatRequest 对象，包含消息列表和可选参数
     
@@ -850,251 +1864,61 @@ async def chat(request: ChatRequest):
     - ChatResponse 对象，包含 AI 的响应
     """
     # 检查 API token
-    if not AI_BUILDER_API_KEY:
+    if not get_api_key():
         raise HTTPException(
             status_code=401,
             detail="AI Builder API token 未配置。请设置 AI_BUILDER_TOKEN 环境变量或确保 'AI builder API key:' 文件存在。"
         )
     
-    url = f"{AI_BUILDER_BASE_URL}/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {AI_BUILDER_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
-    # 准备消息列表
-    messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
-    
-    # 最大轮数：4轮
-    MAX_ROUNDS = 4
+    # 请求头中的截止时间（请求体未指定时使用）
+    if request.deadline_ms is None:
+        header_deadline = http_request.headers.get(DEADLINE_HEADER, "")
+        if header_deadline.isdigit() and int(header_deadline) > 0:
+            request.deadline_ms = int(header_deadline)
+    
+    # 响应缓存：命中时直接返回序列化好的回复（流式模式下作为 done 事件）
+    read_cache, write_cache = chat_cache.policy(request.temperature, http_request.headers)
+    cache_key = chat_cache_key(request) if read_cache or write_cache else None
+    if read_cache:
+        cached = chat_cache.get(cache_key)
+        if cached is not None:
+            headers = {"X-Cache": response_cache.HIT, "Age": str(cached.age())}
+            if request.stream:
+                return Response(
+                    b"event: done\ndata: " + cached.body + b"\n\n",
+                    media_type="text/event-stream",
+                    headers=dict(headers, **{"Cache-Control": "no-cache"})
+                )
+            return Response(cached.body, media_type="application/json", headers=headers)
+    x_cache = response_cache.MISS if write_cache else response_cache.BYPASS
+    
+    # 流式模式：以 SSE 推送每轮事件和 token 增量
+    if request.stream:
+        return StreamingResponse(
+            chat_event_stream(request, cache_key if write_cache else None),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Cache": x_cache}
+        )
     
     try:
-        logger.info("=" * 60)
-        logger.info("开始 Agentic Loop - Chat API 请求")
-        logger.info("=" * 60)
-        logger.info(f"用户消息数量: {len(messages)}")
-        logger.info(f"模型: {request.model}")
-        logger.info(f"最大轮数: {MAX_ROUNDS}")
-        
-        # ========== 循环处理最多三轮 ==========
-        for round_num in range(1, MAX_ROUNDS + 1):
-            logger.info("")
-            logger.info("-" * 60)
-            logger.info(f"第 {round_num} 轮开始")
-            logger.info("-" * 60)
-            
-            # 判断是否提供工具
-            # 前3轮可以提供工具，第4轮不提供
-            provide_tools = round_num < MAX_ROUNDS
-            
-            logger.info(f"是否提供工具: {provide_tools}")
-            if provide_tools:
-                logger.info("✓ 工具可用: search_web")
-            else:
-                logger.info(f"✗ 工具不可用（第{MAX_ROUNDS}轮，强制生成最终答案）")
-            
-            # 构建请求负载
-            payload = {
-                "model": request.model,
-                "messages": messages
-            }
-            
-            # 前3轮提供工具
-            if provide_tools:
-                payload["tools"] = [get_search_tool_definition()]
-                payload["tool_choice"] = "auto"
-            
-            # 添加可选参数
-            if request.temperature is not None:
-                payload["temperature"] = request.temperature
-            if request.max_tokens is not None:
-                payload["max_tokens"] = request.max_tokens
-            if request.stream is not None:
-                payload["stream"] = request.stream
-            
-            logger.info(f"发送请求到 AI Builder...")
-            logger.info(f"消息历史长度: {len(messages)}")
-            
-            # 发送请求
-            response = requests.post(url, headers=headers, json=payload, timeout=60)
-            response.raise_for_status()
-            round_response = response.json()
-            
-            # 检查响应
-            choices = round_response.get("choices", [])
-            if not choices:
-                logger.warning("响应中没有 choices，直接返回")
-                return round_response
-            
-            choice = choices[0]
-            message = choice.get("message", {})
-            tool_calls = message.get("tool_calls")
-            finish_reason = choice.get("finish_reason")
-            usage = round_response.get("usage", {})
-            
-            logger.info(f"响应状态: finish_reason = {finish_reason}")
-            logger.info(f"Token 使用: prompt={usage.get('prompt_tokens', 0)}, completion={usage.get('completion_tokens', 0)}, total={usage.get('total_tokens', 0)}")
-            
-            # 检查是否有工具调用
-            if tool_calls:
-                logger.info(f"✓ 检测到 {len(tool_calls)} 个工具调用")
-            else:
-                logger.info("✗ 没有工具调用")
-                if message.get("content"):
-                    content_preview = message.get("content", "")[:200]
-                    logger.info(f"AI 回复预览: {content_preview}...")
-            
-            # 将 assistant 消息添加到消息历史
-            assistant_message = {
-                "role": "assistant",
-                "content": message.get("content")
-            }
-            if tool_calls:
-                assistant_message["tool_calls"] = tool_calls
-            messages.append(assistant_message)
-            
-            # 如果没有工具调用，或者 finish_reason 是 "stop"，直接返回
-            if not tool_calls or finish_reason == "stop":
-                logger.info(f"第 {round_num} 轮结束：没有工具调用或已完成，返回响应")
-                logger.info("=" * 60)
-                return round_response
-            
-            # ========== 执行工具调用（并行执行）==========
-            logger.info("")
-            logger.info("执行工具调用（并行执行）:")
-            
-            # 先记录所有工具调用的信息
-            for idx, tool_call in enumerate(tool_calls, 1):
-                function = tool_call.get("function", {})
-                function_name = function.get("name")
-                function_args_str = function.get("arguments", "{}")
-                tool_call_id = tool_call.get("id")
-                
-                logger.info(f"  工具调用 #{idx}:")
-                logger.info(f"    ID: {tool_call_id}")
-                logger.info(f"    工具名称: {function_name}")
-                
-                # 解析参数用于日志
-                try:
-                    function_args = json_lib.loads(function_args_str)
-                    logger.info(f"    参数 (JSON): {json_lib.dumps(function_args, indent=6, ensure_ascii=False)}")
-                    if function_name == "search_web":
-                        keywords = function_args.get("keywords", [])
-                        max_results = function_args.get("max_results", 6)
-                        logger.info(f"      关键词: {keywords}")
-                        logger.info(f"      最大结果数: {max_results}")
-                except Exception as e:
-                    logger.warning(f"    参数解析失败: {e}")
-                    logger.info(f"    原始参数: {function_args_str}")
-            
-            # 并行执行所有工具调用
-            logger.info("")
-            logger.info("开始并行执行工具调用...")
-            tool_results = []
-            
-            with ThreadPoolExecutor(max_workers=len(tool_calls)) as executor:
-                # 提交所有任务
-                future_to_tool_call = {
-                    executor.submit(execute_single_tool_call, tool_call): tool_call 
-                    for tool_call in tool_calls
-                }
-                
-                # 收集结果（按完成顺序）
-                for future in as_completed(future_to_tool_call):
-                    tool_call = future_to_tool_call[future]
-                    try:
-                        result = future.result()
-                        tool_results.append(result)
-                        
-                        # 记录结果
-                        if result["success"]:
-                            if result["function_name"] == "search_web":
-                                search_result = result["search_result"]
-                                queries = search_result.get("queries", [])
-                                logger.info(f"  ✓ 工具调用 {result['tool_call_id']} 完成")
-                                logger.info(f"    返回 {len(queries)} 个关键词的搜索结果")
-                                
-                                for query in queries:
-                                    keyword = query.get("keyword", "未知")
-                                    response_data = query.get("response", {})
-                                    results = response_data.get("results", [])
-                                    logger.info(f"      关键词 '{keyword}': {len(results)} 个结果")
-                                    
-                                    # 显示前2个结果的摘要
-                                    for i, result_item in enumerate(results[:2], 1):
-                                        title = result_item.get("title", "无标题")
-                                        score = result_item.get("score", 0)
-                                        logger.info(f"        [{i}] {title} (相关性: {score:.2f})")
-                            else:
-                                logger.info(f"  ✓ 工具调用 {result['tool_call_id']} 完成")
-                        else:
-                            logger.error(f"  ✗ 工具调用 {result['tool_call_id']} 失败")
-                    except Exception as e:
-                        logger.error(f"  ✗ 工具调用执行异常: {e}")
-                        tool_results.append({
-                            "tool_call_id": tool_call.get("id"),
-                            "function_name": tool_call.get("function", {}).get("name", "unknown"),
-                            "result_text": f"执行异常: {str(e)}",
-                            "success": False
-                        })
-            
-            # 按原始顺序添加结果到消息历史（保持工具调用顺序）
-            tool_results_dict = {r["tool_call_id"]: r for r in tool_results}
-            for tool_call in tool_calls:
-                tool_call_id = tool_call.get("id")
-                if tool_call_id in tool_results_dict:
-                    result = tool_results_dict[tool_call_id]
-                    messages.append({
-                        "role": "tool",
-                        "content": result["result_text"],
-                        "tool_call_id": tool_call_id
-                    })
-                    logger.info(f"  ✓ 工具结果 {tool_call_id} 已添加到消息历史")
-            
-            logger.info(f"所有工具调用执行完成（共 {len(tool_calls)} 个）")
-            
-            logger.info(f"第 {round_num} 轮结束：已执行工具调用，准备下一轮")
-            
-            # 如果这是第4轮，已经执行完工具调用，下一轮循环会强制不提供工具
-            # 如果这是前3轮，继续循环，下一轮仍然可以提供工具
-        
-        # 如果循环结束（理论上不应该到达这里，因为第4轮应该返回）
-        # 返回最后一轮的响应
-        logger.info("=" * 60)
-        logger.info("Agentic Loop 完成")
-        logger.info("=" * 60)
-        return round_response
-        
-    except requests.exceptions.Timeout:
-        raise HTTPException(
-            status_code=500,
-            detail="请求超时，AI Builder 服务响应时间过长"
-        )
-    except requests.exceptions.ConnectionError:
-        raise HTTPException(
-            status_code=500,
-            detail="无法连接到 AI Builder 服务，请检查网络连接"
-        )
-    except requests.exceptions.HTTPError as e:
-        error_detail = f"AI Builder API 错误: {e.response.status_code}"
-        try:
-            error_body = e.response.json()
-            if "detail" in error_body:
-                error_detail = error_body["detail"]
-            elif "message" in error_body:
-                error_detail = error_body["message"]
-        except:
-            error_detail = e.response.text or error_detail
-        
-        raise HTTPException(
-            status_code=e.response.status_code,
-            detail=error_detail
+        final_response = await cancel_on_disconnect(
+            run_agentic_loop(request), http_request.is_disconnected, DISCONNECT_POLL_INTERVAL
         )
+        if write_cache:
+            body = store_chat_response(cache_key, final_response)
+            if body is not None:
+                return Response(body, media_type="application/json", headers={"X-Cache": x_cache})
+        if fast_json.FAST_PATH:
+            # 直接返回上游最后一轮的原始 JSON，不再按 ChatResponse 校验和序列化
+            return fast_json.response(final_response, headers={"X-Cache": x_cache})
+        http_response.headers["X-Cache"] = x_cache
+        return final_response
+    except ClientDisconnected:
+        metrics.CLIENT_DISCONNECTS.labels("false").inc()
+        logger.info("客户端已断开，已取消 Agentic Loop")
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
     except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"处理请求时发生错误: {str(e)}"
-        )
+        raise upstream_http_exception(e)
 
 
 # ==================== Search API 模型定义 ====================
@@ -1154,6 +1978,78 @@ class SearchResponse(BaseModel):
 
 # ==================== Search API 端点 ====================
 
+# 透传模式：上游响应体不解析、不校验，按数据块直接转发给客户端（不使用搜索缓存）
+SEARCH_PASSTHROUGH = env_bool("SEARCH_PASSTHROUGH", False)
+# 透传模式下抽样校验响应结构的比例（转发完成后按 SearchResponse 校验，只记录结果）
+SEARCH_PASSTHROUGH_VALIDATE_RATE = env_float("SEARCH_PASSTHROUGH_VALIDATE_RATE", 0.01)
+
+
+# 透传时转发给客户端的上游响应头
+PASSTHROUGH_HEADERS = ("content-type", "content-encoding")
+
+
+def _decode_sample(data: bytes, encoding: str) -> Optional[bytes]:
+    """解码抽样校验用的原始响应体；不支持的 Content-Encoding 返回 None（跳过校验）"""
+    encoding = encoding.strip().lower()
+    if encoding in ("", "identity"):
+        return data
+    if encoding in ("gzip", "x-gzip"):
+        return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        try:
+            return zlib.decompress(data)
+        except zlib.error:
+            return zlib.decompress(data, -zlib.MAX_WBITS)
+    return None
+
+
+async def search_passthrough(request: SearchRequest, accept_encoding: Optional[str] = None) -> Response:
+    """
+    把上游的搜索响应原样转发给客户端
+    
+    请求上游时使用客户端的 Accept-Encoding，响应体不解压，状态码、Content-Type 和
+    Content-Encoding 与上游相同。在返回响应之前先读到第一个数据块：上游失败、熔断或繁忙时
+    仍然返回对应的 HTTP 错误；之后的失败只能中断连接。
+    """
+    chunks = upstream.stream_raw(upstream.SEARCH_PATH, {
+        "keywords": request.keywords,
+        "max_results": request.max_results
+    }, headers={"Accept-Encoding": accept_encoding or "identity"})
+    try:
+        upstream_response = await chunks.__anext__()
+        try:
+            first = await chunks.__anext__()
+        except StopAsyncIteration:
+            first = b""
+    except Exception:
+        await chunks.aclose()
+        raise
+    headers = {name: upstream_response.headers[name] for name in PASSTHROUGH_HEADERS if name in upstream_response.headers}
+    headers.setdefault("content-type", "application/json")
+    validate = random.random() < SEARCH_PASSTHROUGH_VALIDATE_RATE
+    
+    async def body() -> AsyncIterator[bytes]:
+        sampled: Optional[List[bytes]] = [first] if validate else None
+        try:
+            yield first
+            async for chunk in chunks:
+                if sampled is not None:
+                    sampled.append(chunk)
+                yield chunk
+        finally:
+            await chunks.aclose()
+        if sampled is not None:
+            try:
+                data = _decode_sample(b"".join(sampled), headers.get("content-encoding", ""))
+                if data is not None:
+                    SearchResponse.model_validate_json(data)
+                    metrics.SEARCH_PASSTHROUGH_VALIDATIONS.labels("ok").inc()
+            except (ValueError, zlib.error) as e:
+                metrics.SEARCH_PASSTHROUGH_VALIDATIONS.labels("invalid").inc()
+                logger.warning("透传的搜索响应不符合 SearchResponse: %s", str(e)[:500])
+    
+    return StreamingResponse(body(), status_code=upstream_response.status_code, headers=headers)
+
 @app.post(
     "/search",
     response_model=SearchResponse,
@@ -1250,12 +2146,19 @@ class SearchResponse(BaseModel):
     - **401**: API token 未配置或无效
     - **422**: 请求参数验证错误（如关键词列表为空）
     - **500**: AI Builder 服务错误或网络错误
+    - **503**: 上游并发已满或已熔断，请按 `Retry-After` 头指定的秒数后重试
     
     ### 注意事项
     
     - 支持多个关键词并发搜索，每个关键词独立处理
     - 如果某个关键词搜索失败，会在 `errors` 字段中返回，其他关键词的结果仍会正常返回
     - 搜索结果来自 Tavily 搜索引擎，包含实时网络内容
+    
+    ### 透传模式
+    
+    服务端启用 `SEARCH_PASSTHROUGH` 时，请求原样转发给上游，上游响应体按数据块直接转发给客户端，
+    不经过解析、校验和搜索缓存。状态码、`Content-Type` 和 `Content-Encoding` 与上游相同
+    （按客户端的 `Accept-Encoding` 协商，响应体不解压）。上游在开始返回数据之后出错时连接会被中断。
     """,
     response_description="AI Builder 返回的搜索结果",
     responses={
@@ -1310,7 +2213,7 @@ class SearchResponse(BaseModel):
         }
     }
 )
-async def search(request: SearchRequest):
+async def search(request: SearchRequest, http_request: Request):
     """
     Search 端点 - 转发请求到 AI Builder
     
@@ -1323,61 +2226,242 @@ async def search(request: SearchRequest):
     - SearchResponse 对象，包含每个关键词的搜索结果
     """
     # 检查 API token
-    if not AI_BUILDER_API_KEY:
+    if not get_api_key():
         raise HTTPException(
             status_code=401,
             detail="AI Builder API token 未配置。请设置 AI_BUILDER_TOKEN 环境变量或确保 'AI builder API key:' 文件存在。"
         )
     
-    # 构建转发请求
-    url = f"{AI_BUILDER_BASE_URL}/v1/search/"
-    headers = {
-        "Authorization": f"Bearer {AI_BUILDER_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
-    # 构建请求体
-    payload = {
-        "keywords": request.keywords,
-        "max_results": request.max_results
-    }
-    
     try:
-        # 发送请求到 AI Builder
-        response = requests.post(url, headers=headers, json=payload, timeout=60)
-        response.raise_for_status()
-        
-        # 返回响应
-        return response.json()
-        
-    except requests.exceptions.Timeout:
-        raise HTTPException(
-            status_code=500,
-            detail="请求超时，AI Builder 服务响应时间过长"
-        )
-    except requests.exceptions.ConnectionError:
-        raise HTTPException(
-            status_code=500,
-            detail="无法连接到 AI Builder 服务，请检查网络连接"
-        )
-    except requests.exceptions.HTTPError as e:
-        error_detail = f"AI Builder API 错误: {e.response.status_code}"
-        try:
-            error_body = e.response.json()
-            if "detail" in error_body:
-                error_detail = error_body["detail"]
-            elif "message" in error_body:
-                error_detail = error_body["message"]
-        except:
-            error_detail = e.response.text or error_detail
+        if SEARCH_PASSTHROUGH:
+            return await search_passthrough(request, http_request.headers.get("accept-encoding"))
+        # 优先使用缓存，未命中的关键词转发到 AI Builder
+        result = await search_with_cache(request.keywords, request.max_results)
+        if fast_json.FAST_PATH:
+            # 结果由本服务组装，结构已确定，不再按 SearchResponse 校验和序列化
+            return fast_json.response(result)
+        return result
         
-        raise HTTPException(
-            status_code=e.response.status_code,
-            detail=error_detail
-        )
     except Exception as e:
+        raise upstream_http_exception(e, "search")
+
+
+# 流式搜索中同时进行的关键词数（每个请求）
+SEARCH_STREAM_MAX_PARALLEL = env_int("SEARCH_STREAM_MAX_PARALLEL", 4)
+
+
+async def search_stream_events(keywords: List[str], max_results: int) -> AsyncIterator[Dict[str, Any]]:
+    """
+    每个关键词单独搜索（仍经过搜索缓存、请求合并和上游并发限制），按完成顺序产出事件
+    
+    事件：
+    - {"type": "query", "keyword": ..., "response": {...}}
+    - {"type": "error", "keyword": ..., "error": ...}
+    - 最后一条 {"type": "done", "queries": 成功数, "errors": 失败数, "elapsed_ms": ...}
+    """
+    started = time.perf_counter()
+    semaphore = asyncio.Semaphore(max(1, SEARCH_STREAM_MAX_PARALLEL))
+    
+    async def search_one(keyword: str) -> List[Dict[str, Any]]:
+        async with semaphore:
+            try:
+                result = await search_with_cache([keyword], max_results)
+            except Exception as e:
+                return [{"type": "error", "keyword": keyword, "error": upstream_http_exception(e, "search").detail}]
+        events = [dict(query, type="query") for query in result.get("queries") or []]
+        events.extend(dict(error, type="error") for error in result.get("errors") or [])
+        return events
+    
+    # 规范化后相同的关键词只搜索一次
+    unique: Dict[str, str] = {}
+    for keyword in keywords:
+        unique.setdefault(normalize_keyword(keyword), keyword)
+    tasks = [asyncio.create_task(search_one(keyword)) for keyword in unique.values()]
+    counts = {"query": 0, "error": 0}
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            for event in await next_done:
+                counts[event["type"]] += 1
+                yield event
+    finally:
+        # 客户端断开时取消尚未完成的关键词
+        for task in tasks:
+            task.cancel()
+    yield {
+        "type": "done",
+        "queries": counts["query"],
+        "errors": counts["error"],
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+async def search_ndjson(keywords: List[str], max_results: int) -> AsyncIterator[bytes]:
+    async for event in search_stream_events(keywords, max_results):
+        yield fast_json.dumps(event) + b"\n"
+
+
+@app.post(
+    "/search/stream",
+    tags=["Search"],
+    summary="Web 搜索（流式 NDJSON）",
+    description="""
+    ## Search Stream 端点 - 逐个关键词返回结果
+    
+    请求参数与 `POST /search` 相同。每个关键词单独请求上游（每个请求最多同时进行
+    `SEARCH_STREAM_MAX_PARALLEL` 个，默认 4），哪个关键词先完成就先返回哪个，
+    首个结果的延迟不再取决于最慢的关键词。
+    
+    ### 响应格式
+    
+    `application/x-ndjson`，每行一个 JSON 对象，按完成顺序输出：
+    
+    ```
+    {"keyword": "FastAPI", "response": {"results": [...]}, "type": "query"}
+    {"keyword": "REST API", "error": "上游返回 500", "type": "error"}
+    {"type": "done", "queries": 1, "errors": 1, "elapsed_ms": 812.4}
+    ```
+    
+    - **query**: 一个关键词的结果（与 `/search` 的 `queries` 中的元素相同）
+    - **error**: 一个关键词失败（与 `/search` 的 `errors` 中的元素相同）
+    - **done**: 最后一行，成功和失败的关键词数
+    
+    ### 使用 curl
+    ```bash
+    curl -N -X POST "http://localhost:8000/search/stream" \\
+         -H "Content-Type: application/json" \\
+         -d '{"keywords": ["FastAPI", "Python", "REST API"]}'
+    ```
+    """,
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "description": "NDJSON 事件流",
+            "content": {"application/x-ndjson": {}}
+        },
+        401: {"description": "API token 未配置"}
+    }
+)
+async def search_stream(request: SearchRequest):
+    """
+    Search Stream 端点 - 以 NDJSON 逐个返回关键词的搜索结果
+    """
+    # 检查 API token
+    if not get_api_key():
         raise HTTPException(
-            status_code=500,
-            detail=f"处理请求时发生错误: {str(e)}"
+            status_code=401,
+            detail="AI Builder API token 未配置。请设置 AI_BUILDER_TOKEN 环境变量或确保 'AI builder API key:' 文件存在。"
         )
+    
+    return StreamingResponse(
+        search_ndjson(request.keywords, request.max_results),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# ==================== 运行状态 ====================
+
+@app.get(
+    "/stats",
+    tags=["运维"],
+    summary="运行状态统计",
+    description="""
+    ## Stats 端点
+    
+    返回进程内的运行状态统计（仅当前 worker 进程）：
+    - **tool_scheduler**: 工具调用调度器的排队深度、执行数和等待时间
+    - **search_cache**: 搜索缓存的条目数、字节数和命中率
+    - **chat_cache**: /chat 响应缓存的条目数、命中率和绕过次数
+    - **search_flight**: 搜索请求合并的进行中数量和合并次数
+    - **upstream_limiters**: 每个上游路由的进行中请求数、排队深度和拒绝次数
+    - **circuit_breakers**: 每个上游路由的熔断状态
+    - **retry_budget**: 全局重试预算剩余额度和重试次数
+    - **search_hedging**: 搜索对冲请求的次数、胜出次数和当前对冲延迟
+    - **context_budget**: 上下文压缩次数和累计节省的 token 数
+    - **search_dedup**: 搜索结果去重的总结果数、新结果数和重复数
+    """,
+    response_description="运行状态统计"
+)
+async def stats():
+    """
+    Stats 端点
+    
+    返回调度器、缓存等组件的统计信息。
+    """
+    return {
+        "tool_scheduler": tool_scheduler.stats(),
+        "search_cache": search_cache.stats(),
+        "search_flight": search_flight.stats(),
+        "upstream_limiters": {
+            limiter.name: limiter.stats() for limiter in upstream.limiters.values()
+        },
+        "circuit_breakers": {
+            breaker.name: breaker.stats() for breaker in upstream.breakers.values()
+        },
+        "retry_budget": upstream.retry_budget.stats(),
+        "search_hedging": dict(search_hedger.stats(), enabled=SEARCH_HEDGE_ENABLED),
+        "context_budget": ContextBudget.totals,
+        "search_dedup": SearchResultStore.totals,
+        "chat_cache": chat_cache.stats(),
+        "round_policy": {"name": round_policy.name, "max_rounds": round_policy.max_rounds, "load": upstream_load()}
+    }
+
+
+@metrics.REGISTRY.collector
+def collect_runtime_metrics():
+    """抓取时读取的指标：缓存命中率、上游并发、工具调度器和熔断器状态"""
+    cache_stats = search_cache.stats()
+    yield ("search_cache_requests_total", "counter", "搜索缓存查询次数",
+           [({"result": "hit"}, cache_stats["hits"]), ({"result": "miss"}, cache_stats["misses"])])
+    yield ("search_cache_hit_ratio", "gauge", "搜索缓存命中率", [({}, cache_stats["hit_ratio"])])
+    yield ("search_cache_bytes", "gauge", "搜索缓存占用字节数", [({}, cache_stats["bytes"])])
+    chat_cache_stats = chat_cache.stats()
+    yield ("chat_cache_requests_total", "counter", "/chat 响应缓存查询次数",
+           [({"result": "hit"}, chat_cache_stats["hits"]), ({"result": "miss"}, chat_cache_stats["misses"]),
+            ({"result": "bypass"}, chat_cache_stats["bypassed"])])
+    yield ("search_flight_coalesced_total", "counter", "被合并到进行中请求的搜索次数",
+           [({}, search_flight.coalesced)])
+    yield ("upstream_in_flight", "gauge", "进行中的上游请求数",
+           [({"route": limiter.name}, limiter.in_flight) for limiter in upstream.limiters.values()])
+    yield ("upstream_queue_depth", "gauge", "等待上游并发名额的请求数",
+           [({"route": limiter.name}, limiter.queued) for limiter in upstream.limiters.values()])
+    yield ("upstream_rejected_total", "counter", "因上游繁忙被拒绝的请求数",
+           [({"route": limiter.name}, limiter.rejected) for limiter in upstream.limiters.values()])
+    yield ("circuit_breaker_open", "gauge", "熔断器状态（0 关闭 / 1 打开 / 0.5 半开）",
+           [({"route": breaker.name}, {"closed": 0, "open": 1}.get(breaker.state, 0.5))
+            for breaker in upstream.breakers.values()])
+    yield ("tool_calls_in_flight", "gauge", "正在执行的工具调用数", [({}, tool_scheduler.running)])
+    yield ("tool_calls_queued", "gauge", "等待全局并发名额的工具调用数", [({}, tool_scheduler.queued)])
+    yield ("upstream_retries_total", "counter", "上游重试次数", [({}, upstream.retry_budget.retries)])
+    yield ("context_tokens_saved_total", "counter", "上下文压缩节省的 token 数（估算）",
+           [({}, ContextBudget.totals["tokens_saved"])])
+    yield ("search_results_deduplicated_total", "counter", "去重时丢弃的搜索结果数",
+           [({"kind": "url"}, SearchResultStore.totals["url_duplicates"]),
+            ({"kind": "near"}, SearchResultStore.totals["near_duplicates"])])
+
 
+@app.get(
+    "/metrics",
+    tags=["运维"],
+    summary="Prometheus 指标",
+    description="""
+    ## Metrics 端点
+    
+    以 Prometheus 文本格式返回进程内指标（仅当前 worker 进程）：
+    - **http_request_duration_seconds**: 每个端点的请求耗时直方图（流式响应统计到结束）
+    - **chat_rounds**: 每个 chat 请求使用的轮数
+    - **chat_round_upstream_seconds**: 每轮上游 chat completion 耗时
+    - **tool_call_duration_seconds** / **chat_tool_calls_per_round**: 工具调用耗时和每轮调用数
+    - **llm_tokens_total**: 上游 usage 报告的 prompt / completion token 数
+    - **errors_total**: 按端点和异常类型统计的错误数
+    - 缓存命中率、上游并发、工具调度器和熔断器状态
+    """,
+    response_class=PlainTextResponse
+)
+async def metrics_endpoint():
+    """
+    Metrics 端点
+    
+    返回 Prometheus 文本格式的指标。
+    """
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
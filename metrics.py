@@ -0,0 +1,325 @@
+"""
+进程内指标（Prometheus 文本格式）
+
+- Counter / Gauge / Histogram：带标签的指标，labels() 返回缓存的子指标，
+  记录时只做一次字典查找和几次加法，不加锁（应用运行在单个事件循环线程上）
+- 每个指标的标签组合数有上限，超出的组合归入 "other"，避免用户输入导致序列数无限增长
+- Registry.collector(fn)：抓取时才读取的指标（缓存命中率、并发数等），热路径零开销
+
+GET /metrics 返回 Registry.render() 的结果。
+"""
+import math
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+# starlette 会为 text/* 类型追加 charset=utf-8
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+OVERFLOW_LABEL = "other"
+
+# 抓取时指标：(名称, 类型, 说明, [(标签, 值)])
+Sample = Tuple[Dict[str, str], float]
+CollectedMetric = Tuple[str, str, str, List[Sample]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(str(value))}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    """带标签指标的公共部分"""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), max_series: int = 200):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.max_series = max_series
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """返回指定标签值的子指标（按位置对应 labelnames）"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} 需要标签 {self.labelnames}")
+            if len(self._children) >= self.max_series:
+                values = (OVERFLOW_LABEL,) * len(self.labelnames)
+                child = self._children.get(values)
+            if child is None:
+                child = self._children[values] = self._new_child()
+        return child
+
+    def _series(self) -> Iterable[Tuple[Dict[str, str], object]]:
+        for values, child in self._children.items():
+            yield dict(zip(self.labelnames, values)), child
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, child in self._series():
+            lines.extend(self._render_child(labels, child))
+        return lines
+
+    def _render_child(self, labels: Dict[str, str], child) -> List[str]:
+        return [f"{self.name}{_format_labels(labels)} {_format_value(child.value)}"]
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Counter(_Metric):
+    """单调递增计数器"""
+
+    kind = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        """无标签计数器的快捷方法"""
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    """可增可减的数值"""
+
+    kind = "gauge"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.labels().dec(amount)
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self) -> "_Timer":
+        """上下文管理器：观测 with 块的耗时（秒）"""
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ("_histogram", "_started")
+
+    def __init__(self, histogram: _HistogramValue):
+        self._histogram = histogram
+
+    def __enter__(self) -> "_Timer":
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._histogram.observe(time.perf_counter() - self._started)
+
+
+class Histogram(_Metric):
+    """累积直方图（bucket 上界为闭区间，与 Prometheus 一致）"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+        max_series: int = 200,
+    ):
+        super().__init__(name, documentation, labelnames, max_series)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def time(self) -> _Timer:
+        return self.labels().time()
+
+    def _render_child(self, labels: Dict[str, str], child: _HistogramValue) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), child.counts):
+            cumulative += count
+            bucket_labels = dict(labels, le=_format_value(bound))
+            lines.append(f"{self.name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{_format_labels(labels)} {child.count}")
+        return lines
+
+
+class Registry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[CollectedMetric]]] = []
+
+    def _register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = (), **kwargs) -> Counter:
+        return self._register(Counter(name, documentation, labelnames, **kwargs))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (), **kwargs) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames, **kwargs))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), **kwargs) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, **kwargs))
+
+    def collector(self, fn: Callable[[], Iterable[CollectedMetric]]) -> Callable[[], Iterable[CollectedMetric]]:
+        """注册抓取时调用的收集函数（可用作装饰器）"""
+        self._collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        """输出 Prometheus 文本格式"""
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            for name, kind, documentation, samples in collect():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(float(value))}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# ==================== 应用指标 ====================
+
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP 请求耗时（到响应体发送完毕）", ["method", "route", "status"]
+)
+HTTP_REQUESTS_IN_FLIGHT = REGISTRY.gauge("http_requests_in_flight", "正在处理的 HTTP 请求数")
+
+CHAT_ROUNDS = REGISTRY.histogram(
+    "chat_rounds", "每个 chat 请求使用的轮数", ["stream"], buckets=(1, 2, 3, 4, 5, 6, 8)
+)
+CHAT_ROUND_UPSTREAM_DURATION = REGISTRY.histogram(
+    "chat_round_upstream_seconds", "每轮 chat completion 上游调用耗时", ["round", "stream"]
+)
+CHAT_TOOL_CALLS_PER_ROUND = REGISTRY.histogram(
+    "chat_tool_calls_per_round", "每轮的工具调用数", ["round"], buckets=(0, 1, 2, 3, 4, 5, 6, 8, 10)
+)
+TOOL_CALL_DURATION = REGISTRY.histogram(
+    "tool_call_duration_seconds", "单个工具调用耗时", ["tool", "status"]
+)
+LLM_TOKENS = REGISTRY.counter(
+    "llm_tokens_total", "上游 usage 报告的 token 数", ["model", "kind"], max_series=100
+)
+CLIENT_DISCONNECTS = REGISTRY.counter(
+    "chat_client_disconnects_total", "响应完成前断开连接的 chat 请求数", ["stream"]
+)
+CHAT_CANCELLED_WORK = REGISTRY.counter(
+    "chat_cancelled_work_total", "请求取消时中止或跳过的工作（completion / tool_call / round）", ["kind"]
+)
+CHAT_ROUND_STOPS = REGISTRY.counter(
+    "chat_round_stops_total", "轮次策略停止提供工具的次数（max_rounds / low_novelty / load）", ["reason"]
+)
+CHAT_DEADLINE_FINAL_ROUNDS = REGISTRY.counter(
+    "chat_deadline_final_rounds_total", "因截止时间临近提前进入最后一轮的次数", ["reason"]
+)
+SEARCH_CACHE_EVENTS = REGISTRY.counter(
+    "search_cache_events_total",
+    "搜索缓存事件（stale_hit / refresh / refresh_error / negative_hit / negative_store）",
+    ["event"]
+)
+SEARCH_PASSTHROUGH_VALIDATIONS = REGISTRY.counter(
+    "search_passthrough_validations_total", "透传模式下抽样校验搜索响应结构的结果（ok / invalid）", ["result"]
+)
+ERRORS = REGISTRY.counter(
+    "errors_total", "按位置和异常类型统计的错误数", ["where", "exception"], max_series=100
+)
+
+
+class MetricsMiddleware:
+    """
+    ASGI 中间件：记录 HTTP 请求耗时和进行中请求数
+
+    耗时统计到响应体最后一块发送完毕，因此包括 SSE 流式响应的整个过程。
+    route 标签使用路由模板（例如 /chat），未匹配的路径归入 "other"。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = "500"
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+            route = scope.get("route")
+            HTTP_REQUEST_DURATION.labels(
+                scope["method"], getattr(route, "path", OVERFLOW_LABEL), status
+            ).observe(time.perf_counter() - started)
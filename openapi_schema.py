@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+冻结的 OpenAPI 文档
+
+端点的 description / responses 示例很多，FastAPI 首次访问 /openapi.json（或 /docs）时
+生成文档要十几毫秒，serverless 上每个新实例都要再生成一次。构建时把文档写入 openapi.json，
+运行时直接读取。
+
+文档中的 x-source-checksum 是生成时源文件（以及 FastAPI、Pydantic 版本）的哈希；
+运行时校验不一致（改了代码但没有重新生成）时记录警告并回退到实时生成。
+
+    python openapi_schema.py          # 重新生成 openapi.json
+    python openapi_schema.py --check  # 检查 openapi.json 是否与代码一致，不一致时退出码为 1
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SCHEMA_PATH = os.path.join(ROOT, "openapi.json")
+# 定义端点和模型的源文件
+SOURCES = ("main.py",)
+CHECKSUM_KEY = "x-source-checksum"
+
+
+def source_checksum() -> str:
+    """源文件和 FastAPI / Pydantic 版本的 sha256"""
+    import fastapi
+    import pydantic
+
+    digest = hashlib.sha256(f"fastapi={fastapi.__version__};pydantic={pydantic.VERSION}".encode())
+    for name in SOURCES:
+        with open(os.path.join(ROOT, name), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def load_frozen(path: str = SCHEMA_PATH) -> Optional[Dict[str, Any]]:
+    """读取冻结的文档；文件不存在或校验和不一致时返回 None"""
+    try:
+        with open(path, "rb") as f:
+            schema = json.load(f)
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        logger.warning("openapi.json 解析失败，改为实时生成: %s", e)
+        return None
+    if schema.get(CHECKSUM_KEY) != source_checksum():
+        logger.warning("openapi.json 与代码不一致，改为实时生成（运行 python openapi_schema.py 重新生成）")
+        return None
+    return schema
+
+
+def install(app) -> None:
+    """让 app.openapi() 优先使用冻结的文档"""
+    generate: Callable[[], Dict[str, Any]] = app.openapi
+
+    def openapi() -> Dict[str, Any]:
+        if app.openapi_schema is None:
+            app.openapi_schema = load_frozen() or generate()
+        return app.openapi_schema
+
+    app.openapi = openapi
+
+
+def render(schema: Dict[str, Any]) -> str:
+    return json.dumps(schema, ensure_ascii=False, indent=2) + "\n"
+
+
+def build() -> Dict[str, Any]:
+    """从代码实时生成文档（附带校验和）"""
+    from fastapi import FastAPI
+
+    from main import app
+
+    # 调用未被 install() 替换的生成方法
+    app.openapi_schema = None
+    schema = dict(FastAPI.openapi(app))
+    schema[CHECKSUM_KEY] = source_checksum()
+    # 与从文件读取的文档保持一致（去掉元组等非 JSON 类型）
+    return json.loads(json.dumps(schema))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="生成或检查冻结的 OpenAPI 文档")
+    parser.add_argument("--check", action="store_true", help="只检查 openapi.json 是否与代码一致")
+    parser.add_argument("--path", default=SCHEMA_PATH, help="文档路径（默认仓库根目录的 openapi.json）")
+    args = parser.parse_args(argv)
+
+    text = render(build())
+    if args.check:
+        try:
+            with open(args.path, encoding="utf-8") as f:
+                current = f.read()
+        except FileNotFoundError:
+            current = None
+        if current != text:
+            print(f"{args.path} 与代码不一致，请运行 python openapi_schema.py 重新生成", file=sys.stderr)
+            return 1
+        print(f"{args.path} 与代码一致", file=sys.stderr)
+        return 0
+
+    with open(args.path, "w", encoding="utf-8") as f:
+        f.write(text)
+    print(f"已写入 {args.path}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,330 @@
+"""
+上游容错工具
+
+CircuitBreaker: 每个上游路由一个熔断器（closed / open / half-open）。
+上游持续失败时熔断，熔断期间请求立即失败，冷却后放行少量探测请求。
+
+RetryBudget: 全局重试预算。每个请求存入少量额度，每次重试消耗 1 个额度，
+保证重试流量只占正常流量的一小部分，避免重试在上游故障时放大流量。
+
+Hedger: 对冲请求。调用在最近延迟的某个分位数内仍未返回时，再发一个相同的请求，
+先返回的结果胜出，另一个被取消；对冲比例受上限约束。
+"""
+import asyncio
+import math
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+import startup
+
+T = TypeVar("T")
+
+# FAST_START 模式下首次使用时才加载
+httpx = startup.import_module("httpx")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# 视为上游故障（计入熔断、允许重试）的状态码
+FAILURE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+RETRYABLE_STATUS_CODES = frozenset({429, 502, 503, 504})
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，请求被直接拒绝"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} 上游熔断中，请稍后重试")
+        self.name = name
+        self.retry_after = retry_after
+
+
+def is_upstream_failure(e: BaseException) -> bool:
+    """判断异常是否说明上游不健康（超时、连接错误、5xx、429）"""
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code in FAILURE_STATUS_CODES
+    return isinstance(e, (httpx.TransportError, asyncio.TimeoutError))
+
+
+def is_retryable(e: BaseException) -> bool:
+    """
+    判断失败是否可以重试
+
+    只重试连接阶段的错误和明确的临时性状态码；读超时不重试，
+    否则一次慢请求会让总耗时翻倍。
+    """
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError))
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """指数退避 + full jitter：在 [0, min(cap, base * 2^attempt)] 内随机"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    - closed: 正常放行；连续失败达到 failure_threshold，或最近 window 次调用
+      的失败率达到 failure_rate（且至少 min_calls 次）时打开
+    - open: 直接拒绝，reset_timeout 秒后进入 half-open
+    - half-open: 最多放行 half_open_max_calls 个探测请求；探测成功则关闭，失败则重新打开
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        failure_rate: float = 0.5,
+        window: int = 20,
+        min_calls: int = 10,
+        reset_timeout: float = 30.0,
+        half_open_max_calls: int = 1,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._consecutive_failures = 0
+        self._outcomes: deque = deque(maxlen=window)
+        self._probes = 0
+        self.rejected = 0
+        self.opened = 0
+
+    def _retry_after(self) -> float:
+        return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+
+    def acquire(self) -> bool:
+        """
+        请求放行
+
+        Returns:
+            本次调用是否为 half-open 探测请求
+
+        Raises:
+            CircuitOpenError: 熔断中或探测名额已满
+        """
+        if self.state == OPEN:
+            if self._retry_after() > 0:
+                self.rejected += 1
+                raise CircuitOpenError(self.name, self._retry_after())
+            self.state = HALF_OPEN
+            self._probes = 0
+        if self.state == HALF_OPEN:
+            if self._probes >= self.half_open_max_calls:
+                self.rejected += 1
+                raise CircuitOpenError(self.name, 1.0)
+            self._probes += 1
+            return True
+        return False
+
+    def release(self, probe: bool, success: Optional[bool]) -> None:
+        """
+        记录调用结果
+
+        Args:
+            probe: acquire() 的返回值
+            success: True 成功 / False 上游故障 / None 调用被放弃（例如请求被取消）
+        """
+        if probe:
+            self._probes = max(0, self._probes - 1)
+        if success is None:
+            return
+        if success:
+            self._consecutive_failures = 0
+            self._outcomes.append(True)
+            if probe and self.state == HALF_OPEN:
+                self._close()
+            return
+
+        self._consecutive_failures += 1
+        self._outcomes.append(False)
+        if self.state == HALF_OPEN:
+            self._open()
+            return
+        failures = self._outcomes.count(False)
+        if (
+            self._consecutive_failures >= self.failure_threshold
+            or (len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate)
+        ):
+            self._open()
+
+    def _open(self) -> None:
+        if self.state != OPEN:
+            self.opened += 1
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self._probes = 0
+
+    def _close(self) -> None:
+        self.state = CLOSED
+        self._consecutive_failures = 0
+        self._outcomes.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self._consecutive_failures,
+            "recent_failure_rate": round(self._outcomes.count(False) / len(self._outcomes), 4) if self._outcomes else 0.0,
+            "opened": self.opened,
+            "rejected": self.rejected,
+            "retry_after": round(self._retry_after(), 3) if self.state == OPEN else 0.0,
+        }
+
+
+class RetryBudget:
+    """
+    全局重试预算（令牌桶）
+
+    - 每个请求存入 ratio 个令牌，另外每秒补充 min_per_second 个令牌（保证低流量时也能重试）
+    - 每次重试消耗 1 个令牌，令牌不足时不再重试
+    - 令牌数上限为 max_tokens
+    """
+
+    def __init__(self, ratio: float = 0.1, min_per_second: float = 1.0, max_tokens: float = 10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._updated_at = time.monotonic()
+        self.retries = 0
+        self.exhausted = 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.max_tokens, self._tokens + (now - self._updated_at) * self.min_per_second)
+        self._updated_at = now
+
+    def deposit(self) -> None:
+        """每个上游请求（不含重试）调用一次"""
+        self._refill()
+        self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_withdraw(self) -> bool:
+        """尝试为一次重试消耗额度"""
+        self._refill()
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            self.retries += 1
+            return True
+        self.exhausted += 1
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        self._refill()
+        return {
+            "tokens": round(self._tokens, 3),
+            "retries": self.retries,
+            "exhausted": self.exhausted,
+        }
+
+
+class Hedger:
+    """
+    对冲请求（仅用于幂等调用）
+
+    - 对冲延迟：最近 window 次成功调用延迟的 percentile 分位数（不低于 min_delay）；
+      样本数不足 min_samples 时不对冲
+    - 对冲比例：每次调用存入 max_ratio 个额度，每次对冲消耗 1 个，
+      保证额外请求不超过总调用的 max_ratio
+    - 先成功的结果胜出，另一个请求被取消；两个都失败时抛出第一个异常
+    """
+
+    def __init__(
+        self,
+        percentile: float = 0.95,
+        min_delay: float = 0.05,
+        min_samples: int = 20,
+        max_ratio: float = 0.1,
+        window: int = 200,
+    ):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.max_ratio = max_ratio
+        self._latencies: deque = deque(maxlen=window)
+        self._tokens = 0.0
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def delay(self) -> Optional[float]:
+        """当前的对冲延迟秒数；样本不足时返回 None"""
+        if len(self._latencies) < self.min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, math.ceil(self.percentile * len(ordered)) - 1)
+        return max(self.min_delay, ordered[index])
+
+    async def _timed(self, fn: Callable[[], Awaitable[T]]) -> T:
+        started = time.perf_counter()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            # 被对冲取消的慢请求按已耗时记录（实际延迟只会更长），避免分位数被低估
+            self._latencies.append(time.perf_counter() - started)
+            raise
+        self._latencies.append(time.perf_counter() - started)
+        return result
+
+    async def run(self, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        执行 fn，必要时发出对冲请求
+
+        Args:
+            fn: 无参协程函数，可能被调用两次
+
+        Returns:
+            先成功返回的结果
+        """
+        self.calls += 1
+        self._tokens = min(1.0 + self.max_ratio, self._tokens + self.max_ratio)
+
+        primary = asyncio.ensure_future(self._timed(fn))
+        tasks = [primary]
+        try:
+            delay = self.delay()
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done and self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    self.hedged += 1
+                    tasks.append(asyncio.ensure_future(self._timed(fn)))
+
+            pending = set(tasks)
+            first_error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    error = task.exception()
+                    if error is None:
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        return task.result()
+                    if first_error is None:
+                        first_error = error
+            raise first_error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        delay = self.delay()
+        return {
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "hedge_ratio": round(self.hedged / self.calls, 4) if self.calls else 0.0,
+            "delay_ms": round(delay * 1000, 3) if delay is not None else None,
+            "samples": len(self._latencies),
+        }
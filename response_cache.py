@@ -0,0 +1,137 @@
+"""
+/chat 响应缓存（精确匹配）
+
+同样的对话（消息、模型、temperature、max_tokens、max_rounds 都相同）直接返回缓存的最终回复，
+不再运行 Agentic Loop。缓存值是序列化好的 JSON 字节，命中时不做任何模型校验和序列化。
+
+- 默认关闭，CHAT_CACHE_ENABLED=1 启用
+- temperature > 0 的请求每次回答本应不同，默认不使用缓存；
+  CHAT_CACHE_FORCE=1 或请求头 X-Chat-Cache: force 时仍然使用
+- 请求头 Cache-Control: no-cache 跳过读取（仍写入新结果），no-store 既不读也不写
+- 响应头 X-Cache: HIT / MISS / BYPASS；命中时附带 Age（秒）
+
+配置（环境变量）：
+- CHAT_CACHE_TTL: 缓存有效期（秒），默认 600
+- CHAT_CACHE_MAX_ENTRIES: 最大条目数，默认 1024
+- CHAT_CACHE_MAX_BYTES: 最大总字节数，默认 32MB
+- CACHE_BACKEND: memory（默认，每个 worker 一份）或 sqlite（同一台机器的 worker 共享，见 cache.py）
+"""
+import hashlib
+import json
+import struct
+import time
+import unicodedata
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from cache import Codec, create_cache
+from config import env_bool, env_float, env_int
+
+HIT = "HIT"
+MISS = "MISS"
+BYPASS = "BYPASS"
+
+FORCE_HEADER = "x-chat-cache"
+
+
+class CachedResponse:
+    """缓存的最终回复（已序列化的 JSON）"""
+
+    __slots__ = ("body", "created")
+
+    def __init__(self, body: bytes, created: Optional[float] = None):
+        self.body = body
+        self.created = time.time() if created is None else created
+
+    def age(self) -> int:
+        return max(0, int(time.time() - self.created))
+
+
+class _ResponseCodec(Codec):
+    """文件缓存中的编码：8 字节写入时间 + 响应体"""
+
+    _header = struct.Struct("<d")
+
+    def encode(self, value: CachedResponse) -> bytes:
+        return self._header.pack(value.created) + value.body
+
+    def decode(self, data: bytes) -> CachedResponse:
+        (created,) = self._header.unpack_from(data)
+        return CachedResponse(bytes(data[self._header.size:]), created)
+
+
+def cache_key(
+    messages: List[Tuple[str, str]],
+    model: str,
+    temperature: Optional[float],
+    max_tokens: Optional[int],
+    max_rounds: Optional[int] = None,
+) -> str:
+    """
+    规范化请求的哈希
+
+    消息内容做 Unicode NFC 规范化并去掉首尾空白，角色不区分大小写。
+    """
+    canonical = {
+        "messages": [[role.lower(), unicodedata.normalize("NFC", content).strip()] for role, content in messages],
+        "model": model,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "max_rounds": max_rounds,
+    }
+    data = json.dumps(canonical, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """按请求决定是否读写缓存，并统计 hit / miss / bypass"""
+
+    def __init__(self, enabled: bool, force: bool, ttl: float, max_entries: int, max_bytes: int):
+        self.enabled = enabled
+        self.force = force
+        self._cache = create_cache(
+            "chat",
+            max_entries=max_entries,
+            max_bytes=max_bytes,
+            ttl=ttl,
+            sizeof=lambda entry: len(entry.body),
+            codec=_ResponseCodec(),
+        )
+        self.bypassed = 0
+
+    def policy(self, temperature: Optional[float], headers: Mapping[str, str]) -> Tuple[bool, bool]:
+        """
+        根据 temperature 和请求头决定本请求是否读、写缓存
+
+        Returns:
+            (是否读取缓存, 是否写入缓存)
+        """
+        if not self.enabled:
+            return False, False
+        directives = {item.strip().lower() for item in headers.get("cache-control", "").split(",")}
+        forced = self.force or headers.get(FORCE_HEADER, "").lower() == "force"
+        if "no-store" in directives or (temperature is not None and temperature > 0 and not forced):
+            self.bypassed += 1
+            return False, False
+        return "no-cache" not in directives, True
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        return self._cache.get(key)
+
+    def set(self, key: str, body: bytes) -> None:
+        self._cache.set(key, CachedResponse(body))
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._cache.stats(), enabled=self.enabled, force=self.force, bypassed=self.bypassed)
+
+
+def from_env() -> ResponseCache:
+    return ResponseCache(
+        enabled=env_bool("CHAT_CACHE_ENABLED", False),
+        force=env_bool("CHAT_CACHE_FORCE", False),
+        ttl=env_float("CHAT_CACHE_TTL", 600.0),
+        max_entries=env_int("CHAT_CACHE_MAX_ENTRIES", 1024),
+        max_bytes=env_int("CHAT_CACHE_MAX_BYTES", 32 * 1024 * 1024),
+    )
@@ -0,0 +1,132 @@
+"""
+Agentic Loop 轮次策略
+
+决定每一轮是否还向模型提供搜索工具；不提供工具的一轮即为最后一轮（生成最终答案）。
+
+- RoundPolicy（fixed）：固定轮数，前 max_rounds - 1 轮提供工具
+- AdaptiveRoundPolicy（adaptive，默认）：在固定轮数的基础上
+  - 上一轮工具调用的新结果比例（去重后的新 URL / 新内容）过低时提前结束工具轮次
+  - 上游负载高时减少工具轮次
+- 每个请求可以通过 max_rounds 指定更少的轮数
+
+配置（环境变量）：
+- ROUND_POLICY: adaptive（默认）或 fixed
+- CHAT_MAX_ROUNDS: 总轮数上限（含最后一轮），默认 4；请求的 max_rounds 不能超过它
+- ROUND_MIN_NOVELTY: 上一轮新结果比例低于该值时不再提供工具，默认 0.2
+- ROUND_LOAD_HIGH: 上游负载（(进行中 + 排队) / 并发上限）达到该值时少一轮工具调用，默认 0.75
+- ROUND_LOAD_CRITICAL: 上游负载达到该值时只保留一轮工具调用，默认 1.0
+"""
+import os
+from typing import Dict, Optional, Type
+
+from config import env_float, env_int
+
+MAX_ROUNDS = env_int("CHAT_MAX_ROUNDS", 4)
+
+# 停止提供工具的原因
+STOP_MAX_ROUNDS = "max_rounds"
+STOP_LOW_NOVELTY = "low_novelty"
+STOP_LOAD = "load"
+
+
+class RoundPolicy:
+    """固定轮数策略"""
+
+    name = "fixed"
+
+    def __init__(self, max_rounds: int = MAX_ROUNDS):
+        self.max_rounds = max(1, max_rounds)
+
+    def rounds_for(self, requested: Optional[int]) -> int:
+        """本请求的总轮数上限（含最后一轮）"""
+        if requested is None:
+            return self.max_rounds
+        return max(1, min(requested, self.max_rounds))
+
+    def stop_reason(
+        self,
+        round_num: int,
+        max_rounds: int,
+        novelty: Optional[float],
+        load: float,
+    ) -> Optional[str]:
+        """
+        判断第 round_num 轮是否停止提供工具
+
+        Args:
+            round_num: 即将开始的轮次（从 1 开始）
+            max_rounds: rounds_for() 的结果
+            novelty: 上一轮工具调用的新结果比例；第一轮或上一轮没有结果时为 None
+            load: 当前上游负载
+
+        Returns:
+            停止原因；None 表示本轮继续提供工具
+        """
+        if round_num >= max_rounds:
+            return STOP_MAX_ROUNDS
+        return None
+
+
+class AdaptiveRoundPolicy(RoundPolicy):
+    """按新结果比例和上游负载调整工具轮数的策略"""
+
+    name = "adaptive"
+
+    def __init__(
+        self,
+        max_rounds: int = MAX_ROUNDS,
+        min_novelty: float = 0.2,
+        load_high: float = 0.75,
+        load_critical: float = 1.0,
+    ):
+        super().__init__(max_rounds)
+        self.min_novelty = min_novelty
+        self.load_high = load_high
+        self.load_critical = load_critical
+
+    def stop_reason(
+        self,
+        round_num: int,
+        max_rounds: int,
+        novelty: Optional[float],
+        load: float,
+    ) -> Optional[str]:
+        reason = super().stop_reason(round_num, max_rounds, novelty, load)
+        if reason is not None:
+            return reason
+        if novelty is not None and novelty < self.min_novelty:
+            # 再搜一轮大概率也只是重复的结果
+            return STOP_LOW_NOVELTY
+        tool_rounds = max_rounds - 1
+        if load >= self.load_critical:
+            tool_rounds = 1
+        elif load >= self.load_high:
+            tool_rounds -= 1
+        if round_num > max(1, tool_rounds):
+            return STOP_LOAD
+        return None
+
+
+POLICIES: Dict[str, Type[RoundPolicy]] = {
+    RoundPolicy.name: RoundPolicy,
+    AdaptiveRoundPolicy.name: AdaptiveRoundPolicy,
+}
+
+
+def create_policy(name: Optional[str] = None) -> RoundPolicy:
+    """
+    按名称（默认读取 ROUND_POLICY）创建轮次策略
+
+    Raises:
+        ValueError: 未知的策略名称
+    """
+    name = (name or os.getenv("ROUND_POLICY", AdaptiveRoundPolicy.name)).lower()
+    if name not in POLICIES:
+        raise ValueError(f"未知的轮次策略: {name}（可选: {', '.join(POLICIES)}）")
+    if name == AdaptiveRoundPolicy.name:
+        return AdaptiveRoundPolicy(
+            min_novelty=env_float("ROUND_MIN_NOVELTY", 0.2),
+            load_high=env_float("ROUND_LOAD_HIGH", 0.75),
+            load_critical=env_float("ROUND_LOAD_CRITICAL", 1.0),
+        )
+    return POLICIES[name]()
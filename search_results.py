@@ -0,0 +1,209 @@
+"""
+请求级搜索结果去重
+
+同一个 URL 经常被多个关键词、多个轮次重复搜到。SearchResultStore 在单个 /chat 请求内
+记录已经发给模型的结果，只把新的结果写入工具消息：
+- 按规范化 URL 去重（忽略协议、www、末尾斜杠、锚点和常见跟踪参数）
+- 按内容近似去重（shingle + bottom-k MinHash 估算 Jaccard 相似度）
+- 重复结果合并分数（取最高分并记录出现次数）
+"""
+import heapq
+import unicodedata
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from text_utils import cjk_re
+
+# 不影响页面内容的跟踪参数
+TRACKING_PARAMS = frozenset({"gclid", "fbclid", "msclkid", "spm", "ref", "ref_src", "from", "source"})
+
+# bottom-k MinHash：每个文本保留 k 个最小的 shingle 哈希值
+SIGNATURE_SIZE = 32
+SHINGLE_SIZE_CHARS = 5
+SHINGLE_SIZE_WORDS = 3
+NEAR_DUPLICATE_THRESHOLD = 0.8
+# 只对内容的前若干字符计算签名，控制 CPU 开销
+SIGNATURE_CHARS = 600
+
+
+def canonical_url(url: str) -> str:
+    """
+    规范化 URL 作为去重键
+
+    http/https 视为相同，去掉 www.、默认端口、锚点、末尾斜杠和跟踪参数，查询参数排序。
+    URL 为空或没有主机名时返回空字符串（不按 URL 去重）。
+    """
+    try:
+        parts = urlsplit(url.strip())
+    except ValueError:
+        return url.strip().lower()
+    host = (parts.hostname or "").lower()
+    if not host:
+        return ""
+    if host.startswith("www."):
+        host = host[4:]
+    if parts.port and parts.port not in (80, 443):
+        host = f"{host}:{parts.port}"
+    path = parts.path.rstrip("/") or "/"
+    query = urlencode(sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith("utm_") and key.lower() not in TRACKING_PARAMS
+    ))
+    return f"{host}{path}?{query}" if query else f"{host}{path}"
+
+
+def _shingles(text: str) -> set:
+    text = " ".join(unicodedata.normalize("NFKC", text[:SIGNATURE_CHARS]).casefold().split())
+    if cjk_re().search(text):
+        size = SHINGLE_SIZE_CHARS
+        return {text[i:i + size] for i in range(max(1, len(text) - size + 1))}
+    words = text.split()
+    size = SHINGLE_SIZE_WORDS
+    return {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+
+def minhash_signature(text: str) -> Optional[FrozenSet[int]]:
+    """
+    计算文本的 bottom-k MinHash 签名；文本为空时返回 None
+
+    每个 shingle 只哈希一次（进程内的 str 哈希即可，签名不跨进程使用），
+    比 k 个独立哈希函数的经典 MinHash 少一个数量级的计算。
+    """
+    shingles = _shingles(text)
+    shingles.discard("")
+    if not shingles:
+        return None
+    return frozenset(heapq.nsmallest(SIGNATURE_SIZE, map(hash, shingles)))
+
+
+def estimate_similarity(left: FrozenSet[int], right: FrozenSet[int]) -> float:
+    """用 bottom-k 签名估算 Jaccard 相似度"""
+    union = sorted(left | right)[:SIGNATURE_SIZE]
+    return sum(1 for value in union if value in left and value in right) / len(union)
+
+
+class SearchResultStore:
+    """
+    单个请求内的搜索结果存储
+
+    add() 接收一次搜索的原始结果，返回只包含新结果的同结构搜索结果，
+    每个关键词的新结果按分数从高到低排序。
+    """
+
+    # 进程内累计统计
+    totals: Dict[str, int] = {"total": 0, "new": 0, "url_duplicates": 0, "near_duplicates": 0}
+
+    def __init__(self, threshold: float = NEAR_DUPLICATE_THRESHOLD):
+        self.threshold = threshold
+        # 规范化 URL -> 已发送结果的记录
+        self._by_url: Dict[str, Dict[str, Any]] = {}
+        # 签名中的哈希值 -> 包含该值的 (签名, 记录)，只和共享足够多哈希值的结果比较相似度
+        self._index: Dict[int, List[Tuple[FrozenSet[int], Dict[str, Any]]]] = {}
+        self.total = 0
+        self.new = 0
+        self.url_duplicates = 0
+        self.near_duplicates = 0
+        self.last_total = 0
+        self.last_new = 0
+
+    def _find_duplicate(self, url_key: str, signature: Optional[FrozenSet[int]]) -> Optional[Dict[str, Any]]:
+        # 没有可用 URL 的结果只按内容去重
+        record = self._by_url.get(url_key) if url_key else None
+        if record is not None:
+            self.url_duplicates += 1
+            SearchResultStore.totals["url_duplicates"] += 1
+            return record
+        if signature is not None:
+            shared: Dict[int, int] = {}
+            candidates = {}
+            for value in signature:
+                for other, record in self._index.get(value, ()):
+                    shared[id(record)] = shared.get(id(record), 0) + 1
+                    candidates[id(record)] = (other, record)
+            min_shared = self.threshold * min(len(signature), SIGNATURE_SIZE) / 2
+            for key, (other, record) in candidates.items():
+                if shared[key] >= min_shared and estimate_similarity(signature, other) >= self.threshold:
+                    self.near_duplicates += 1
+                    SearchResultStore.totals["near_duplicates"] += 1
+                    return record
+        return None
+
+    def add(self, search_result: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        登记一次搜索结果，返回去重后的结果
+
+        Args:
+            search_result: AI Builder /v1/search/ 结构的结果
+
+        Returns:
+            同结构的结果，每个 query 只包含新结果，并附带 duplicates（被去掉的结果数）
+        """
+        if "error" in search_result:
+            return search_result
+
+        self.last_total = 0
+        self.last_new = 0
+        queries = []
+        for query in search_result.get("queries") or []:
+            response_data = query.get("response") or {}
+            results = sorted(
+                response_data.get("results") or [],
+                key=lambda item: item.get("score") or 0,
+                reverse=True
+            )
+            fresh = []
+            duplicates = 0
+            for item in results:
+                self.total += 1
+                self.last_total += 1
+                SearchResultStore.totals["total"] += 1
+                url_key = canonical_url(item.get("url") or "")
+                signature = minhash_signature(item.get("content") or "")
+                record = self._find_duplicate(url_key, signature)
+                if record is not None:
+                    # 合并分数：保留最高分，记录出现次数
+                    record["score"] = max(record["score"], item.get("score") or 0)
+                    record["occurrences"] += 1
+                    duplicates += 1
+                    continue
+                record = {"url": item.get("url"), "score": item.get("score") or 0, "occurrences": 1}
+                if url_key:
+                    self._by_url[url_key] = record
+                if signature is not None:
+                    for value in signature:
+                        self._index.setdefault(value, []).append((signature, record))
+                self.new += 1
+                self.last_new += 1
+                SearchResultStore.totals["new"] += 1
+                fresh.append(item)
+            queries.append({
+                "keyword": query.get("keyword"),
+                "response": dict(response_data, results=fresh),
+                "duplicates": duplicates
+            })
+        return dict(search_result, queries=queries)
+
+    def mark(self) -> Tuple[int, int]:
+        """当前的 (结果总数, 新结果数)，配合 novelty(since=...) 统计一段时间内的新结果比例"""
+        return self.total, self.new
+
+    def novelty(self, since: Optional[Tuple[int, int]] = None) -> float:
+        """
+        新结果的比例（没有结果时为 0）
+
+        Args:
+            since: mark() 的返回值；提供时统计此后所有 add() 的结果，否则只统计最近一次 add()
+        """
+        if since is None:
+            total, new = self.last_total, self.last_new
+        else:
+            total, new = self.total - since[0], self.new - since[1]
+        return new / total if total else 0.0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "total": self.total,
+            "new": self.new,
+            "url_duplicates": self.url_duplicates,
+            "near_duplicates": self.near_duplicates,
+        }
@@ -0,0 +1,51 @@
+"""
+冷启动优化
+
+Vercel 等 serverless 平台上每个新实例都要重新 import main，导入耗时直接计入首个请求的延迟。
+FAST_START 模式下：
+- 较重的依赖（httpx、sqlite3）改为惰性导入，首次真正使用时才加载；
+  只访问主页、/hello 的实例不会加载它们
+- 静态资源不在 lifespan 中预加载，首次访问时再读入
+- API token 文件在首次调用上游时才读取
+
+配置（环境变量）：
+- FAST_START: 是否启用，默认在 Vercel 上（VERCEL=1）启用，其他环境关闭
+
+启动耗时基准：python -m bench.startup_bench
+"""
+import importlib
+import importlib.util
+import os
+import sys
+from types import ModuleType
+
+from config import env_bool
+
+FAST_START = env_bool("FAST_START", os.getenv("VERCEL") == "1")
+
+
+def lazy_import(name: str) -> ModuleType:
+    """
+    返回惰性模块：首次访问属性时才真正执行模块代码
+
+    只能通过返回值使用；对同名模块执行 import 语句会立即触发加载。已经导入的模块原样返回。
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    if spec is None or spec.loader is None:
+        raise ImportError(f"No module named {name!r}")
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def import_module(name: str) -> ModuleType:
+    """FAST_START 模式下惰性导入，否则立即导入"""
+    if FAST_START:
+        return lazy_import(name)
+    return importlib.import_module(name)
@@ -29,16 +29,17 @@ async function sendMessage() {
     messageInput.style.height = 'auto';
     
     // 显示思考动画
-    const thinkingId = showThinking();
+    let thinkingId = showThinking();
     isThinking = true;
     sendButton.disabled = true;
     
     try {
-        // 调用 API
+        // 调用 API（流式模式，逐步渲染）
         const response = await fetch('/chat', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
+                'Accept': 'text/event-stream',
             },
             body: JSON.stringify({
                 messages: [
@@ -48,7 +49,8 @@ async function sendMessage() {
                     }
                 ],
                 model: 'gpt-5',
-                temperature: 0.7
+                temperature: 0.7,
+                stream: true
             })
         });
         
@@ -57,14 +59,55 @@ async function sendMessage() {
             throw new Error(error.detail || `HTTP error! status: ${response.status}`);
         }
         
-        const data = await response.json();
+        let answerContent = null;
+        let roundText = '';
         
-        // 移除思考动画
-        removeThinking(thinkingId);
-        
-        // 添加 AI 回复
-        const aiMessage = data.choices[0].message.content;
-        addMessage('assistant', aiMessage);
+        await readEventStream(response, (event, data) => {
+            switch (event) {
+                case 'round_start':
+                    roundText = '';
+                    if (!answerContent) {
+                        updateThinking(thinkingId, data.round > 1 ? `正在思考（第 ${data.round} 轮）...` : '正在思考...');
+                    }
+                    break;
+                case 'delta':
+                    roundText += data.content;
+                    if (!answerContent) {
+                        removeThinking(thinkingId);
+                        answerContent = addMessage('assistant', '');
+                    }
+                    renderMarkdown(answerContent, roundText);
+                    break;
+                case 'tool_call': {
+                    const keywords = (data.arguments && data.arguments.keywords) || [];
+                    const text = keywords.length ? `正在搜索：${keywords.join('、')}` : '正在调用工具...';
+                    if (answerContent) {
+                        // 本轮的文字只是调用工具前的说明，回到思考状态
+                        answerContent.closest('.message').remove();
+                        answerContent = null;
+                        thinkingId = showThinking();
+                    }
+                    updateThinking(thinkingId, text);
+                    break;
+                }
+                case 'tool_result':
+                    if (!answerContent && data.success) {
+                        updateThinking(thinkingId, `已获取 ${data.result_count || 0} 条搜索结果，正在整理...`);
+                    }
+                    break;
+                case 'done': {
+                    const finalText = data.choices && data.choices[0] && data.choices[0].message.content;
+                    removeThinking(thinkingId);
+                    if (!answerContent) {
+                        answerContent = addMessage('assistant', '');
+                    }
+                    renderMarkdown(answerContent, finalText || roundText, true);
+                    break;
+                }
+                case 'error':
+                    throw new Error(data.detail || '发送消息时出错，请稍后重试。');
+            }
+        });
         
     } catch (error) {
         console.error('Error:', error);
@@ -77,6 +120,58 @@ async function sendMessage() {
     }
 }
 
+// 读取 SSE 流，逐个事件回调
+async function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder('utf-8');
+    let buffer = '';
+    
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            
+            let event = 'message';
+            let data = '';
+            for (const line of rawEvent.split('\n')) {
+                if (line.startsWith('event:')) {
+                    event = line.slice(6).trim();
+                } else if (line.startsWith('data:')) {
+                    data += line.slice(5).trim();
+                }
+            }
+            if (data) {
+                onEvent(event, JSON.parse(data));
+            }
+        }
+    }
+}
+
+// 渲染 markdown（按动画帧合并，避免每个 token 都重新渲染）
+const pendingRenders = new Map();
+function renderMarkdown(element, content, immediate = false) {
+    const render = () => {
+        const latest = pendingRenders.get(element);
+        pendingRenders.delete(element);
+        element.innerHTML = marked.parse(latest);
+        chatContainer.scrollTop = chatContainer.scrollHeight;
+    };
+    const scheduled = pendingRenders.has(element);
+    pendingRenders.set(element, content);
+    if (immediate) {
+        render();
+    } else if (!scheduled) {
+        requestAnimationFrame(() => {
+            if (pendingRenders.has(element)) render();
+        });
+    }
+}
+
 // 添加消息到聊天容器
 function addMessage(role, content) {
     // 移除欢迎消息
@@ -110,6 +205,8 @@ function addMessage(role, content) {
     
     // 滚动到底部
     chatContainer.scrollTop = chatContainer.scrollHeight;
+    
+    return messageContent;
 }
 
 // 显示思考动画
@@ -156,6 +253,14 @@ function showThinking() {
     return thinkingId;
 }
 
+// 更新思考动画的提示文字
+function updateThinking(thinkingId, text) {
+    const thinkingDiv = document.getElementById(thinkingId);
+    if (thinkingDiv) {
+        thinkingDiv.querySelector('.thinking-text').textContent = text;
+    }
+}
+
 // 移除思考动画
 function removeThinking(thinkingId) {
     const thinkingDiv = document.getElementById(thinkingId);
@@ -0,0 +1,164 @@
+"""
+静态资源（主页和 /static 下的文件）
+
+启动时一次性读入内存，并预先计算：
+- gzip 和 brotli（安装了 brotli 包时）压缩版本，按 Accept-Encoding 选择
+- 强 ETag（内容哈希），If-None-Match 匹配时返回 304
+- 指纹 URL：index.html 中对其他资源的引用改写为 /static/<name>?v=<hash>，
+  带当前指纹的请求返回一年的 immutable 缓存头，其余请求每次重新验证（no-cache）
+
+每次请求只做字典查找和响应头拼装，不访问文件系统。
+"""
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from starlette.datastructures import Headers
+from starlette.responses import PlainTextResponse, Response
+
+try:
+    import brotli
+except ImportError:  # 可选依赖
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+INDEX = "index.html"
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+# 小于该字节数的文件不压缩
+MIN_COMPRESS_SIZE = 256
+# 按优先级排列的编码
+ENCODINGS = ("br", "gzip")
+
+
+class StaticAsset:
+    """一个静态资源的全部变体"""
+
+    __slots__ = ("name", "content_type", "fingerprint", "etag", "variants")
+
+    def __init__(self, name: str, body: bytes):
+        self.name = name
+        content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        if content_type.startswith("text/") or content_type in ("application/javascript", "application/json"):
+            content_type += "; charset=utf-8"
+        self.content_type = content_type
+        self.fingerprint = hashlib.sha256(body).hexdigest()[:16]
+        self.etag = f'"{self.fingerprint}"'
+        # 编码 -> (响应体, ETag)；不同编码的表示使用不同的强 ETag
+        self.variants: Dict[str, Tuple[bytes, str]] = {"identity": (body, self.etag)}
+        if len(body) >= MIN_COMPRESS_SIZE:
+            compressed = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                compressed["br"] = brotli.compress(body, quality=11)
+            for encoding, data in compressed.items():
+                if len(data) < len(body):
+                    self.variants[encoding] = (data, f'"{self.fingerprint}-{encoding}"')
+
+    def etags(self) -> List[str]:
+        return [etag for _, etag in self.variants.values()]
+
+    def select(self, accept_encoding: str) -> Tuple[str, bytes, str]:
+        """按 Accept-Encoding 选择变体，返回 (编码, 响应体, ETag)"""
+        accepted = {item.split(";")[0].strip() for item in accept_encoding.lower().split(",")}
+        for encoding in ENCODINGS:
+            if encoding in accepted and encoding in self.variants:
+                return (encoding,) + self.variants[encoding]
+        return ("identity",) + self.variants["identity"]
+
+
+class StaticAssets:
+    """从目录加载的静态资源集合"""
+
+    def __init__(self, directory: str = STATIC_DIR, url_prefix: str = "/static"):
+        self.directory = directory
+        self.url_prefix = url_prefix
+        self._assets: Optional[Dict[str, StaticAsset]] = None
+
+    def load(self) -> Dict[str, StaticAsset]:
+        """读入全部文件（只执行一次）"""
+        if self._assets is not None:
+            return self._assets
+        files: Dict[str, bytes] = {}
+        for root, _, names in os.walk(self.directory):
+            for filename in names:
+                path = os.path.join(root, filename)
+                name = os.path.relpath(path, self.directory).replace(os.sep, "/")
+                with open(path, "rb") as f:
+                    files[name] = f.read()
+
+        assets = {name: StaticAsset(name, body) for name, body in files.items() if name != INDEX}
+        if INDEX in files:
+            assets[INDEX] = StaticAsset(INDEX, self._fingerprint_links(files[INDEX].decode("utf-8"), assets))
+        self._assets = assets
+        logger.info("已加载 %d 个静态资源（brotli: %s）", len(assets), "启用" if brotli is not None else "未安装")
+        return assets
+
+    def _fingerprint_links(self, html: str, assets: Dict[str, StaticAsset]) -> bytes:
+        """把 index.html 中对其他资源的引用改写为带指纹的 URL"""
+        for name, asset in assets.items():
+            url = f"{self.url_prefix}/{name}"
+            html = html.replace(f'"{url}"', f'"{url}?v={asset.fingerprint}"')
+        return html.encode("utf-8")
+
+    def get(self, name: str) -> Optional[StaticAsset]:
+        return self.load().get(name)
+
+    def url(self, name: str) -> str:
+        """带指纹的 URL"""
+        asset = self.get(name)
+        url = f"{self.url_prefix}/{name}"
+        return f"{url}?v={asset.fingerprint}" if asset is not None else url
+
+    def response(self, asset: StaticAsset, headers: Mapping[str, str], immutable: bool = False) -> Response:
+        """按请求头返回 304 或对应编码的资源"""
+        encoding, body, etag = asset.select(headers.get("accept-encoding", ""))
+        response_headers = {
+            "cache-control": IMMUTABLE if immutable else REVALIDATE,
+            "vary": "accept-encoding",
+            "etag": etag,
+        }
+        if_none_match = headers.get("if-none-match")
+        if if_none_match is not None and (
+            if_none_match.strip() == "*"
+            or any(tag.strip().removeprefix("W/") in asset.etags() for tag in if_none_match.split(","))
+        ):
+            return Response(status_code=304, headers=response_headers)
+        if encoding != "identity":
+            response_headers["content-encoding"] = encoding
+        response_headers["content-type"] = asset.content_type
+        return Response(body, headers=response_headers)
+
+
+class StaticAssetsApp:
+    """
+    挂载在 /static 下的 ASGI 应用（替代 StaticFiles）
+
+    查询参数 v 等于当前指纹时返回 immutable 缓存头。
+    """
+
+    def __init__(self, assets: StaticAssets):
+        self.assets = assets
+
+    async def __call__(self, scope, receive, send):
+        if scope["method"] not in ("GET", "HEAD"):
+            response = PlainTextResponse("Method Not Allowed", status_code=405, headers={"allow": "GET, HEAD"})
+            await response(scope, receive, send)
+            return
+        path, root_path = scope["path"], scope.get("root_path", "")
+        if root_path and path.startswith(root_path):
+            # 新版 Starlette 的 Mount 不再去掉路径前缀
+            path = path[len(root_path):]
+        asset = self.assets.get(path.lstrip("/"))
+        if asset is None:
+            await PlainTextResponse("Not Found", status_code=404)(scope, receive, send)
+            return
+        version = scope.get("query_string", b"").decode("latin-1").split("&")
+        response = self.assets.response(asset, Headers(scope=scope), immutable=f"v={asset.fingerprint}" in version)
+        await response(scope, receive, send)
+
@@ -0,0 +1,176 @@
+"""
+结构化、采样、非阻塞日志
+
+- 日志记录经 QueueHandler 放入队列，由后台线程（QueueListener）格式化并写出，
+  请求处理协程不做字符串格式化和 I/O
+- 按级别采样：在入队之前丢弃，被丢弃的记录几乎没有开销
+- log_event(logger, event, **fields)：结构化事件；级别未启用时直接返回，
+  不构造任何字符串，字段在后台线程中才被格式化
+
+配置（环境变量）：
+- LOG_FORMAT: text（默认，可读文本）或 json（每行一个 JSON 对象）
+- LOG_LEVEL: 默认 INFO；设置为 DEBUG 可查看每个工具调用的参数和搜索结果摘要
+- LOG_SAMPLE_RATES: 按级别的采样比例，例如 "DEBUG=0.01,INFO=0.5"；未列出的级别全部保留
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, List, Optional
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+TEXT_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_listener: Optional[QueueListener] = None
+
+
+class Event:
+    """
+    结构化事件（作为日志参数传递，格式化推迟到后台线程）
+
+    字段值应当是不再修改的对象（字符串、数字、新建的列表/字典），
+    因为格式化发生在记录入队之后。
+    """
+
+    __slots__ = ("name", "fields")
+
+    def __init__(self, name: str, fields: Dict[str, Any]):
+        self.name = name
+        self.fields = fields
+
+    def __str__(self) -> str:
+        parts = [self.name]
+        for key, value in self.fields.items():
+            if isinstance(value, (dict, list, tuple)):
+                value = json.dumps(value, ensure_ascii=False, default=str)
+            parts.append(f"{key}={value}")
+        return " ".join(parts)
+
+
+def log_event(logger: logging.Logger, event: str, level: int = logging.INFO, **fields: Any) -> None:
+    """
+    记录一条结构化事件
+
+    Args:
+        logger: 日志记录器
+        event: 事件名，例如 "chat.round"
+        level: 日志级别
+        **fields: 事件字段
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, "%s", Event(event, fields))
+
+
+class SamplingFilter(logging.Filter):
+    """按级别采样的过滤器"""
+
+    def __init__(self, rates: Dict[int, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(record.levelno, 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    不在调用线程中格式化的 QueueHandler
+
+    标准 QueueHandler.prepare() 会在入队前格式化消息；这里只在有异常信息时
+    提前渲染 traceback（traceback 对象不能安全地延后读取），消息和参数原样入队。
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """每条记录输出一行 JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data: Dict[str, Any] = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+        }
+        args = record.args
+        if isinstance(args, tuple) and len(args) == 1 and isinstance(args[0], Event):
+            data["event"] = args[0].name
+            data.update(args[0].fields)
+        else:
+            data["msg"] = record.getMessage()
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def _parse_level(name: str) -> Optional[int]:
+    """日志级别名称转为数值；未知级别返回 None"""
+    level = logging.getLevelName(name.strip().upper())
+    return level if isinstance(level, int) else None
+
+
+def _parse_sample_rates(spec: str, invalid: List[str]) -> Dict[int, float]:
+    """解析 LOG_SAMPLE_RATES；无法解析的项加入 invalid 并忽略"""
+    rates = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        name, _, rate = item.partition("=")
+        level = _parse_level(name)
+        try:
+            value = float(rate)
+        except ValueError:
+            value = None
+        if level is None or value is None:
+            invalid.append(item.strip())
+            continue
+        rates[level] = value
+    return rates
+
+
+def setup_logging() -> None:
+    """配置根日志记录器（重复调用无副作用）"""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    if os.getenv("LOG_FORMAT", "text").lower() == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter(TEXT_FORMAT, TEXT_DATE_FORMAT))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    invalid_rates: List[str] = []
+    queue_handler.addFilter(SamplingFilter(_parse_sample_rates(os.getenv("LOG_SAMPLE_RATES", ""), invalid_rates)))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    level_name = os.getenv("LOG_LEVEL", "INFO")
+    level = _parse_level(level_name)
+    root.setLevel(logging.INFO if level is None else level)
+
+    _listener = QueueListener(log_queue, stream_handler)
+    _listener.start()
+
+    # 配置错误不影响启动：记录警告后忽略
+    logger = logging.getLogger(__name__)
+    if level is None:
+        logger.warning("LOG_LEVEL 无效，使用 INFO: %r", level_name)
+    for item in invalid_rates:
+        logger.warning("LOG_SAMPLE_RATES 中的无效项已忽略: %r", item)
+    # 进程退出时写出队列中剩余的日志
+    atexit.register(_listener.stop)
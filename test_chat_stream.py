@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+测试 Chat API 流式模式的脚本
+以 SSE 方式接收 Agentic Loop 的过程事件，并统计首字节时间
+"""
+
+import requests
+import json
+import time
+
+# API 基础 URL
+BASE_URL = "http://localhost:8000"
+
+def test_chat_stream():
+    """
+    测试 POST /chat 接口（stream = true）
+    """
+    print(f"\n{'='*50}")
+    print(f"测试 POST /chat 接口（流式模式）")
+    print(f"{'='*50}")
+
+    url = f"{BASE_URL}/chat"
+
+    # 测试请求数据 - 需要搜索最新信息
+    payload = {
+        "messages": [
+            {
+                "role": "user",
+                "content": "FastAPI 的最新版本是什么？"
+            }
+        ],
+        "model": "gpt-5",
+        "stream": True
+    }
+
+    headers = {
+        "Content-Type": "application/json",
+        "Accept": "text/event-stream"
+    }
+
+    try:
+        print(f"\n📤 发送请求:")
+        print(f"URL: {url}")
+        print(f"Payload:")
+        print(json.dumps(payload, indent=2, ensure_ascii=False))
+
+        start_time = time.time()
+        first_byte_time = None
+        answer = ""
+        event_counts = {}
+
+        with requests.post(url, json=payload, headers=headers, stream=True, timeout=240) as response:
+            response.raise_for_status()
+            print(f"\n✅ 连接成功！")
+            print(f"状态码: {response.status_code}")
+            print(f"Content-Type: {response.headers.get('content-type')}")
+            print(f"\n📥 事件流:")
+
+            event = None
+            for line in response.iter_lines(decode_unicode=True):
+                if first_byte_time is None:
+                    first_byte_time = time.time() - start_time
+                if not line:
+                    continue
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                    continue
+                if not line.startswith("data:"):
+                    continue
+
+                data = json.loads(line[5:].strip())
+                event_counts[event] = event_counts.get(event, 0) + 1
+                elapsed = time.time() - start_time
+
+                if event == "round_start":
+                    print(f"  [{elapsed:6.2f}s] 第 {data['round']} 轮开始（工具可用: {data['tools_available']}）")
+                elif event == "tool_call":
+                    print(f"  [{elapsed:6.2f}s] 🔍 工具调用 {data['id']}: {data.get('arguments')}")
+                elif event == "tool_result":
+                    print(f"  [{elapsed:6.2f}s] ✓ 工具结果 {data['id']}: {data.get('result_count', 0)} 个结果")
+                elif event == "delta":
+                    answer += data["content"]
+                elif event == "done":
+                    print(f"  [{elapsed:6.2f}s] 完成，finish_reason = {data['choices'][0].get('finish_reason')}")
+                elif event == "error":
+                    print(f"  [{elapsed:6.2f}s] ❌ 错误 {data['status_code']}: {data['detail']}")
+
+        total_time = time.time() - start_time
+        print(f"\n🤖 AI 回复:")
+        print(answer)
+        print(f"\n📊 统计:")
+        print(f"  首字节时间: {first_byte_time:.2f}s" if first_byte_time is not None else "  首字节时间: N/A")
+        print(f"  总耗时: {total_time:.2f}s")
+        print(f"  事件数量: {event_counts}")
+
+        return event_counts
+
+    except requests.exceptions.ConnectionError:
+        print(f"❌ 连接错误：无法连接到 {BASE_URL}")
+        print("请确保 FastAPI 应用正在运行（运行: uvicorn main:app --reload）")
+        return None
+    except requests.exceptions.HTTPError as e:
+        print(f"❌ HTTP 错误：{e}")
+        print(f"状态码: {e.response.status_code}")
+        return None
+    except requests.exceptions.Timeout:
+        print(f"❌ 请求超时：AI Builder 服务响应时间过长")
+        return None
+    except Exception as e:
+        print(f"❌ 发生错误：{e}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+
+def main():
+    """主函数"""
+    print("🚀 开始测试 Chat API 流式模式")
+    print(f"API 地址: {BASE_URL}")
+
+    test_chat_stream()
+
+    print(f"\n{'='*50}")
+    print("测试完成！")
+    print(f"{'='*50}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -85,6 +85,8 @@ def test_chat_with_logs():
         print("  - 每轮的开始和结束")
         print("  - 工具调用的详细信息（工具名称、参数）")
         print("  - 搜索结果的摘要")
+        print("（每轮和每个请求各输出一条汇总日志；工具调用参数和搜索结果摘要需要以 LOG_LEVEL=DEBUG 启动服务器，")
+        print("  LOG_FORMAT=json 时输出结构化 JSON 日志）")
         print(f"{'='*60}\n")
         
         return result
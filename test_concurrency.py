@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+测试上游并发限制器的队列上限
+"""
+
+import asyncio
+
+from concurrency import ConcurrencyLimiter, UpstreamOverloaded
+
+
+def test_burst_respects_queue_bound():
+    """同一时刻到达 50 个调用：只允许 max_concurrency + max_queue 个进入，其余立即拒绝"""
+    limiter = ConcurrencyLimiter("test", max_concurrency=2, max_queue=2, queue_timeout=5.0, retry_after=1.0)
+    peak = {"load": 0}
+
+    async def call():
+        async with limiter.slot():
+            peak["load"] = max(peak["load"], limiter.in_flight + limiter.queued)
+            await asyncio.sleep(0.01)
+
+    async def burst():
+        return await asyncio.gather(*(call() for _ in range(50)), return_exceptions=True)
+
+    results = asyncio.run(burst())
+    rejected = [r for r in results if isinstance(r, UpstreamOverloaded)]
+    print(f"限制器状态: {limiter.stats()}，最大负载（进行中 + 排队）: {peak['load']}")
+    assert len(rejected) == 46
+    assert limiter.rejected == 46
+    assert limiter.admitted == 4
+    assert peak["load"] <= limiter.max_concurrency + limiter.max_queue
+
+
+def main():
+    """主函数"""
+    print("🚀 开始测试并发限制器")
+    test_burst_respects_queue_bound()
+    print("✅ 测试通过")
+
+
+if __name__ == "__main__":
+    main()
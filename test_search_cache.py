@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+测试搜索负缓存（不依赖真实上游，使用 httpx.MockTransport）
+"""
+
+import asyncio
+import json
+
+import httpx
+
+import deadline
+import main as api
+import upstream
+
+
+def run_with_upstream(handler, coro_factory):
+    """使用模拟上游和空的搜索缓存运行 coro_factory()，结束后恢复共享客户端"""
+    saved_client = upstream._client
+    upstream._client = httpx.AsyncClient(base_url="http://upstream.test", transport=httpx.MockTransport(handler))
+    api.search_cache.clear()
+
+    async def run():
+        try:
+            return await coro_factory()
+        finally:
+            await upstream._client.aclose()
+
+    try:
+        return asyncio.run(run())
+    finally:
+        upstream._client = saved_client
+        api.search_cache.clear()
+
+
+def rejecting_handler(request):
+    """包含关键词 bad 的请求返回 400，其余正常返回"""
+    keywords = json.loads(request.content)["keywords"]
+    if "bad" in keywords:
+        return httpx.Response(400, json={"detail": "invalid keyword"})
+    return httpx.Response(200, json={"queries": [
+        {"keyword": keyword, "response": {"results": [{"title": keyword, "url": f"https://example.com/{keyword}"}]}}
+        for keyword in keywords
+    ]})
+
+
+def test_batch_rejection_does_not_poison_other_keywords():
+    """整批被拒绝时，同批的正常关键词不能写入负缓存"""
+
+    async def scenario():
+        try:
+            await api.search_with_cache(["fastapi", "bad"], 3)
+        except httpx.HTTPStatusError as e:
+            assert e.response.status_code == 400
+        else:
+            raise AssertionError("应当返回 400")
+        return await api.search_with_cache(["fastapi"], 3)
+
+    result = run_with_upstream(rejecting_handler, scenario)
+    print(f"搜索结果: {result}")
+    assert [query["keyword"] for query in result["queries"]] == ["fastapi"]
+    assert not result["errors"]
+
+
+def test_cached_rejection_keeps_status():
+    """单个关键词被拒绝后，负缓存命中时保留原来的 4xx 状态码，不提示重试"""
+    calls = {"n": 0}
+
+    def handler(request):
+        calls["n"] += 1
+        return rejecting_handler(request)
+
+    async def scenario():
+        for _ in range(2):
+            try:
+                await api.search_with_cache(["bad"], 3)
+            except Exception as e:
+                error = e
+        return error
+
+    error = run_with_upstream(handler, scenario)
+    exc = api.upstream_http_exception(error, "search")
+    print(f"第二次请求: {type(error).__name__} -> {exc.status_code} {exc.headers}")
+    assert calls["n"] == 1
+    assert isinstance(error, api.CachedSearchError)
+    assert exc.status_code == 400
+    assert not exc.headers or "Retry-After" not in exc.headers
+
+
+def test_coalesced_search_uses_own_deadline():
+    """合并的搜索请求：截止时间很短的第一个调用方超时，不影响截止时间充足的后续调用方"""
+
+    async def handler(request):
+        await asyncio.sleep(0.5)
+        return rejecting_handler(request)
+
+    async def search(seconds):
+        with deadline.scope(deadline.Deadline(seconds)):
+            return await api.search_with_cache(["fastapi"], 3)
+
+    async def scenario():
+        leader = asyncio.ensure_future(search(0.2))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(search(60))
+        return await asyncio.gather(leader, follower, return_exceptions=True)
+
+    leader, follower = run_with_upstream(handler, scenario)
+    print(f"第一个调用方: {leader!r}\n后续调用方: {follower}")
+    assert isinstance(leader, asyncio.TimeoutError)
+    assert [query["keyword"] for query in follower["queries"]] == ["fastapi"]
+    assert api.search_flight.coalesced >= 1
+
+
+def main():
+    """主函数"""
+    print("🚀 开始测试搜索负缓存")
+    test_batch_rejection_does_not_poison_other_keywords()
+    test_cached_rejection_keeps_status()
+    test_coalesced_search_uses_own_deadline()
+    print("✅ 测试通过")
+
+
+if __name__ == "__main__":
+    main()
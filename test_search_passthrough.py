@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+测试 /search 透传模式（不依赖真实上游，使用 httpx.MockTransport）
+"""
+
+import asyncio
+import gzip
+import json
+
+import httpx
+
+import main as api
+import upstream
+
+SEARCH_BODY = json.dumps({
+    "queries": [{"keyword": "FastAPI", "response": {"results": [{"title": "FastAPI", "url": "https://fastapi.tiangolo.com"}]}}],
+    "combined_answer": None,
+    "errors": None,
+}).encode()
+
+
+class ChunkedStream(httpx.AsyncByteStream):
+    """按数据块返回的响应体（与网络上收到的响应相同，不会被 httpx 预先读取）"""
+
+    def __init__(self, data: bytes, size: int = 16):
+        self.chunks = [data[i:i + size] for i in range(0, len(data), size)]
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+def run_with_upstream(handler, coro_factory):
+    """使用模拟上游运行 coro_factory()，结束后恢复共享客户端"""
+    saved_client = upstream._client
+    upstream._client = httpx.AsyncClient(base_url="http://upstream.test", transport=httpx.MockTransport(handler))
+
+    async def run():
+        try:
+            return await coro_factory()
+        finally:
+            await upstream._client.aclose()
+
+    try:
+        return asyncio.run(run())
+    finally:
+        upstream._client = saved_client
+
+
+def test_gzip_body_is_forwarded_unchanged():
+    """上游返回 gzip 编码的响应体：原样转发字节、状态码、Content-Type 和 Content-Encoding"""
+    compressed = gzip.compress(SEARCH_BODY)
+    seen = {}
+
+    def handler(request):
+        seen["accept_encoding"] = request.headers.get("accept-encoding")
+        return httpx.Response(203, stream=ChunkedStream(compressed), headers={
+            "content-type": "application/json; charset=utf-8",
+            "content-encoding": "gzip",
+        })
+
+    async def scenario():
+        request = api.SearchRequest(keywords=["FastAPI"], max_results=3)
+        response = await api.search_passthrough(request, "gzip")
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        return response, body
+
+    response, body = run_with_upstream(handler, scenario)
+    print(f"状态码: {response.status_code}，响应头: {dict(response.headers)}，{len(body)} 字节")
+    assert seen["accept_encoding"] == "gzip"
+    assert response.status_code == 203
+    assert response.headers["content-type"] == "application/json; charset=utf-8"
+    assert response.headers["content-encoding"] == "gzip"
+    assert body == compressed
+    assert json.loads(gzip.decompress(body)) == json.loads(SEARCH_BODY)
+
+
+def main():
+    """主函数"""
+    print("🚀 开始测试搜索透传")
+    test_gzip_body_is_forwarded_unchanged()
+    print("✅ 测试通过")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+测试流式 Search API 的脚本
+以 NDJSON 逐行接收每个关键词的搜索结果，并统计首个结果的时间
+"""
+
+import requests
+import json
+import time
+
+# API 基础 URL
+BASE_URL = "http://localhost:8000"
+
+def test_search_stream():
+    """
+    测试 POST /search/stream 接口
+    """
+    print(f"\n{'='*50}")
+    print(f"测试 POST /search/stream 接口")
+    print(f"{'='*50}")
+
+    url = f"{BASE_URL}/search/stream"
+
+    payload = {
+        "keywords": ["FastAPI", "Python web framework", "REST API", "async programming"],
+        "max_results": 3
+    }
+
+    try:
+        print(f"\n📤 发送请求:")
+        print(f"URL: {url}")
+        print(f"Payload:")
+        print(json.dumps(payload, indent=2, ensure_ascii=False))
+
+        start_time = time.time()
+        first_result_time = None
+        line_counts = {}
+
+        with requests.post(url, json=payload, stream=True, timeout=120) as response:
+            response.raise_for_status()
+            print(f"\n✅ 连接成功！")
+            print(f"状态码: {response.status_code}")
+            print(f"Content-Type: {response.headers.get('content-type')}")
+            print(f"\n📥 结果流:")
+
+            for line in response.iter_lines(decode_unicode=True):
+                if not line:
+                    continue
+                data = json.loads(line)
+                elapsed = time.time() - start_time
+                line_counts[data["type"]] = line_counts.get(data["type"], 0) + 1
+
+                if data["type"] == "query":
+                    if first_result_time is None:
+                        first_result_time = elapsed
+                    results = data["response"].get("results", [])
+                    print(f"  [{elapsed:6.2f}s] ✓ {data['keyword']}: {len(results)} 个结果")
+                    for item in results[:2]:
+                        print(f"      - {item.get('title', 'N/A')}")
+                elif data["type"] == "error":
+                    print(f"  [{elapsed:6.2f}s] ❌ {data['keyword']}: {data['error']}")
+                elif data["type"] == "done":
+                    print(f"  [{elapsed:6.2f}s] 完成，成功 {data['queries']} 个，失败 {data['errors']} 个")
+
+        total_time = time.time() - start_time
+        print(f"\n📊 统计:")
+        print(f"  首个结果时间: {first_result_time:.2f}s" if first_result_time is not None else "  首个结果时间: N/A")
+        print(f"  总耗时: {total_time:.2f}s")
+        print(f"  行数: {line_counts}")
+
+        return line_counts
+
+    except requests.exceptions.ConnectionError:
+        print(f"❌ 连接错误：无法连接到 {BASE_URL}")
+        print("请确保 FastAPI 应用正在运行（运行: uvicorn main:app --reload）")
+        return None
+    except requests.exceptions.HTTPError as e:
+        print(f"❌ HTTP 错误：{e}")
+        print(f"状态码: {e.response.status_code}")
+        return None
+    except requests.exceptions.Timeout:
+        print(f"❌ 请求超时：AI Builder 服务响应时间过长")
+        return None
+    except Exception as e:
+        print(f"❌ 发生错误：{e}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+
+def main():
+    """主函数"""
+    print("🚀 开始测试流式 Search API")
+    print(f"API 地址: {BASE_URL}")
+
+    test_search_stream()
+
+    print(f"\n{'='*50}")
+    print("测试完成！")
+    print(f"{'='*50}\n")
+
+
+if __name__ == "__main__":
+    main()
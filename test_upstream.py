@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+测试上游客户端的熔断器记录（不依赖真实上游，使用 httpx.MockTransport）
+"""
+
+import asyncio
+from contextlib import aclosing
+
+import httpx
+
+import deadline
+import upstream
+from concurrency import ConcurrencyLimiter, UpstreamOverloaded
+from resilience import HALF_OPEN, CircuitBreaker
+
+SSE_BODY = (
+    'data: {"choices":[{"delta":{"content":"Hello"},"finish_reason":null}]}\n\n'
+    'data: {"choices":[{"delta":{},"finish_reason":"stop"}]}\n\n'
+    "data: [DONE]\n\n"
+)
+
+
+def run_with_upstream(handler, coro_factory):
+    """使用模拟上游运行 coro_factory()，结束后恢复共享客户端、熔断器和并发限制器"""
+    saved_client, saved_breakers, saved_limiters = upstream._client, dict(upstream.breakers), dict(upstream.limiters)
+    upstream._client = httpx.AsyncClient(base_url="http://upstream.test", transport=httpx.MockTransport(handler))
+    upstream.breakers.clear()
+    upstream.breakers.update({path: upstream._new_breaker(b.name) for path, b in saved_breakers.items()})
+
+    async def main():
+        try:
+            return await coro_factory()
+        finally:
+            await upstream._client.aclose()
+
+    try:
+        return asyncio.run(main())
+    finally:
+        upstream._client = saved_client
+        upstream.breakers.clear()
+        upstream.breakers.update(saved_breakers)
+        upstream.limiters.clear()
+        upstream.limiters.update(saved_limiters)
+
+
+def test_stream_closed_after_done_counts_as_success():
+    """一次失败后，读到 [DONE] 就提前结束的 N 个流式对话应当把连续失败数清零"""
+    calls = {"n": 0}
+
+    def handler(request):
+        calls["n"] += 1
+        if calls["n"] == 1:
+            return httpx.Response(500, json={"detail": "boom"})
+        return httpx.Response(200, text=SSE_BODY, headers={"content-type": "text/event-stream"})
+
+    async def scenario():
+        path = upstream.CHAT_COMPLETIONS_PATH
+        breaker: CircuitBreaker = upstream.breakers[path]
+        try:
+            async for _ in upstream.stream_lines(path, {"stream": True}):
+                pass
+        except httpx.HTTPStatusError:
+            pass
+        assert breaker.stats()["consecutive_failures"] == 1
+
+        for _ in range(5):
+            # 与 main.stream_completion 相同：读到 [DONE] 即跳出并关闭流
+            async with aclosing(upstream.stream_lines(path, {"stream": True})) as stream:
+                async for line in stream:
+                    if line.startswith("data:") and line[5:].strip() == "[DONE]":
+                        break
+        return breaker.stats()
+
+    stats = run_with_upstream(handler, scenario)
+    print(f"熔断器状态: {stats}")
+    assert stats["consecutive_failures"] == 0
+    assert stats["state"] == "closed"
+
+
+def test_local_rejection_does_not_close_half_open_breaker():
+    """half-open 时排队已满被本地拒绝的调用没有到达上游，不能当作探测成功"""
+
+    def handler(request):
+        raise AssertionError("被拒绝的调用不应到达上游")
+
+    async def scenario():
+        path = upstream.CHAT_COMPLETIONS_PATH
+        breaker: CircuitBreaker = upstream.breakers[path]
+        breaker._open()
+        breaker._opened_at -= breaker.reset_timeout
+        breaker._consecutive_failures = 3
+        limiter = upstream.limiters[path] = ConcurrencyLimiter(
+            "chat", max_concurrency=1, max_queue=0, queue_timeout=1.0, retry_after=1.0
+        )
+        async with limiter.slot():
+            try:
+                await upstream.post_json(path, {})
+            except UpstreamOverloaded:
+                pass
+            else:
+                raise AssertionError("应当被并发限制器拒绝")
+        return breaker.stats()
+
+    stats = run_with_upstream(handler, scenario)
+    print(f"熔断器状态: {stats}")
+    assert stats["state"] == HALF_OPEN
+    assert stats["consecutive_failures"] == 3
+
+
+def test_request_deadline_timeouts_do_not_trip_breaker():
+    """请求自身截止时间很短导致的超时是调用方放弃，不能计入熔断"""
+
+    async def handler(request):
+        await asyncio.sleep(0.5)
+        return httpx.Response(200, json={"choices": []})
+
+    async def scenario():
+        path = upstream.CHAT_COMPLETIONS_PATH
+        breaker: CircuitBreaker = upstream.breakers[path]
+        for _ in range(breaker.failure_threshold + 1):
+            with deadline.scope(deadline.Deadline(0.05)):
+                try:
+                    await upstream.post_json(path, {})
+                except asyncio.TimeoutError:
+                    pass
+                else:
+                    raise AssertionError("应当超时")
+        with deadline.scope(deadline.Deadline(0.05)):
+            try:
+                async for _ in upstream.stream_lines(path, {"stream": True}):
+                    pass
+            except (asyncio.TimeoutError, httpx.TimeoutException):
+                pass
+        return breaker.stats()
+
+    stats = run_with_upstream(handler, scenario)
+    print(f"熔断器状态: {stats}")
+    assert stats["state"] == "closed"
+    assert stats["consecutive_failures"] == 0
+
+
+def main():
+    """主函数"""
+    print("🚀 开始测试上游客户端")
+    test_stream_closed_after_done_counts_as_success()
+    test_local_rejection_does_not_close_half_open_breaker()
+    test_request_deadline_timeouts_do_not_trip_breaker()
+    print("✅ 测试通过")
+
+
+if __name__ == "__main__":
+    main()
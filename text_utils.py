@@ -0,0 +1,17 @@
+"""
+文本工具
+
+- cjk_re: 匹配 CJK 字符的正则（首次使用时编译）。context_budget 用它估算 token 数，
+  search_results 用它选择按字符还是按词切分 shingle
+"""
+import functools
+import re
+
+# CJK 统一表意文字、标点、全角字符、假名和韩文音节
+_CJK_PATTERN = "[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]"
+
+
+@functools.lru_cache(maxsize=None)
+def cjk_re() -> "re.Pattern[str]":
+    # 首次使用时才编译：这个字符类的编译要几毫秒，不计入冷启动
+    return re.compile(_CJK_PATTERN)
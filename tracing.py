@@ -0,0 +1,301 @@
+"""
+轻量级请求追踪
+
+每个被追踪的请求生成一条 trace，由嵌套的 span 组成（请求 → 轮次 → 上游调用 / 工具调用 → 格式化）。
+当前 trace 和 span 保存在 contextvars 中，asyncio 任务创建时会复制上下文，
+因此工具调用任务中的 span 自动挂在所在轮次的 span 之下。
+
+未被追踪的请求中 span() 返回一个共享的空对象，开销只有一次 ContextVar 读取。
+
+- 请求头 X-Debug-Trace: 1：强制追踪，并在响应头 X-Trace-Id / X-Trace 中返回 trace
+  （流式响应改为在 done 之前推送 trace 事件）
+- TRACE_EXPORT_PATH: 导出文件路径（JSONL，每行一条 trace），未设置时不导出
+- TRACE_EXPORT_FORMAT: json（默认，紧凑格式）或 otlp（OTLP/JSON ExportTraceServiceRequest，
+  可由 OpenTelemetry Collector 的 otlpjsonfile receiver 读取）
+- TRACE_SAMPLE_RATE: 设置了导出路径时追踪的请求比例，默认 1.0
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import time
+from contextvars import ContextVar
+from logging.handlers import QueueListener
+from typing import Any, Dict, List, Optional
+
+from config import env_float
+from structured_logging import DeferredQueueHandler
+
+DEBUG_HEADER = b"x-debug-trace"
+# 超过该长度时 X-Trace 响应头省略 span 属性
+MAX_HEADER_BYTES = 16 * 1024
+SERVICE_NAME = "ai-chat"
+
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH")
+TRACE_EXPORT_FORMAT = os.getenv("TRACE_EXPORT_FORMAT", "json").lower()
+TRACE_SAMPLE_RATE = env_float("TRACE_SAMPLE_RATE", 1.0)
+
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class Span:
+    """一个计时区间"""
+
+    __slots__ = ("name", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "status")
+
+    def __init__(self, name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = attributes
+        self.status = "ok"
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def end(self) -> None:
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+
+
+class Trace:
+    """一个请求的全部 span"""
+
+    def __init__(self, debug: bool = False):
+        self.trace_id = os.urandom(16).hex()
+        self.debug = debug
+        self.spans: List[Span] = []
+
+    def to_dict(self, include_attributes: bool = True) -> Dict[str, Any]:
+        """紧凑格式：时间为相对 trace 开始的毫秒数"""
+        spans = list(self.spans)
+        origin = spans[0].start_ns if spans else 0
+        now = time.time_ns()
+        return {
+            "trace_id": self.trace_id,
+            "spans": [
+                dict(
+                    {
+                        "id": span.span_id,
+                        "parent": span.parent_id,
+                        "name": span.name,
+                        "start_ms": round((span.start_ns - origin) / 1e6, 3),
+                        "duration_ms": round(((span.end_ns or now) - span.start_ns) / 1e6, 3),
+                        "status": span.status,
+                    },
+                    **({"attributes": span.attributes} if include_attributes else {})
+                )
+                for span in spans
+            ],
+        }
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """OTLP/JSON ExportTraceServiceRequest"""
+        now = time.time_ns()
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [_otlp_attribute("service.name", SERVICE_NAME)]},
+                "scopeSpans": [{
+                    "scope": {"name": __name__},
+                    "spans": [
+                        {
+                            "traceId": self.trace_id,
+                            "spanId": span.span_id,
+                            "parentSpanId": span.parent_id or "",
+                            "name": span.name,
+                            "kind": 1,
+                            "startTimeUnixNano": str(span.start_ns),
+                            "endTimeUnixNano": str(span.end_ns or now),
+                            "attributes": [_otlp_attribute(key, value) for key, value in span.attributes.items()],
+                            # 1 = OK, 2 = ERROR
+                            "status": {"code": 1 if span.status == "ok" else 2, "message": span.status},
+                        }
+                        for span in list(self.spans)
+                    ],
+                }],
+            }]
+        }
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    elif isinstance(value, str):
+        typed = {"stringValue": value}
+    else:
+        typed = {"stringValue": json.dumps(value, ensure_ascii=False, default=str)}
+    return {"key": key, "value": typed}
+
+
+class _SpanContext:
+    """span() 返回的上下文管理器"""
+
+    __slots__ = ("_trace", "_name", "_attributes", "_span", "_token")
+
+    def __init__(self, trace: Trace, name: str, attributes: Dict[str, Any]):
+        self._trace = trace
+        self._name = name
+        self._attributes = attributes
+
+    def __enter__(self) -> Span:
+        parent = _current_span.get()
+        self._span = Span(self._name, parent.span_id if parent else None, self._attributes)
+        self._trace.spans.append(self._span)
+        self._token = _current_span.set(self._span)
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None:
+            self._span.status = "cancelled" if exc_type.__name__ == "CancelledError" else "error"
+            self._span.attributes.setdefault("exception", exc_type.__name__)
+        self._span.end()
+        _current_span.reset(self._token)
+
+
+class _NoopSpan:
+    """未追踪时使用的空 span"""
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        return None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        return None
+
+    def set_attributes(self, **attributes: Any) -> None:
+        return None
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str, /, **attributes: Any):
+    """
+    在当前 trace 中开启一个子 span（with 语句使用）
+
+    未被追踪的请求中返回空对象，with 块照常执行。
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return NOOP_SPAN
+    return _SpanContext(trace, name, attributes)
+
+
+def current_span():
+    """当前 span；未被追踪时返回空 span"""
+    return _current_span.get() or NOOP_SPAN
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+# ==================== 导出 ====================
+
+_export_logger = logging.getLogger("tracing.export")
+_export_logger.propagate = False
+_export_listener: Optional[QueueListener] = None
+
+
+class _ExportRecord:
+    """导出内容，在后台线程中才序列化"""
+
+    __slots__ = ("_trace",)
+
+    def __init__(self, trace: Trace):
+        self._trace = trace
+
+    def __str__(self) -> str:
+        data = self._trace.to_otlp() if TRACE_EXPORT_FORMAT == "otlp" else self._trace.to_dict()
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def _start_export() -> None:
+    global _export_listener
+    file_handler = logging.FileHandler(TRACE_EXPORT_PATH, encoding="utf-8")
+    file_handler.setFormatter(logging.Formatter("%(message)s"))
+    export_queue: queue.SimpleQueue = queue.SimpleQueue()
+    _export_logger.addHandler(DeferredQueueHandler(export_queue))
+    _export_logger.setLevel(logging.INFO)
+    _export_listener = QueueListener(export_queue, file_handler)
+    _export_listener.start()
+    atexit.register(_export_listener.stop)
+
+
+def export(trace: Trace) -> None:
+    """把 trace 交给后台线程写入导出文件"""
+    if not TRACE_EXPORT_PATH:
+        return
+    if _export_listener is None:
+        _start_export()
+    _export_logger.info("%s", _ExportRecord(trace))
+
+
+# ==================== ASGI 中间件 ====================
+
+class TracingMiddleware:
+    """
+    ASGI 中间件：决定是否追踪请求，创建根 span，返回或导出 trace
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        debug = dict(scope["headers"]).get(DEBUG_HEADER, b"").lower() in (b"1", b"true")
+        sampled = bool(TRACE_EXPORT_PATH) and random.random() < TRACE_SAMPLE_RATE
+        if not debug and not sampled:
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace(debug=debug)
+        attributes: Dict[str, Any] = {"method": scope["method"], "path": scope["path"]}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                attributes["status_code"] = message["status"]
+                if debug:
+                    message = dict(message, headers=list(message.get("headers", [])) + trace_headers(trace))
+            await send(message)
+
+        trace_token = _current_trace.set(trace)
+        try:
+            with _SpanContext(trace, "http.request", attributes):
+                try:
+                    await self.app(scope, receive, send_wrapper)
+                finally:
+                    route = scope.get("route")
+                    if route is not None:
+                        attributes["route"] = route.path
+        finally:
+            _current_trace.reset(trace_token)
+            export(trace)
+
+
+def trace_headers(trace: Trace) -> List[tuple]:
+    """X-Trace-Id 和 X-Trace 响应头（过大时省略 span 属性）"""
+    value = json.dumps(trace.to_dict(), separators=(",", ":"))
+    if len(value) > MAX_HEADER_BYTES:
+        value = json.dumps(trace.to_dict(include_attributes=False), separators=(",", ":"))
+    headers = [(b"x-trace-id", trace.trace_id.encode("latin-1"))]
+    if len(value) <= MAX_HEADER_BYTES:
+        headers.append((b"x-trace", value.encode("latin-1")))
+    return headers
@@ -0,0 +1,398 @@
+"""
+AI Builder 上游 HTTP 客户端
+
+所有对 AI Builder 的调用（chat completions、search）共享一个异步 httpx 客户端，
+避免在 async 端点中使用同步 requests 阻塞事件循环。
+
+- 长连接复用：keep-alive 连接池，随 FastAPI lifespan 创建与关闭
+- 连接池上限可配置
+- 分阶段超时：connect / read / total
+
+配置（环境变量）：
+- AI_BUILDER_MAX_CONNECTIONS: 连接池最大连接数，默认 200
+- AI_BUILDER_MAX_KEEPALIVE: 最大空闲长连接数，默认 50
+- AI_BUILDER_KEEPALIVE_EXPIRY: 空闲长连接保留秒数，默认 30
+- AI_BUILDER_CONNECT_TIMEOUT: 建立连接超时秒数，默认 5
+- AI_BUILDER_READ_TIMEOUT: 读取响应超时秒数，默认 60
+- AI_BUILDER_POOL_TIMEOUT: 等待连接池空闲连接的超时秒数，默认 10
+- AI_BUILDER_TOTAL_TIMEOUT: 单次请求的总超时秒数，默认 90
+
+上游并发限制（每个路由独立，超过队列上限时快速失败）：
+- AI_BUILDER_CHAT_MAX_CONCURRENCY / AI_BUILDER_CHAT_MAX_QUEUE: chat completions，默认 32 / 64
+- AI_BUILDER_SEARCH_MAX_CONCURRENCY / AI_BUILDER_SEARCH_MAX_QUEUE: search，默认 32 / 128
+- AI_BUILDER_QUEUE_TIMEOUT: 排队最长等待秒数，默认 10
+- AI_BUILDER_RETRY_AFTER: 拒绝时返回的 Retry-After 秒数，默认 2
+
+熔断与重试（熔断器每个路由独立，重试预算全局共享）：
+- AI_BUILDER_BREAKER_FAILURE_THRESHOLD: 连续失败多少次后熔断，默认 5
+- AI_BUILDER_BREAKER_FAILURE_RATE: 最近调用失败率达到多少时熔断，默认 0.5
+- AI_BUILDER_BREAKER_RESET_TIMEOUT: 熔断后多少秒进入 half-open 探测，默认 30
+- AI_BUILDER_MAX_RETRIES: 单次调用的最大重试次数，默认 2
+- AI_BUILDER_RETRY_BUDGET_RATIO: 每个请求为重试预算存入的额度，默认 0.1（重试约占 10%）
+- AI_BUILDER_RETRY_BUDGET_MIN_PER_SEC: 重试预算每秒保底补充的额度，默认 1
+- AI_BUILDER_RETRY_BASE_DELAY / AI_BUILDER_RETRY_MAX_DELAY: 退避基数和上限秒数，默认 0.2 / 2
+
+在请求截止时间（deadline.scope）内调用时，排队、单次尝试的超时都不超过剩余时间，
+剩余时间不够退避等待时不再重试。因截止时间提前结束的尝试是调用方放弃，不计入熔断。
+"""
+import asyncio
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Union
+
+import deadline
+import fast_json
+import startup
+from concurrency import ConcurrencyLimiter, UpstreamOverloaded
+from config import env_float, env_int
+from resilience import CircuitBreaker, RetryBudget, backoff_delay, is_retryable, is_upstream_failure
+
+# FAST_START 模式下首次使用时才加载
+httpx = startup.import_module("httpx")
+
+MAX_CONNECTIONS = env_int("AI_BUILDER_MAX_CONNECTIONS", 200)
+MAX_KEEPALIVE_CONNECTIONS = env_int("AI_BUILDER_MAX_KEEPALIVE", 50)
+KEEPALIVE_EXPIRY = env_float("AI_BUILDER_KEEPALIVE_EXPIRY", 30.0)
+CONNECT_TIMEOUT = env_float("AI_BUILDER_CONNECT_TIMEOUT", 5.0)
+READ_TIMEOUT = env_float("AI_BUILDER_READ_TIMEOUT", 60.0)
+POOL_TIMEOUT = env_float("AI_BUILDER_POOL_TIMEOUT", 10.0)
+TOTAL_TIMEOUT = env_float("AI_BUILDER_TOTAL_TIMEOUT", 90.0)
+
+QUEUE_TIMEOUT = env_float("AI_BUILDER_QUEUE_TIMEOUT", 10.0)
+RETRY_AFTER = env_float("AI_BUILDER_RETRY_AFTER", 2.0)
+
+CHAT_COMPLETIONS_PATH = "/v1/chat/completions"
+SEARCH_PATH = "/v1/search/"
+
+# 每个上游路由独立的并发限制器
+limiters: Dict[str, ConcurrencyLimiter] = {
+    CHAT_COMPLETIONS_PATH: ConcurrencyLimiter(
+        "chat",
+        max_concurrency=env_int("AI_BUILDER_CHAT_MAX_CONCURRENCY", 32),
+        max_queue=env_int("AI_BUILDER_CHAT_MAX_QUEUE", 64),
+        queue_timeout=QUEUE_TIMEOUT,
+        retry_after=RETRY_AFTER,
+    ),
+    SEARCH_PATH: ConcurrencyLimiter(
+        "search",
+        max_concurrency=env_int("AI_BUILDER_SEARCH_MAX_CONCURRENCY", 32),
+        max_queue=env_int("AI_BUILDER_SEARCH_MAX_QUEUE", 128),
+        queue_timeout=QUEUE_TIMEOUT,
+        retry_after=RETRY_AFTER,
+    ),
+}
+
+MAX_RETRIES = env_int("AI_BUILDER_MAX_RETRIES", 2)
+RETRY_BASE_DELAY = env_float("AI_BUILDER_RETRY_BASE_DELAY", 0.2)
+RETRY_MAX_DELAY = env_float("AI_BUILDER_RETRY_MAX_DELAY", 2.0)
+
+
+def _new_breaker(name: str) -> CircuitBreaker:
+    return CircuitBreaker(
+        name,
+        failure_threshold=env_int("AI_BUILDER_BREAKER_FAILURE_THRESHOLD", 5),
+        failure_rate=env_float("AI_BUILDER_BREAKER_FAILURE_RATE", 0.5),
+        reset_timeout=env_float("AI_BUILDER_BREAKER_RESET_TIMEOUT", 30.0),
+    )
+
+
+# 每个上游路由独立的熔断器
+breakers: Dict[str, CircuitBreaker] = {
+    CHAT_COMPLETIONS_PATH: _new_breaker("chat"),
+    SEARCH_PATH: _new_breaker("search"),
+}
+
+# 全局重试预算
+retry_budget = RetryBudget(
+    ratio=env_float("AI_BUILDER_RETRY_BUDGET_RATIO", 0.1),
+    min_per_second=env_float("AI_BUILDER_RETRY_BUDGET_MIN_PER_SEC", 1.0),
+)
+
+
+def __getattr__(name: str) -> Any:
+    # 上游超时类异常：httpx 的分阶段超时 + total 超时（asyncio.wait_for）
+    # 按需取值，FAST_START 模式下导入本模块时不加载 httpx
+    if name == "TIMEOUT_ERRORS":
+        return (httpx.TimeoutException, asyncio.TimeoutError)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+_base_url: str = ""
+_api_key: Union[None, str, Callable[[], Optional[str]]] = None
+_client: Optional["httpx.AsyncClient"] = None
+
+
+def configure(base_url: str, api_key: Union[None, str, Callable[[], Optional[str]]]) -> None:
+    """
+    设置上游地址和 API token（在创建客户端之前调用）
+
+    api_key 可以是返回 token 的函数，创建客户端时才调用。
+    """
+    global _base_url, _api_key
+    _base_url = base_url.rstrip("/")
+    _api_key = api_key
+
+
+def _build_client() -> "httpx.AsyncClient":
+    headers = {"Content-Type": "application/json"}
+    api_key = _api_key() if callable(_api_key) else _api_key
+    if api_key:
+        headers["Authorization"] = f"Bearer {api_key}"
+    return httpx.AsyncClient(
+        base_url=_base_url,
+        headers=headers,
+        limits=httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            connect=CONNECT_TIMEOUT,
+            read=READ_TIMEOUT,
+            write=CONNECT_TIMEOUT,
+            pool=POOL_TIMEOUT,
+        ),
+    )
+
+
+def get_client() -> "httpx.AsyncClient":
+    """
+    返回共享的异步客户端
+
+    正常情况下客户端由 lifespan 创建；在不执行 lifespan 的运行环境
+    （例如部分 serverless 平台）中首次使用时惰性创建。
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+    return _client
+
+
+async def start() -> None:
+    """lifespan 启动时调用：预先创建客户端"""
+    get_client()
+
+
+async def close() -> None:
+    """lifespan 关闭时调用：释放连接池"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _limiter(path: str) -> ConcurrencyLimiter:
+    limiter = limiters.get(path)
+    if limiter is None:
+        limiter = limiters[path] = ConcurrencyLimiter(
+            path, max_concurrency=0, max_queue=0, queue_timeout=QUEUE_TIMEOUT, retry_after=RETRY_AFTER
+        )
+    return limiter
+
+
+def _breaker(path: str) -> CircuitBreaker:
+    breaker = breakers.get(path)
+    if breaker is None:
+        breaker = breakers[path] = _new_breaker(path)
+    return breaker
+
+
+async def _should_retry(e: Exception, attempt: int) -> bool:
+    """判断是否重试；需要重试时先按退避时间等待"""
+    if attempt >= MAX_RETRIES or not is_retryable(e):
+        return False
+    delay = backoff_delay(attempt, RETRY_BASE_DELAY, RETRY_MAX_DELAY)
+    # 截止时间之前来不及再试一次
+    if deadline.clamp(delay) < delay or not retry_budget.try_withdraw():
+        return False
+    await asyncio.sleep(delay)
+    return True
+
+
+def _failure_outcome(e: Exception, timeout: float, total_timeout: Optional[float]) -> Optional[bool]:
+    """
+    失败的尝试在熔断器中记录的结果（CircuitBreaker.release 的 success 参数）
+
+    以下情况不计入（None）：
+    - 本地准入拒绝（排队已满或排队超时）没有到达上游，
+      否则 half-open 时一次排队拒绝就会被当作探测成功而关闭熔断器
+    - 单次超时被请求截止时间收紧到路由超时以下、且截止时间已到：是调用方放弃，
+      否则截止时间很短的客户端几次调用就能让所有人的请求熔断
+
+    Args:
+        timeout: 本次尝试实际使用的超时秒数
+        total_timeout: 调用方指定的路由超时（None 为 AI_BUILDER_TOTAL_TIMEOUT）
+    """
+    if isinstance(e, UpstreamOverloaded):
+        return None
+    if isinstance(e, (httpx.TimeoutException, asyncio.TimeoutError)):
+        request_deadline = deadline.current()
+        if (
+            request_deadline is not None
+            and request_deadline.expired()
+            and timeout < (total_timeout or TOTAL_TIMEOUT)
+        ):
+            return None
+    return not is_upstream_failure(e)
+
+
+def _attempt_timeout(total_timeout: Optional[float]) -> float:
+    """
+    单次尝试的总超时（按请求截止时间收紧）
+
+    Raises:
+        asyncio.TimeoutError: 截止时间已到
+    """
+    timeout = deadline.clamp(total_timeout or TOTAL_TIMEOUT)
+    if timeout <= 0:
+        raise asyncio.TimeoutError()
+    return timeout
+
+
+async def post_json(
+    path: str,
+    payload: Dict[str, Any],
+    total_timeout: Optional[float] = None,
+    keep_raw: bool = False,
+) -> Dict[str, Any]:
+    """
+    向 AI Builder 发送 JSON POST 请求并返回解析后的响应
+
+    连接错误、429 和 502/503/504 会在重试预算允许时按 jitter 退避重试；
+    熔断器打开时直接失败。
+
+    Args:
+        path: 上游路径，例如 "/v1/search/"
+        payload: 请求体
+        total_timeout: 单次尝试的总超时秒数，默认使用 AI_BUILDER_TOTAL_TIMEOUT
+        keep_raw: 返回保留原始响应字节的 fast_json.RawJSON
+
+    Returns:
+        响应 JSON
+
+    Raises:
+        CircuitOpenError: 该路由已熔断
+        UpstreamOverloaded: 该路由的并发和等待队列均已满
+        httpx.HTTPStatusError: 上游返回非 2xx 状态码
+        httpx.TimeoutException / asyncio.TimeoutError: 超时
+        httpx.TransportError: 连接错误等
+    """
+    client = get_client()
+    breaker = _breaker(path)
+    retry_budget.deposit()
+    attempt = 0
+    while True:
+        timeout = _attempt_timeout(total_timeout)
+        probe = breaker.acquire()
+        success = None
+        try:
+            async with _limiter(path).slot(timeout):
+                # 排队后按剩余时间再收紧一次
+                timeout = deadline.clamp(timeout)
+                response = await asyncio.wait_for(client.post(path, json=payload), timeout=timeout)
+            response.raise_for_status()
+            success = True
+            if keep_raw:
+                return fast_json.loads_raw(response.content)
+            return fast_json.loads(response.content)
+        except Exception as e:
+            success = _failure_outcome(e, timeout, total_timeout)
+            if not await _should_retry(e, attempt):
+                raise
+            attempt += 1
+        finally:
+            breaker.release(probe, success)
+
+
+async def _stream(
+    path: str,
+    payload: Dict[str, Any],
+    total_timeout: Optional[float],
+    read: Callable[["httpx.Response"], AsyncIterator[Any]],
+    headers: Optional[Dict[str, str]] = None,
+) -> AsyncIterator[Any]:
+    """以流式方式发送 JSON POST 请求，产出 read(response) 的每一项"""
+    client = get_client()
+    breaker = _breaker(path)
+    loop = asyncio.get_running_loop()
+    retry_budget.deposit()
+    attempt = 0
+    while True:
+        timeout = _attempt_timeout(total_timeout)
+        probe = breaker.acquire()
+        success = None
+        started = False
+        try:
+            expires_at = loop.time() + timeout
+            async with _limiter(path).slot(timeout):
+                # 读取每一块的等待时间也不超过剩余时间
+                read_timeout = min(READ_TIMEOUT, max(expires_at - loop.time(), 0.001))
+                async with client.stream(
+                    "POST", path, json=payload, headers=headers,
+                    timeout=httpx.Timeout(CONNECT_TIMEOUT, read=read_timeout, pool=POOL_TIMEOUT)
+                ) as response:
+                    if response.is_error:
+                        await response.aread()
+                        response.raise_for_status()
+                    async for item in read(response):
+                        if loop.time() > expires_at:
+                            raise asyncio.TimeoutError()
+                        started = True
+                        yield item
+            success = True
+            return
+        except GeneratorExit:
+            # 调用方读到需要的内容后提前关闭（例如 SSE 读到 [DONE]）：已经收到数据即视为成功
+            if started:
+                success = True
+            raise
+        except Exception as e:
+            success = _failure_outcome(e, timeout, total_timeout)
+            if started or not await _should_retry(e, attempt):
+                raise
+            attempt += 1
+        finally:
+            breaker.release(probe, success)
+
+
+def stream_lines(
+    path: str,
+    payload: Dict[str, Any],
+    total_timeout: Optional[float] = None,
+) -> AsyncIterator[str]:
+    """
+    以流式方式发送 JSON POST 请求，逐行产出响应体（用于 SSE）
+
+    读取每一行时都受 read 超时约束，整个流受 total 超时约束。
+    只有在产出第一行之前的失败才会重试。
+
+    Raises:
+        与 post_json 相同
+    """
+    return _stream(path, payload, total_timeout, lambda response: response.aiter_lines())
+
+
+async def _read_raw(response: "httpx.Response") -> AsyncIterator[Any]:
+    yield response
+    async for chunk in response.aiter_raw():
+        yield chunk
+
+
+def stream_raw(
+    path: str,
+    payload: Dict[str, Any],
+    total_timeout: Optional[float] = None,
+    headers: Optional[Dict[str, str]] = None,
+) -> AsyncIterator[Any]:
+    """
+    以流式方式发送 JSON POST 请求，用于把上游响应原样转发给客户端
+
+    第一项是 httpx.Response（用于转发状态码和响应头，响应体尚未读取），
+    之后按收到的数据块产出原始响应体（不解码 Content-Encoding）。
+    超时、重试和并发限制与 stream_lines 相同：并发名额一直占用到响应体读完或迭代器关闭。
+
+    Args:
+        headers: 额外的请求头，例如客户端的 Accept-Encoding
+
+    Raises:
+        与 post_json 相同
+    """
+    return _stream(path, payload, total_timeout, _read_raw, headers)